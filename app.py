@@ -1,16 +1,25 @@
 import os
+import time
 from datetime import datetime, timedelta
 
-from flask import Flask
+# Inizio dell'avvio, per le metriche di cold start (vedere tools/startup_report.py)
+_startup_start = time.perf_counter()
+_awaiting_first_response = True
+
+from flask import Flask, g, make_response, request
 from flask_login import LoginManager
 
-from utils import users_dao
-from utils.logger import get_logger, setup_logger
+from utils import db, metrics, profiler, templates, users_dao
+from utils.idempotency import new_idempotency_key
+from utils.hold_sweeper import sweeper
+from utils.reconciler import reconciler
+from utils.logger import get_logger, log_access, setup_logger
 from utils.models import User
 
 setup_logger()
 logger = get_logger()
 
+from blueprints.admin import admin_bp
 from blueprints.auth import auth_bp
 from blueprints.main import main_bp
 from blueprints.performances import performances_bp
@@ -24,17 +33,135 @@ app.config["SECRET_KEY"] = "O*nY)jDH92t1g2K"
 app.config["REMEMBER_COOKIE_DURATION"] = timedelta(days=30)
 app.config["REMEMBER_COOKIE_SECURE"] = True
 app.config["REMEMBER_COOKIE_HTTPONLY"] = True
+# Token per gli endpoint di amministrazione (/admin/...), disabilitati se assente
+app.config["ADMIN_TOKEN"] = os.environ.get("SONOSPHERE_ADMIN_TOKEN")
+# Bytecode dei template su disco: i nuovi processi non ricompilano i template
+app.jinja_options = {**app.jinja_options, "bytecode_cache": templates.bytecode_cache()}
 
 app.register_blueprint(main_bp)
 app.register_blueprint(auth_bp)
 app.register_blueprint(performances_bp)
 app.register_blueprint(profile_bp)
 app.register_blueprint(tickets_bp)
+app.register_blueprint(admin_bp)
+
+# Secondi suggeriti al client prima di ripetere una richiesta fallita per database bloccato
+DATABASE_BUSY_RETRY_AFTER = 2
+_DATABASE_BUSY_BODY = (
+    "<!doctype html><html lang=\"it\"><head><meta charset=\"utf-8\">"
+    "<title>Sonosphere - Servizio occupato</title></head><body>"
+    "<h1>Servizio momentaneamente occupato</h1>"
+    "<p>Non è stato possibile completare l'operazione. Riprova tra qualche secondo.</p>"
+    "</body></html>"
+)
 
 login_manager = LoginManager()
 login_manager.init_app(app)
 
 
+def _reset_startup_after_fork() -> None:
+    # Nei worker creati con fork dopo il preload (wsgi.py --preload) l'avvio coincide con il fork
+    global _startup_start, _awaiting_first_response
+    _startup_start = time.perf_counter()
+    _awaiting_first_response = True
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_startup_after_fork)
+
+
+# Avvia la misurazione della richiesta e delle query eseguite per servirla
+@app.before_request
+def _start_request_timer():
+    g.request_start = time.perf_counter()
+    g.metrics_endpoint = request.endpoint or "<unmatched>"
+    metrics.HTTP_IN_FLIGHT.inc((g.metrics_endpoint,))
+    db.begin_request_stats(g.metrics_endpoint, track_statements=app.debug)
+    metrics.INSTRUMENTATION_OVERHEAD.inc(amount=time.perf_counter() - g.request_start)
+
+
+# Profila con cProfile le sole richieste che presentano un token di profilazione firmato
+@app.before_request
+def _start_request_profile():
+    profile = profiler.start_request_profile(
+        request.environ, request.args, app.config["SECRET_KEY"]
+    )
+    if profile is not None:
+        g.request_profile = profile
+
+
+
+# Registra le metriche e scrive la riga strutturata del log di accesso
+@app.after_request
+def _log_request(response):
+    hook_start = time.perf_counter()
+    duration = hook_start - g.request_start
+    stats = db.end_request_stats()
+    endpoint = g.metrics_endpoint
+    db_time = stats.time if stats else 0.0
+    db_queries = stats.count if stats else 0
+
+    metrics.HTTP_REQUESTS.inc((endpoint, request.method, str(response.status_code)))
+    metrics.HTTP_REQUEST_DURATION.observe(duration, (endpoint,))
+    metrics.DB_QUERIES_PER_REQUEST.observe(db_queries, (endpoint,))
+    metrics.DB_TIME_PER_REQUEST.observe(db_time, (endpoint,))
+
+    global _awaiting_first_response
+    if _awaiting_first_response:
+        _awaiting_first_response = False
+        startup = hook_start - _startup_start
+        metrics.STARTUP_DURATION.set(startup, ("first_response",))
+        logger.info(f"Prima risposta servita {startup * 1000:.0f} ms dopo l'avvio")
+
+    log_access(
+        method=request.method,
+        path=request.path,
+        endpoint=request.endpoint,
+        status=response.status_code,
+        duration_ms=round(duration * 1000, 3),
+        db_ms=round(db_time * 1000, 3),
+        db_queries=db_queries,
+        remote_addr=request.remote_addr,
+    )
+
+    metrics.INSTRUMENTATION_OVERHEAD.inc(amount=time.perf_counter() - hook_start)
+    return response
+
+
+# Registrato dopo _log_request perché Flask esegue gli after_request in ordine inverso:
+# il profilo si ferma prima della registrazione delle metriche
+@app.after_request
+def _finish_request_profile(response):
+    profile = g.pop("request_profile", None)
+    if profile is not None:
+        path, summary = profiler.finish_request_profile(profile, g.metrics_endpoint)
+        response.headers["X-Profile-File"] = os.path.basename(path)
+        response.headers["X-Profile-Summary"] = summary
+    return response
+
+
+# Eseguito sempre, anche se la richiesta termina con un'eccezione
+@app.teardown_request
+def _end_request(exc):
+    if "metrics_endpoint" in g:
+        metrics.HTTP_IN_FLIGHT.dec((g.metrics_endpoint,))
+        g.pop("metrics_endpoint")
+    # Se la richiesta è fallita con un'eccezione after_request non viene eseguito
+    profile = g.pop("request_profile", None)
+    if profile is not None:
+        profiler.stop_request_profile(profile)
+
+
+# Il database è rimasto bloccato anche dopo i nuovi tentativi (utils/db.py): la pagina non usa
+# il template base, che leggerebbe di nuovo l'utente dal database
+@app.errorhandler(db.DatabaseBusyError)
+def _database_busy(error):
+    response = make_response(_DATABASE_BUSY_BODY, 503)
+    response.headers["Retry-After"] = str(DATABASE_BUSY_RETRY_AFTER)
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+
 # Funzione da usare in Jinja per formattare in un modo specifico le date
 @app.template_filter("strfdate")
 def _filter_date(date, fmt=None):
@@ -51,6 +178,10 @@ def _filter_datetime(dt, fmt=None):
     return dt.strftime(fmt or "%d %B %Y %H:%M")
 
 
+# Chiavi di idempotenza dei moduli di acquisto e dell'editor delle performance
+app.add_template_global(new_idempotency_key)
+
+
 @login_manager.user_loader
 def load_user(user_id):
     db_user = users_dao.get_user_by_id(user_id)
@@ -71,5 +202,16 @@ def load_user(user_id):
     return user
 
 
+# Precompila i template all'avvio (dopo la registrazione dei filtri usati dai template)
+templates.precompile_templates(app.jinja_env)
+
+# Scadenza delle prenotazioni dei biglietti non confermate
+sweeper.start()
+# Confronto periodico dei contatori dei giorni con biglietti e prenotazioni
+reconciler.start()
+
+metrics.STARTUP_DURATION.set(time.perf_counter() - _startup_start, ("app",))
+
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", debug=True)
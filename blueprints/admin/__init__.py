@@ -0,0 +1,5 @@
+from flask import Blueprint
+
+admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
+
+from blueprints.admin import routes
\ No newline at end of file
@@ -0,0 +1,260 @@
+import hmac
+from functools import wraps
+
+from flask import Response, abort, current_app, jsonify, request
+
+from utils import admission, memory
+from utils.logger import get_logger
+from utils.metrics import render_metrics
+from utils.profiler import (
+    DEFAULT_INTERVAL,
+    MAX_DURATION,
+    MIN_INTERVAL,
+    PROFILE_HEADER,
+    PROFILE_PARAM,
+    PROFILE_TOKEN_MAX_AGE,
+    create_profile_token,
+    profiler,
+)
+from utils.waiting_room import room
+
+logger = get_logger()
+from blueprints.admin import admin_bp
+
+
+def admin_token_required(view):
+    """
+    Protegge un endpoint di amministrazione con il token configurato in ADMIN_TOKEN,
+    da inviare nell'header "Authorization: Bearer <token>".
+    Se il token non è configurato gli endpoint di amministrazione sono disabilitati.
+    """
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        token = current_app.config.get("ADMIN_TOKEN")
+        if not token:
+            abort(404)
+
+        authorization = request.headers.get("Authorization", "")
+        if not hmac.compare_digest(authorization.encode(), f"Bearer {token}".encode()):
+            logger.warning(f"Accesso non autorizzato a {request.path} da {request.remote_addr}")
+            abort(403)
+
+        return view(*args, **kwargs)
+
+    return wrapper
+
+
+@admin_bp.route("/metrics")
+@admin_token_required
+def metrics():
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+
+@admin_bp.route("/admission")
+@admin_token_required
+def admission_status():
+    # Stato del controllo di ammissione del solo processo che serve la richiesta
+    controller = admission.active_controller
+    if controller is None:
+        return jsonify(enabled=False)
+    return jsonify(enabled=True, **controller.status())
+
+
+def _waiting_room_rate():
+    try:
+        rate = float(request.args.get("rate", ""))
+    except ValueError:
+        return None
+    return rate if rate > 0 else None
+
+
+@admin_bp.route("/waiting-room")
+@admin_token_required
+def waiting_room_status():
+    return jsonify(room.status())
+
+
+@admin_bp.route("/waiting-room/open", methods=["POST"])
+@admin_token_required
+def waiting_room_open():
+    rate = _waiting_room_rate()
+    if rate is None:
+        return jsonify(error="Indicare il parametro rate (utenti ammessi al secondo, maggiore di 0)"), 400
+
+    if room.status()["open"]:
+        return jsonify(error="La sala d'attesa è già aperta: usare /admin/waiting-room/rate"), 409
+
+    room.open(rate)
+    return jsonify(room.status()), 201
+
+
+@admin_bp.route("/waiting-room/rate", methods=["POST"])
+@admin_token_required
+def waiting_room_rate():
+    rate = _waiting_room_rate()
+    if rate is None:
+        return jsonify(error="Indicare il parametro rate (utenti ammessi al secondo, maggiore di 0)"), 400
+
+    if room.set_rate(rate) is None:
+        return jsonify(error="La sala d'attesa non è aperta"), 409
+    return jsonify(room.status())
+
+
+@admin_bp.route("/waiting-room/close", methods=["POST"])
+@admin_token_required
+def waiting_room_close():
+    room.close()
+    return jsonify(room.status())
+
+
+@admin_bp.route("/profiler/start", methods=["POST"])
+@admin_token_required
+def profiler_start():
+    try:
+        duration = float(request.args.get("seconds", 10))
+        interval = float(request.args.get("interval_ms", DEFAULT_INTERVAL * 1000)) / 1000
+    except ValueError:
+        return jsonify(error="Parametri non validi"), 400
+
+    if not 0 < duration <= MAX_DURATION or interval < MIN_INTERVAL:
+        return jsonify(
+            error=f"La durata deve essere tra 0 e {MAX_DURATION} s e l'intervallo almeno {MIN_INTERVAL * 1000:g} ms"
+        ), 400
+
+    if not profiler.start(duration, interval):
+        return jsonify(error="Una sessione di profiling è già in corso", **profiler.status()), 409
+
+    return jsonify(profiler.status()), 202
+
+
+@admin_bp.route("/profiler/stop", methods=["POST"])
+@admin_token_required
+def profiler_stop():
+    profiler.stop()
+    return jsonify(profiler.status())
+
+
+@admin_bp.route("/profiler/status")
+@admin_token_required
+def profiler_status():
+    return jsonify(profiler.status())
+
+
+@admin_bp.route("/profiler/stacks")
+@admin_token_required
+def profiler_stacks():
+    # Con ?thread=waitress si limita l'output ai thread il cui nome inizia con il prefisso
+    prefix = request.args.get("thread")
+    stacks = profiler.collapsed()
+    if prefix:
+        stacks = "".join(line + "\n" for line in stacks.splitlines() if line.startswith(prefix))
+
+    response = Response(stacks, mimetype="text/plain")
+    response.headers["X-Profiler-Samples"] = str(profiler.sample_count)
+    response.headers["X-Profiler-Overhead"] = f"{profiler.overhead():.5f}"
+    return response
+
+
+@admin_bp.route("/profiler/token")
+@admin_token_required
+def profiler_token():
+    # Token da inviare in X-Profile-Token o in ?_profile= per profilare una singola richiesta
+    return jsonify(
+        token=create_profile_token(current_app.config["SECRET_KEY"]),
+        header=PROFILE_HEADER,
+        param=PROFILE_PARAM,
+        max_age=PROFILE_TOKEN_MAX_AGE,
+    )
+
+
+@admin_bp.route("/memory/tracing/start", methods=["POST"])
+@admin_token_required
+def memory_tracing_start():
+    frames = request.args.get("frames", 1, type=int)
+    if not 1 <= frames <= 64:
+        return jsonify(error="Il numero di frame deve essere tra 1 e 64"), 400
+
+    started = memory.start_tracing(frames)
+    return jsonify(tracing=True, already_running=not started)
+
+
+@admin_bp.route("/memory/tracing/stop", methods=["POST"])
+@admin_token_required
+def memory_tracing_stop():
+    memory.stop_tracing()
+    return jsonify(tracing=False)
+
+
+@admin_bp.route("/memory/snapshots")
+@admin_token_required
+def memory_snapshots():
+    return jsonify(snapshots=memory.list_snapshots())
+
+
+@admin_bp.route("/memory/snapshots/<name>", methods=["POST"])
+@admin_token_required
+def memory_snapshot(name):
+    try:
+        return jsonify(memory.take_snapshot(name)), 201
+    except RuntimeError as e:
+        return jsonify(error=str(e)), 409
+
+
+@admin_bp.route("/memory/diff")
+@admin_token_required
+def memory_diff():
+    # Senza "to" la snapshot di partenza viene confrontata con lo stato attuale
+    old_name = request.args.get("from")
+    new_name = request.args.get("to")
+    limit = request.args.get("limit", 20, type=int)
+    if not old_name:
+        return jsonify(error="Parametro from mancante"), 400
+
+    try:
+        stats = memory.compare_snapshots(old_name, new_name, limit)
+    except KeyError as e:
+        return jsonify(error=f"Snapshot {e} non trovata"), 404
+    except RuntimeError as e:
+        return jsonify(error=str(e)), 409
+
+    return jsonify(
+        old=old_name,
+        new=new_name or "<attuale>",
+        size_diff=sum(stat["size_diff"] for stat in stats),
+        stats=stats,
+    )
+
+
+@admin_bp.route("/memory/history/start", methods=["POST"])
+@admin_token_required
+def memory_history_start():
+    interval = request.args.get("interval", memory.DEFAULT_HISTORY_INTERVAL, type=float)
+    if interval < 0.1:
+        return jsonify(error="L'intervallo deve essere almeno di 0.1 s"), 400
+
+    started = memory.recorder.start(interval)
+    return jsonify(running=True, already_running=not started, interval=memory.recorder.interval)
+
+
+@admin_bp.route("/memory/history/stop", methods=["POST"])
+@admin_token_required
+def memory_history_stop():
+    memory.recorder.stop()
+    return jsonify(running=False)
+
+
+@admin_bp.route("/memory/history")
+@admin_token_required
+def memory_history():
+    limit = request.args.get("limit", type=int)
+    history = list(memory.recorder.history)
+    if limit:
+        history = history[-limit:]
+
+    return jsonify(
+        running=memory.recorder.running,
+        interval=memory.recorder.interval,
+        current={"rss": memory.rss_bytes(), "heap": memory.python_heap_bytes()},
+        history=history,
+    )
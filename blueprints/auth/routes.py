@@ -3,7 +3,7 @@ import os
 from flask import flash, redirect, render_template, request, url_for
 from flask_login import current_user, login_required, login_user, logout_user
 from werkzeug.security import check_password_hash, generate_password_hash
-from PIL import Image
+# Pillow viene importato solo dove si elaborano immagini, per non rallentare l'avvio
 
 from utils import users_dao
 from utils.models import User
@@ -106,6 +106,8 @@ def signup():
             immagine = request.files["profile_picture"]
 
             if immagine and immagine.filename:
+                from PIL import Image
+
                 os.makedirs(f"{ROOT_PATH}static/images/uploads", exist_ok=True)
                 os.makedirs(f"{ROOT_PATH}static/images/pfp", exist_ok=True)
                 img = Image.open(immagine.stream)
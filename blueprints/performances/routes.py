@@ -2,9 +2,10 @@ import os
 from datetime import datetime
 from flask import flash, redirect, render_template, request, url_for
 from flask_login import current_user, login_required
-from PIL import Image
+# Pillow viene importato solo dove si elaborano immagini, per non rallentare l'avvio
 
-from utils import event_days_dao, genres_dao, performances_dao, stages_dao, users_dao
+from utils import event_days_dao, genres_dao, performances_dao, stages_dao
+from utils.idempotency import idempotent
 from utils.vars import ROOT_PATH
 from utils.logger import get_logger
 
@@ -17,7 +18,7 @@ def detail(id: int):
     source = request.args.get("from", "main.lineup")
     source_name = request.args.get("source_name", "Lineup")
 
-    performance = performances_dao.get_performance_by_id(id)
+    performance = performances_dao.get_performance_details(id)
 
     if not performance:
         flash("Performance non trovata.", "danger")
@@ -32,20 +33,7 @@ def detail(id: int):
             flash("Questa performance non esiste", "danger")
             return redirect(url_for("main.lineup"))
 
-    stage = stages_dao.get_stage_by_id(performance["stage_id"])
-    performance["stage_name"] = stage["name"] if stage else "Sconosciuto"
-
-    day = event_days_dao.get_day_by_id(performance["day_id"])
-    performance["day_name"] = day["name"] if day else "Sconosciuto"
-    performance["day_date"] = day["date"] if day else None
-
-    genre = genres_dao.get_genre_by_id(performance["genre_id"])
-    performance["genre_name"] = genre["name"] if genre else "Sconosciuto"
-
-    organizer = users_dao.get_user_by_id(performance["organizer_id"])
-    performance["organizer_name"] = (
-        organizer["username"] if organizer else "Sconosciuto"
-    )
+    performance["organizer_name"] = performance["organizer_username"]
 
     return render_template(
         "performance-detail.html",
@@ -62,24 +50,12 @@ def management():
         flash("Non hai i permessi per accedere a questa pagina.", "danger")
         return redirect(url_for("main.home"))
 
-    performances = performances_dao.get_all_performances(include_unpublished=True)
+    performances = performances_dao.get_all_performances_with_details(
+        include_unpublished=True
+    )
 
     for performance in performances:
-        stage = stages_dao.get_stage_by_id(performance["stage_id"])
-        performance["stage_name"] = stage["name"] if stage else "Sconosciuto"
-
-        genre = genres_dao.get_genre_by_id(performance["genre_id"])
-        performance["genre_name"] = genre["name"] if genre else "Sconosciuto"
-
-        day = event_days_dao.get_day_by_id(performance["day_id"])
-        performance["day_name"] = day["name"] if day else "Sconosciuto"
-
-        organizer = users_dao.get_user_by_id(performance["organizer_id"])
-        performance["organizer_name"] = (
-            organizer["name"] + " " + organizer["surname"]
-            if organizer
-            else "Sconosciuto"
-        )
+        performance["organizer_name"] = performance["organizer_full_name"]
 
     return render_template("performance-management.html", performances=performances)
 
@@ -87,6 +63,7 @@ def management():
 @performances_bp.route("/management/<action>", methods=["GET", "POST"])
 @performances_bp.route("/management/<action>/<int:id>", methods=["GET", "POST"])
 @login_required
+@idempotent
 def editor(action, id=None):
     source = request.args.get("from", "main.lineup")
     source_name = request.args.get("source_name", "Lineup")
@@ -95,10 +72,6 @@ def editor(action, id=None):
         flash("Non hai i permessi per accedere a questa pagina.", "danger")
         return redirect(url_for("main.home"))
 
-    stages = stages_dao.get_all_stages()
-    days = event_days_dao.get_all_days()
-    genres = genres_dao.get_all_genres()
-
     if action == "edit" and id:
         performance = performances_dao.get_performance_by_id(id)
 
@@ -142,6 +115,8 @@ def editor(action, id=None):
             artist_image = request.files.get("artist_image")
 
             if artist_image and artist_image.filename:
+                from PIL import Image
+
                 os.makedirs(f"{ROOT_PATH}static/images/artists", exist_ok=True)
                 img = Image.open(artist_image.stream)
                 max_size = (800, 800)
@@ -186,9 +161,9 @@ def editor(action, id=None):
                 "performance-editor.html",
                 action="edit",
                 performance=performance,
-                stages=stages,
-                days=days,
-                genres=genres,
+                stages=stages_dao.get_all_stages(),
+                days=event_days_dao.get_all_days(),
+                genres=genres_dao.get_all_genres(),
                 source=source,
                 source_name=source_name,
             )
@@ -223,6 +198,8 @@ def editor(action, id=None):
             artist_image = request.files.get("artist_image")
 
             if artist_image and artist_image.filename:
+                from PIL import Image
+
                 os.makedirs(f"{ROOT_PATH}static/images/uploads", exist_ok=True)
                 os.makedirs(f"{ROOT_PATH}static/images/performances", exist_ok=True)
                 img = Image.open(artist_image.stream)
@@ -303,9 +280,9 @@ def editor(action, id=None):
                 "performance-editor.html",
                 action="add",
                 performance=None,
-                stages=stages,
-                days=days,
-                genres=genres,
+                stages=stages_dao.get_all_stages(),
+                days=event_days_dao.get_all_days(),
+                genres=genres_dao.get_all_genres(),
                 default_day_id=default_day_id,
                 default_stage_id=default_stage_id,
                 source=source,
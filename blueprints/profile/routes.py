@@ -2,13 +2,11 @@ import os
 from flask import flash, redirect, render_template, request, url_for
 from flask_login import current_user, login_required
 from werkzeug.security import check_password_hash, generate_password_hash
-from PIL import Image
+# Pillow viene importato solo dove si elaborano immagini, per non rallentare l'avvio
 
 from utils import (
     event_days_dao,
     performances_dao, 
-    stages_dao, 
-    ticket_types_dao, 
     tickets_dao, 
     users_dao
 )
@@ -37,25 +35,17 @@ def index():
     if current_user.role == 0:
         ticket = tickets_dao.get_ticket_by_user_id(current_user.id)
         if ticket:
-            ticket_type = ticket_types_dao.get_ticket_type_by_id(
-                ticket["ticket_type_id"]
-            )
-            ticket["ticket_type_name"] = (
-                ticket_type["name"] if ticket_type else "Biglietto"
-            )
             template_data["tickets"] = [ticket]
+            # I giorni di validità del biglietto sono mostrati per ogni giorno del festival
+            template_data["event_days"] = event_days_dao.get_all_days()
         else:
             template_data["tickets"] = []
 
     elif current_user.role == 1:
-        performances = performances_dao.get_performances_by_organizer(
-            current_user.id, include_unpublished=True
+        performances = performances_dao.get_all_performances_with_details(
+            include_unpublished=True, organizer_id=current_user.id
         )
 
-        for p in performances:
-            stage = stages_dao.get_stage_by_id(p["stage_id"])
-            p["stage_name"] = stage["name"] if stage else "Sconosciuto"
-
         template_data["performances"] = performances
 
         event_days = event_days_dao.get_all_days()
@@ -115,6 +105,8 @@ def update_picture():
     pfp = request.files["profile_picture"]
 
     if pfp and pfp.filename:
+        from PIL import Image
+
         os.makedirs(f"{ROOT_PATH}static/images/pfp", exist_ok=True)
         img = Image.open(pfp.stream)
         max_size = (500, 500)
@@ -1,33 +1,156 @@
 import os
-import qrcode
-from flask import flash, redirect, render_template, request, url_for
+import time
+from functools import wraps
+from flask import current_app, flash, jsonify, make_response, redirect, render_template, request, url_for
 from flask_login import current_user, login_required
-from qrcode.constants import ERROR_CORRECT_L
+# qrcode (e con esso Pillow) viene importato solo dopo un acquisto, per non rallentare l'avvio
 
-from utils import event_days_dao, ticket_types_dao, tickets_dao
+from utils import event_days_dao, metrics, ticket_holds_dao, ticket_types_dao, tickets_dao
+from utils.hold_sweeper import sweeper
+from utils.idempotency import idempotent
 from utils.vars import ROOT_PATH
 from utils.logger import get_logger
+from utils.waiting_room import (
+    QUEUE_COOKIE,
+    TOKEN_MAX_AGE,
+    create_queue_token,
+    read_queue_token,
+    room,
+)
 
 logger = get_logger()
 from blueprints.tickets import tickets_bp
 
+
+def _queue_ticket(state):
+    """Token di coda della richiesta, se valido per la coda aperta e per l'utente corrente"""
+
+    ticket = read_queue_token(current_app.config["SECRET_KEY"], request.cookies.get(QUEUE_COOKIE))
+    if ticket is None or ticket.epoch != state["epoch"] or ticket.user_id != current_user.id:
+        return None
+    return ticket
+
+
+def waiting_room_required(view):
+    """
+    Con la sala d'attesa aperta i partecipanti accedono all'acquisto solo quando il loro
+    numero di coda è stato ammesso, altrimenti vengono mandati alla pagina di attesa.
+    Il controllo non esegue query: lo stato della sala d'attesa è in memoria.
+    """
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        state = room.state()
+        if state is None or current_user.role != 0:
+            return view(*args, **kwargs)
+
+        ticket = _queue_ticket(state)
+        if ticket is None or not room.position(state, ticket)["admitted"]:
+            metrics.WAITING_ROOM_REQUESTS.inc(("waiting",))
+            return redirect(url_for("tickets.waiting"))
+
+        metrics.WAITING_ROOM_REQUESTS.inc(("admitted",))
+        return view(*args, **kwargs)
+
+    return wrapper
+
+
+@tickets_bp.route("/waiting")
+@login_required
+def waiting():
+    state = room.state()
+    if state is None or current_user.role != 0:
+        return redirect(url_for("tickets.index"))
+
+    ticket = _queue_ticket(state)
+    token = None
+    if ticket is None:
+        ticket = room.issue(current_user.id)
+        if ticket is None:
+            # La sala d'attesa è stata chiusa nel frattempo
+            return redirect(url_for("tickets.index"))
+        token = create_queue_token(current_app.config["SECRET_KEY"], ticket)
+
+    position = room.position(state, ticket)
+    if position["admitted"]:
+        response = redirect(url_for("tickets.index"))
+    else:
+        response = make_response(render_template("waiting-room.html", position=position))
+
+    if token:
+        response.set_cookie(
+            QUEUE_COOKIE,
+            token,
+            max_age=TOKEN_MAX_AGE,
+            path=url_for("tickets.index"),
+            httponly=True,
+            samesite="Lax",
+        )
+    return response
+
+
+@tickets_bp.route("/waiting/status")
+def waiting_status():
+    # Endpoint di polling della pagina di attesa: non carica l'utente e non esegue query,
+    # il token firmato basta a identificare il numero di coda
+    state = room.state()
+    ticket = read_queue_token(current_app.config["SECRET_KEY"], request.cookies.get(QUEUE_COOKIE))
+    if state is None or ticket is None or ticket.epoch != state["epoch"]:
+        # Sala chiusa o token non valido: la pagina di acquisto decide dove mandare l'utente
+        response = jsonify(admitted=True, next=url_for("tickets.index"))
+    else:
+        response = jsonify(next=url_for("tickets.index"), **room.position(state, ticket))
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+
+def _save_ticket_qr(ticket):
+    """Genera il QR code del biglietto in static/images/tickets/<id>.webp"""
+
+    import qrcode
+    from qrcode.constants import ERROR_CORRECT_L
+
+    qr = qrcode.QRCode(
+        error_correction=ERROR_CORRECT_L,
+        box_size=10,
+        border=4,
+    )
+    qr.add_data(str(ticket))
+    qr.make(fit=True)
+    img = qr.make_image(fill_color="black", back_color="white")
+    os.makedirs(f"{ROOT_PATH}static/images/tickets", exist_ok=True)
+
+    pil_img = img.get_image()
+    if pil_img.mode != "RGBA":
+        pil_img = pil_img.convert("RGBA")
+
+    img_path = f"{ROOT_PATH}static/images/tickets/{ticket['id']}.webp"
+    pil_img.save(img_path, "WEBP", quality=90, method=6)
+
+
 @tickets_bp.route("/")
 @login_required
+@waiting_room_required
 def index():
     ticket = None
+    hold = None
     if current_user.is_authenticated and current_user.role == 0:
         ticket = tickets_dao.get_ticket_by_user_id(current_user.id)
+        if not ticket:
+            hold = ticket_holds_dao.get_hold_by_user_id(current_user.id)
 
     ticket_types = ticket_types_dao.get_all_ticket_types()
     event_days = event_days_dao.get_all_days()
 
     return render_template(
-        "tickets.html", ticket=ticket, ticket_types=ticket_types, event_days=event_days
+        "tickets.html", ticket=ticket, hold=hold, ticket_types=ticket_types, event_days=event_days
     )
 
 
 @tickets_bp.route("/buy", methods=["POST"])
 @login_required
+@waiting_room_required
+@idempotent
 def buy():
     if current_user.role != 0:
         flash("Solo i partecipanti possono acquistare biglietti", "danger")
@@ -45,47 +168,78 @@ def buy():
         flash("Seleziona un tipo di biglietto e i giorni", "danger")
         return redirect(url_for("tickets.index"))
 
-    ticket_type_id = int(ticket_type_id)
-    days = [int(day) for day in days]
+    try:
+        ticket_type_id = int(ticket_type_id)
+        days = [int(day) for day in days]
+    except ValueError:
+        flash("Tipo di biglietto o giorni non validi", "danger")
+        return redirect(url_for("tickets.index"))
 
     ticket_type = ticket_types_dao.get_ticket_type_by_id(ticket_type_id)
     if not ticket_type:
         flash("Tipo di biglietto non valido", "danger")
         return redirect(url_for("tickets.index"))
 
-    if len(days) != ticket_type["days_count"]:
+    # I giorni ripetuti non contano: create_hold prenota ogni giorno una sola volta
+    if len(days) != len(set(days)) or len(days) != ticket_type["days_count"]:
         flash(
             "Numero di giorni non valido per il tipo di biglietto selezionato", "danger"
         )
         return redirect(url_for("tickets.index"))
 
-    success, ticket = tickets_dao.create_ticket(current_user.id, ticket_type_id, days)
+    # I posti vengono prenotati per HOLD_TTL secondi, il biglietto viene creato alla conferma
+    success, hold = ticket_holds_dao.create_hold(current_user.id, ticket_type_id, days)
 
-    if success and ticket:
-        flash(f"Biglietto {ticket_type['name']} acquistato con successo!", "success")
+    if success and hold:
+        sweeper.schedule(hold["id"], hold["expires_at"])
+        return redirect(url_for("tickets.confirm"))
 
-        qr = qrcode.QRCode(
-            error_correction=ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(str(ticket))
-        qr.make(fit=True)
-        img = qr.make_image(fill_color="black", back_color="white")
-        os.makedirs(f"{ROOT_PATH}static/images/tickets", exist_ok=True)
+    flash(
+        "Non è stato possibile prenotare il biglietto. Alcuni giorni potrebbero essere esauriti.",
+        "danger",
+    )
+    return redirect(url_for("tickets.index"))
 
-        pil_img = img.get_image()
-        if pil_img.mode != "RGBA":
-            pil_img = pil_img.convert("RGBA")
 
-        img_path = f"{ROOT_PATH}static/images/tickets/{ticket['id']}.webp"
-        pil_img.save(img_path, "WEBP", quality=90, method=6)
+@tickets_bp.route("/confirm", methods=["GET", "POST"])
+@login_required
+@waiting_room_required
+@idempotent
+def confirm():
+    hold = ticket_holds_dao.get_hold_by_user_id(current_user.id)
+    if not hold:
+        flash("La prenotazione è scaduta o non esiste, scegli di nuovo il biglietto", "warning")
+        return redirect(url_for("tickets.index"))
+
+    if request.method == "GET":
+        event_days = event_days_dao.get_all_days()
+        return render_template(
+            "ticket-confirm.html",
+            hold=hold,
+            days=[day for day in event_days if day["id"] in hold["days"]],
+            remaining=max(0, int(hold["expires_at"] - time.time())),
+        )
 
+    success, ticket = ticket_holds_dao.convert_hold(current_user.id)
+
+    if success and ticket:
+        sweeper.cancel(hold["id"])
+        flash(f"Biglietto {hold['ticket_type_name']} acquistato con successo!", "success")
+        _save_ticket_qr(ticket)
         return redirect(url_for("profile.index"))
 
-    else:
-        flash(
-            "Si è verificato un errore durante l'acquisto del biglietto. Alcuni giorni potrebbero essere esauriti.",
-            "danger",
-        )
-        return redirect(url_for("tickets.index"))
+    flash(
+        "Si è verificato un errore durante l'acquisto del biglietto. La prenotazione potrebbe essere scaduta.",
+        "danger",
+    )
+    return redirect(url_for("tickets.index"))
+
+
+@tickets_bp.route("/release", methods=["POST"])
+@login_required
+def release():
+    hold = ticket_holds_dao.get_hold_by_user_id(current_user.id)
+    if hold and ticket_holds_dao.release_hold(current_user.id):
+        sweeper.cancel(hold["id"])
+        flash("Prenotazione annullata", "info")
+    return redirect(url_for("tickets.index"))
@@ -1,8 +1,12 @@
+import argparse
+import hashlib
 import os
+import random
 import sqlite3
 import sys
-from datetime import datetime
-from werkzeug.security import generate_password_hash
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from werkzeug.security import SALT_CHARS, generate_password_hash
 
 from utils.vars import DB_PATH, ROOT_PATH
 
@@ -17,6 +21,7 @@ table_schemas = [
         "max_attendees" INTEGER NOT NULL DEFAULT 200,
         "start_time" TEXT NOT NULL,
         "end_time" TEXT NOT NULL,
+        "held_attendees" INTEGER NOT NULL DEFAULT 0,
         PRIMARY KEY("id" AUTOINCREMENT)
     )
     """,
@@ -89,14 +94,88 @@ table_schemas = [
         "ticket_type_id" INTEGER NOT NULL,
         "purchase_date" TEXT DEFAULT CURRENT_TIMESTAMP,
         "is_valid" INTEGER DEFAULT 1,
-        "friday" INTEGER DEFAULT 0,
-        "saturday" INTEGER DEFAULT 0,
-        "sunday" INTEGER DEFAULT 0,
+        "days" INTEGER NOT NULL DEFAULT 0,
         PRIMARY KEY("id" AUTOINCREMENT),
         FOREIGN KEY("user_id") REFERENCES "users"("id"),
         FOREIGN KEY("ticket_type_id") REFERENCES "ticket_types"("id")
     )
     """,
+    """
+    CREATE TABLE IF NOT EXISTS "ticket_holds" (
+        "id" INTEGER NOT NULL UNIQUE,
+        "user_id" INTEGER NOT NULL UNIQUE,
+        "ticket_type_id" INTEGER NOT NULL,
+        "days" INTEGER NOT NULL DEFAULT 0,
+        "created_at" TEXT DEFAULT CURRENT_TIMESTAMP,
+        "expires_at" REAL NOT NULL,
+        PRIMARY KEY("id" AUTOINCREMENT),
+        FOREIGN KEY("user_id") REFERENCES "users"("id"),
+        FOREIGN KEY("ticket_type_id") REFERENCES "ticket_types"("id")
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS "waiting_room" (
+        "id" INTEGER NOT NULL UNIQUE CHECK ("id" = 1),
+        "is_open" INTEGER NOT NULL DEFAULT 0,
+        "epoch" INTEGER NOT NULL DEFAULT 0,
+        "rate" REAL NOT NULL DEFAULT 1,
+        "next_serial" INTEGER NOT NULL DEFAULT 1,
+        "base_serial" INTEGER NOT NULL DEFAULT 0,
+        "base_time" REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY("id")
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS "idempotency_keys" (
+        "key" TEXT NOT NULL,
+        "user_id" INTEGER NOT NULL,
+        "endpoint" TEXT NOT NULL,
+        "status" INTEGER,
+        "location" TEXT,
+        "body" TEXT,
+        "flashes" TEXT,
+        "created_at" REAL NOT NULL,
+        "expires_at" REAL NOT NULL,
+        PRIMARY KEY("key"),
+        FOREIGN KEY("user_id") REFERENCES "users"("id")
+    )
+    """,
+]
+
+# Indici usati dalle query dei DAO (verificati con tools/explain_audit.py)
+index_schemas = [
+    """
+    CREATE UNIQUE INDEX IF NOT EXISTS "idx_tickets_user_id"
+    ON "tickets" ("user_id")
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS "idx_tickets_days"
+    ON "tickets" ("days")
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS "idx_ticket_holds_expires_at"
+    ON "ticket_holds" ("expires_at")
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS "idx_idempotency_keys_expires_at"
+    ON "idempotency_keys" ("expires_at")
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS "idx_performances_organizer"
+    ON "performances" ("organizer_id", "day_id", "start_time")
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS "idx_performances_slot"
+    ON "performances" ("day_id", "stage_id")
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS "idx_performances_artist_name"
+    ON "performances" ("artist_name")
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS "idx_performances_featured"
+    ON "performances" ("day_id", "start_time") WHERE "is_featured" = 1 AND "is_published" = 1
+    """,
 ]
 
 table_names = [
@@ -107,6 +186,9 @@ table_names = [
     "performances",
     "ticket_types",
     "tickets",
+    "ticket_holds",
+    "waiting_room",
+    "idempotency_keys",
 ]
 
 default_users = [
@@ -169,10 +251,11 @@ default_users = [
     ),
 ]
 
+# I partecipanti iniziali corrispondono ai giorni dei biglietti in default_tickets
 default_days = [
-    ("Venerdì", "2025-06-20", 0, 200, "14:00", "24:00"),
-    ("Sabato", "2025-06-21", 0, 200, "14:00", "24:00"),
-    ("Domenica", "2025-06-22", 0, 200, "14:00", "24:00"),
+    ("Venerdì", "2025-06-20", 2, 200, "14:00", "24:00"),
+    ("Sabato", "2025-06-21", 4, 200, "14:00", "24:00"),
+    ("Domenica", "2025-06-22", 2, 200, "14:00", "24:00"),
 ]
 
 default_stages = [
@@ -473,11 +556,12 @@ default_performances = [
     ),
 ]
 
+# L'ultimo campo è la maschera dei giorni: bit 0 venerdì, bit 1 sabato, bit 2 domenica
 default_tickets = [
-    (1, 5, 3, "2025-06-10 21:55:08", 1, 1, 1, 1),
-    (2, 6, 1, "2025-06-10 21:55:50", 1, 0, 1, 0),
-    (3, 8, 2, "2025-06-10 21:57:06", 1, 1, 1, 0),
-    (4, 9, 2, "2025-06-10 21:57:37", 1, 0, 1, 1),
+    (1, 5, 3, "2025-06-10 21:55:08", 1, 0b111),
+    (2, 6, 1, "2025-06-10 21:55:50", 1, 0b010),
+    (3, 8, 2, "2025-06-10 21:57:06", 1, 0b011),
+    (4, 9, 2, "2025-06-10 21:57:37", 1, 0b110),
 ]
 
 
@@ -492,6 +576,65 @@ def check_db_exists():
     return os.path.exists(ROOT_PATH + DB_PATH)
 
 
+# Colonne aggiunte a tabelle già esistenti: (tabella, colonna, definizione)
+added_columns = (("event_days", "held_attendees", "INTEGER NOT NULL DEFAULT 0"),)
+
+
+def migrate_added_columns(cursor):
+    """
+    Aggiunge alle tabelle esistenti le colonne introdotte dopo la loro creazione.
+    Le colonne già presenti vengono saltate.
+
+    Returns:
+        list: Colonne aggiunte, come "tabella.colonna"
+    """
+    added = []
+    for table, column, definition in added_columns:
+        columns = {row[1] for row in cursor.execute(f'PRAGMA table_info("{table}")')}
+        if column in columns:
+            continue
+
+        cursor.execute(f'ALTER TABLE "{table}" ADD COLUMN "{column}" {definition}')
+        added.append(f"{table}.{column}")
+
+    return added
+
+
+# Colonne dei giorni usate prima della maschera "days", con il bit corrispondente
+legacy_day_columns = (("friday", 0), ("saturday", 1), ("sunday", 2))
+
+
+def migrate_ticket_days(cursor):
+    """
+    Converte le colonne friday, saturday e sunday di tickets e ticket_holds nella
+    maschera di bit "days" e le elimina. Le tabelle già migrate vengono saltate.
+
+    Returns:
+        list: Nomi delle tabelle migrate
+    """
+    migrated = []
+    for table in ("tickets", "ticket_holds"):
+        columns = {row[1] for row in cursor.execute(f'PRAGMA table_info("{table}")')}
+        if "friday" not in columns:
+            continue
+
+        # Gli operatori bit a bit di SQLite hanno tutti la stessa precedenza: ogni termine va tra parentesi
+        mask = " + ".join(f'(("{column}" != 0) << {bit})' for column, bit in legacy_day_columns)
+        cursor.execute("BEGIN")
+        try:
+            cursor.execute(f'ALTER TABLE "{table}" ADD COLUMN "days" INTEGER NOT NULL DEFAULT 0')
+            cursor.execute(f'UPDATE "{table}" SET "days" = {mask}')
+            for column, _ in legacy_day_columns:
+                cursor.execute(f'ALTER TABLE "{table}" DROP COLUMN "{column}"')
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+        migrated.append(table)
+
+    return migrated
+
+
 def create_database_structure():
     """
     Crea la struttura del database come definita nel README
@@ -509,15 +652,44 @@ def create_database_structure():
         except Exception as e:
             print(f"Errore durante la creazione della tabella: {e}")
 
+    # Un database creato con una versione precedente dello schema va migrato prima degli indici
+    migrated = True
+    try:
+        for column in migrate_added_columns(cursor):
+            print(f"Colonna {column} aggiunta")
+    except Exception as e:
+        print(f"Errore durante l'aggiunta delle colonne: {e}")
+        migrated = False
+
+    try:
+        for table in migrate_ticket_days(cursor):
+            print(f"Tabella {table} migrata alla maschera dei giorni")
+    except Exception as e:
+        print(f"Errore durante la migrazione dei giorni dei biglietti: {e}")
+        migrated = False
+
+    indexes_created = 0
+    for schema in index_schemas:
+        try:
+            cursor.execute(schema)
+            indexes_created += 1
+        except Exception as e:
+            print(f"Errore durante la creazione dell'indice: {e}")
+
     conn.commit()
     cursor.close()
     conn.close()
 
-    if tables_created == len(table_schemas):
-        print("Tutte le tabelle create con successo")
+    if not migrated:
+        print("La migrazione della struttura esistente non è riuscita")
+        return False
+    elif tables_created == len(table_schemas) and indexes_created == len(index_schemas):
+        print("Tutte le tabelle e gli indici creati con successo")
         return True
     else:
-        print(f"Create {tables_created}/{len(table_schemas)} tabelle")
+        print(
+            f"Create {tables_created}/{len(table_schemas)} tabelle e {indexes_created}/{len(index_schemas)} indici"
+        )
         return False
 
 
@@ -646,10 +818,17 @@ def initialize_default_users():
     success = True
 
     try:
-        for user in default_users:
-            username, name, surname, email, plain_password, pfp, role = user
+        # scrypt è volutamente lento: gli hash vengono calcolati in parallelo
+        with ThreadPoolExecutor() as executor:
+            password_hashes = list(
+                executor.map(
+                    lambda user: generate_password_hash(user[4], method="scrypt"),
+                    default_users,
+                )
+            )
 
-            password_hash = generate_password_hash(plain_password, method="scrypt")
+        for user, password_hash in zip(default_users, password_hashes):
+            username, name, surname, email, plain_password, pfp, role = user
 
             cursor.execute(
                 insert_query,
@@ -745,9 +924,8 @@ def initialize_default_tickets():
             # Inserisci i biglietti
             cursor.executemany(
                 """INSERT INTO tickets 
-                (id, user_id, ticket_type_id, purchase_date, is_valid, 
-                friday, saturday, sunday) 
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                (id, user_id, ticket_type_id, purchase_date, is_valid, days)
+                VALUES (?, ?, ?, ?, ?, ?)""",
                 default_tickets
             )
             print("Biglietti inizializzati con successo")
@@ -765,6 +943,294 @@ def initialize_default_tickets():
     return success
 
 
+# Password di tutti gli utenti generati, utile per gli strumenti che effettuano il login
+SYNTHETIC_PASSWORD = "Password2025!"
+# Durata delle performance generate in minuti: 20 slot per palco tra le 14:00 e le 24:00
+SYNTHETIC_SLOT_MINUTES = 30
+
+synthetic_first_names = [
+    "Alessandro", "Giulia", "Francesco", "Sofia", "Lorenzo", "Aurora", "Matteo",
+    "Ginevra", "Leonardo", "Alice", "Gabriele", "Emma", "Riccardo", "Giorgia",
+    "Tommaso", "Beatrice", "Edoardo", "Chiara", "Davide", "Martina",
+]
+synthetic_surnames = [
+    "Rossi", "Russo", "Ferrari", "Esposito", "Bianchi", "Romano", "Colombo",
+    "Ricci", "Marino", "Greco", "Bruno", "Gallo", "Conti", "De Luca", "Costa",
+    "Giordano", "Mancini", "Rizzo", "Lombardi", "Moretti",
+]
+synthetic_artist_words = (
+    ["Neon", "Velvet", "Lunar", "Electric", "Silent", "Golden", "Crimson", "Static", "Wild", "Hollow"],
+    ["Echo", "Tide", "Parade", "Machine", "Garden", "Riot", "Orbit", "Signal", "Bloom", "Waves"],
+)
+# Combinazioni di giorni (venerdì, sabato, domenica) per numero di giorni del biglietto
+synthetic_ticket_days = {
+    1: [0b001, 0b010, 0b100],
+    2: [0b011, 0b110],
+    3: [0b111],
+}
+
+
+def _synthetic_salt(rng):
+    """Estrae da rng un sale di 16 caratteri come quelli di generate_password_hash"""
+
+    return "".join(rng.choice(SALT_CHARS) for _ in range(16))
+
+
+def _synthetic_password_hash(password, salt):
+    """
+    Calcola un hash scrypt nello stesso formato di generate_password_hash
+    ("scrypt:32768:8:1$<sale>$<hash>", verificabile con check_password_hash), ma con un
+    sale dato: estratto dal generatore casuale della generazione, a parità di seme l'hash
+    è identico. Da usare solo per i dati generati, mai per password reali.
+
+    Parameters:
+        password (str): La password in chiaro
+        salt (str): Il sale (vedi _synthetic_salt)
+
+    Returns:
+        str: L'hash della password
+    """
+
+    n, r, p = 2**15, 8, 1
+    digest = hashlib.scrypt(
+        password.encode(), salt=salt.encode(), n=n, r=r, p=p, maxmem=132 * n * r * p
+    ).hex()
+    return f"scrypt:{n}:{r}:{p}${salt}${digest}"
+
+
+def generate_synthetic_data(db_path, performances=0, users=0, tickets=0, seed=0):
+    """
+    Crea un database con la struttura e i dati predefiniti, a cui aggiunge performance,
+    utenti partecipanti e biglietti generati. A parità di seme il risultato è identico.
+
+    Le performance generate occupano slot di SYNTHETIC_SLOT_MINUTES minuti su palchi
+    dedicati ("Palco N"), quindi non si sovrappongono tra loro né a quelle predefinite.
+    Gli utenti si chiamano utente0000000, utente0000001, ... con password
+    SYNTHETIC_PASSWORD, e i biglietti sono assegnati ai primi utenti generati.
+    Il numero di partecipanti di ogni giorno è ricalcolato dai biglietti presenti.
+
+    Parameters:
+        db_path (str): Percorso del database da creare (viene sovrascritto)
+        performances (int): Numero di performance da generare
+        users (int): Numero di utenti partecipanti da generare
+        tickets (int): Numero di biglietti da generare (al massimo uno per utente)
+        seed (int): Seme del generatore casuale
+
+    Returns:
+        dict: Numero di righe per tabella nel database creato
+    """
+    rng = random.Random(seed)
+
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+
+    # Il caricamento avviene in un'unica transazione senza journal né fsync:
+    # se si interrompe, il database va semplicemente rigenerato
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA journal_mode = OFF")
+    cursor.execute("PRAGMA synchronous = OFF")
+    cursor.execute("PRAGMA temp_store = MEMORY")
+    cursor.execute("PRAGMA cache_size = -65536")
+
+    try:
+        cursor.execute("BEGIN")
+
+        for schema in table_schemas:
+            cursor.execute(schema)
+
+        cursor.executemany(
+            "INSERT INTO event_days (name, date, current_attendees, max_attendees, start_time, end_time) VALUES (?, ?, ?, ?, ?, ?)",
+            default_days,
+        )
+        cursor.executemany(
+            "INSERT INTO stages (name, description, image) VALUES (?, ?, ?)",
+            default_stages,
+        )
+        cursor.executemany(
+            "INSERT INTO genres (name) VALUES (?)",
+            [(genre,) for genre in default_genres],
+        )
+        cursor.executemany(
+            "INSERT INTO ticket_types (name, description, price, days_count) VALUES (?, ?, ?, ?)",
+            default_ticket_types,
+        )
+
+        # I sali vengono estratti in ordine prima di calcolare gli hash in parallelo
+        salts = [_synthetic_salt(rng) for _ in default_users]
+        with ThreadPoolExecutor() as executor:
+            password_hashes = list(
+                executor.map(
+                    lambda user, salt: _synthetic_password_hash(user[4], salt),
+                    default_users,
+                    salts,
+                )
+            )
+        cursor.executemany(
+            "INSERT INTO users (username, name, surname, email, password, pfp, role) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                (username.lower(), name, surname, email.lower(), password_hash, pfp, role)
+                for (username, name, surname, email, _, pfp, role), password_hash in zip(
+                    default_users, password_hashes
+                )
+            ],
+        )
+        cursor.executemany(
+            """INSERT INTO performances
+            (id, artist_name, start_time, duration, description, image_path,
+            day_id, stage_id, genre_id, organizer_id, is_published,
+            created_at, updated_at, is_featured)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            default_performances,
+        )
+        cursor.executemany(
+            """INSERT INTO tickets
+            (id, user_id, ticket_type_id, purchase_date, is_valid, days)
+            VALUES (?, ?, ?, ?, ?, ?)""",
+            default_tickets,
+        )
+
+        _generate_performances(cursor, rng, performances)
+        _generate_users_and_tickets(cursor, rng, users, tickets)
+
+        # Allinea i contatori dei partecipanti ai biglietti presenti; la capienza viene portata
+        # almeno al numero di biglietti, così resta spazio per nuovi acquisti
+        cursor.execute(
+            """UPDATE event_days SET current_attendees = (
+                SELECT COUNT(*) FROM tickets WHERE days & (1 << (event_days.id - 1))
+            )"""
+        )
+        cursor.execute(
+            "UPDATE event_days SET max_attendees = MAX(max_attendees, (SELECT COUNT(*) FROM tickets))"
+        )
+
+        # Gli indici vengono creati a fine caricamento: costa meno che aggiornarli ad ogni riga
+        for schema in index_schemas:
+            cursor.execute(schema)
+
+        cursor.execute("COMMIT")
+    except Exception:
+        cursor.execute("ROLLBACK")
+        raise
+
+    cursor.execute("ANALYZE")
+    cursor.execute("PRAGMA journal_mode = DELETE")
+
+    counts = {}
+    for table in ("event_days", "stages", "genres", "ticket_types", "users", "performances", "tickets"):
+        cursor.execute(f"SELECT COUNT(*) FROM {table}")
+        counts[table] = cursor.fetchone()[0]
+
+    cursor.close()
+    conn.close()
+
+    return counts
+
+
+def _generate_performances(cursor, rng, count):
+    if count <= 0:
+        return
+
+    cursor.execute("SELECT id FROM users WHERE role = 1")
+    organizers = [row[0] for row in cursor.fetchall()]
+    cursor.execute("SELECT COUNT(*) FROM stages")
+    stages_count = cursor.fetchone()[0]
+
+    slots_per_stage = (24 - 14) * 60 // SYNTHETIC_SLOT_MINUTES
+    slots_per_stage_all_days = len(default_days) * slots_per_stage
+    needed_stages = -(-count // slots_per_stage_all_days)
+    cursor.executemany(
+        "INSERT INTO stages (name, description, image) VALUES (?, ?, ?)",
+        [
+            (f"Palco {i}", "Palco generato per i test di scala", "images/assets/main_stage.webp")
+            for i in range(1, needed_stages + 1)
+        ],
+    )
+
+    first, second = synthetic_artist_words
+    created_base = datetime(2025, 3, 1)
+
+    def rows():
+        for i in range(count):
+            stage_index, rest = divmod(i, slots_per_stage_all_days)
+            day_index, slot = divmod(rest, slots_per_stage)
+            start_minutes = 14 * 60 + slot * SYNTHETIC_SLOT_MINUTES
+            created_at = (created_base + timedelta(seconds=rng.randrange(90 * 86400))).strftime(
+                "%Y-%m-%d %H:%M:%S"
+            )
+            yield (
+                # Il numero progressivo garantisce l'unicità del nome dell'artista
+                f"{rng.choice(first)} {rng.choice(second)} {i + 1}",
+                f"{start_minutes // 60:02d}:{start_minutes % 60:02d}",
+                SYNTHETIC_SLOT_MINUTES,
+                "Performance generata per i test di scala",
+                "",
+                day_index + 1,
+                stages_count + stage_index + 1,
+                rng.randint(1, len(default_genres)),
+                rng.choice(organizers),
+                1 if rng.random() < 0.8 else 0,
+                created_at,
+                created_at,
+                1 if rng.random() < 0.05 else 0,
+            )
+
+    cursor.executemany(
+        """INSERT INTO performances
+        (artist_name, start_time, duration, description, image_path,
+        day_id, stage_id, genre_id, organizer_id, is_published,
+        created_at, updated_at, is_featured)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+        rows(),
+    )
+
+
+def _generate_users_and_tickets(cursor, rng, users, tickets):
+    if users <= 0:
+        return
+
+    # Un solo hash condiviso: calcolare scrypt per ogni utente renderebbe la generazione lentissima
+    password_hash = _synthetic_password_hash(SYNTHETIC_PASSWORD, _synthetic_salt(rng))
+
+    cursor.execute("SELECT COALESCE(MAX(id), 0) FROM users")
+    first_id = cursor.fetchone()[0] + 1
+
+    cursor.executemany(
+        "INSERT INTO users (id, username, name, surname, email, password, pfp, role) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            (
+                first_id + i,
+                f"utente{i:07d}",
+                rng.choice(synthetic_first_names),
+                rng.choice(synthetic_surnames),
+                f"utente{i:07d}@example.com",
+                password_hash,
+                "",
+                0,
+            )
+            for i in range(users)
+        ),
+    )
+
+    purchase_base = datetime(2025, 3, 1)
+
+    def rows():
+        for i in range(min(tickets, users)):
+            ticket_type_id = rng.randint(1, len(default_ticket_types))
+            days_count = default_ticket_types[ticket_type_id - 1][3]
+            purchase_date = (purchase_base + timedelta(seconds=rng.randrange(100 * 86400))).strftime(
+                "%Y-%m-%d %H:%M:%S"
+            )
+            yield (first_id + i, ticket_type_id, purchase_date, rng.choice(synthetic_ticket_days[days_count]))
+
+    cursor.executemany(
+        """INSERT INTO tickets (user_id, ticket_type_id, purchase_date, days)
+        VALUES (?, ?, ?, ?)""",
+        rows(),
+    )
+
+
 def drop_tables():
     """
     Elimina tutte le tabelle del database
@@ -1105,7 +1571,111 @@ def main():
         input("\nPremi INVIO per continuare...")
 
 
+def generate_command(argv):
+    """
+    Sottocomando non interattivo "generate": crea un database con dati generati
+    per i test di scala.
+    """
+    parser = argparse.ArgumentParser(
+        prog="initialize_db.py generate",
+        description="Genera un database con performance, utenti e biglietti sintetici",
+    )
+    parser.add_argument("--performances", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--tickets", type=int, default=None, help="predefinito: metà degli utenti")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--db", default=ROOT_PATH + DB_PATH, help="database da creare")
+    parser.add_argument("--force", action="store_true", help="sovrascrive un database esistente")
+    args = parser.parse_args(argv)
+
+    if os.path.exists(args.db) and not args.force:
+        print(f"Il database {args.db} esiste già: usare --force per sovrascriverlo.")
+        return 1
+
+    tickets = args.users // 2 if args.tickets is None else args.tickets
+    if tickets > args.users:
+        print("Il numero di biglietti non può superare il numero di utenti generati.")
+        return 1
+
+    start = datetime.now()
+    counts = generate_synthetic_data(args.db, args.performances, args.users, tickets, args.seed)
+    elapsed = (datetime.now() - start).total_seconds()
+
+    print(f"Database {args.db} generato in {elapsed:.1f} secondi (seme {args.seed}):")
+    for table, count in counts.items():
+        print(f"{table.ljust(15)}: {count} record")
+    return 0
+
+
+def migrate_command(argv):
+    """
+    Sottocomando non interattivo "migrate": porta la struttura del database dell'applicazione
+    (SONOSPHERE_DB_PATH) a quella attuale. Crea le tabelle e gli indici mancanti, aggiunge
+    le colonne introdotte in seguito (added_columns, es. held_attendees di event_days) e
+    converte le colonne friday, saturday e sunday di tickets e ticket_holds nella maschera
+    "days". Termina con codice 1 se uno di questi passi non riesce.
+    """
+    parser = argparse.ArgumentParser(
+        prog="initialize_db.py migrate",
+        description="Aggiorna la struttura di un database esistente",
+    )
+    parser.parse_args(argv)
+
+    if not check_db_exists():
+        print(f"Il database {ROOT_PATH + DB_PATH} non esiste.")
+        return 1
+
+    return 0 if create_database_structure() else 1
+
+
+def reconcile_command(argv):
+    """
+    Sottocomando non interattivo "reconcile": confronta i contatori dei giorni con i
+    biglietti e le prenotazioni presenti nel database dell'applicazione (SONOSPHERE_DB_PATH)
+    e con --fix li corregge. Termina con codice 1 se restano differenze.
+    """
+    parser = argparse.ArgumentParser(
+        prog="initialize_db.py reconcile",
+        description="Verifica ed eventualmente corregge i contatori dei partecipanti dei giorni",
+    )
+    parser.add_argument("--fix", action="store_true", help="corregge i contatori non allineati")
+    args = parser.parse_args(argv)
+
+    if not check_db_exists():
+        print(f"Il database {ROOT_PATH + DB_PATH} non esiste.")
+        return 1
+
+    from utils.reconciler import reconcile_attendees
+
+    start = datetime.now()
+    drifted = reconcile_attendees(fix=args.fix)
+    elapsed = (datetime.now() - start).total_seconds() * 1000
+
+    if not drifted:
+        print(f"Contatori allineati ({elapsed:.1f} ms).")
+        return 0
+
+    for day in drifted:
+        print(
+            f"{day['name'].ljust(15)}: partecipanti {day['current_attendees']} (reali {day['actual_attendees']}), "
+            f"prenotati {day['held_attendees']} (reali {day['actual_held']})"
+        )
+    if args.fix:
+        print(f"Corretti {len(drifted)} giorni ({elapsed:.1f} ms).")
+        return 0
+
+    print(f"{len(drifted)} giorni non allineati ({elapsed:.1f} ms): usare --fix per correggerli.")
+    return 1
+
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "generate":
+        sys.exit(generate_command(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == "migrate":
+        sys.exit(migrate_command(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == "reconcile":
+        sys.exit(reconcile_command(sys.argv[2:]))
+
     try:
         main()
     except KeyboardInterrupt:
@@ -0,0 +1,22 @@
+document.addEventListener('DOMContentLoaded', function () {
+    const holdTimer = document.getElementById('holdTimer');
+    const holdRemaining = document.getElementById('holdRemaining');
+    const confirmButton = document.getElementById('confirmButton');
+    const expiresAt = Date.now() + parseInt(holdTimer.dataset.remaining) * 1000;
+
+    function updateTimer() {
+        const remaining = Math.max(0, Math.round((expiresAt - Date.now()) / 1000));
+        const seconds = remaining % 60;
+        holdRemaining.textContent = Math.floor(remaining / 60) + ':' + (seconds < 10 ? '0' : '') + seconds;
+
+        if (remaining === 0) {
+            holdTimer.classList.replace('alert-warning', 'alert-danger');
+            holdTimer.textContent = 'La prenotazione è scaduta: torna alla pagina dei biglietti per sceglierne uno nuovo.';
+            confirmButton.disabled = true;
+            return;
+        }
+        setTimeout(updateTimer, 1000);
+    }
+
+    updateTimer();
+});
@@ -0,0 +1,37 @@
+document.addEventListener('DOMContentLoaded', function () {
+    const waitingRoom = document.getElementById('waitingRoom');
+    const queueAhead = document.getElementById('queueAhead');
+    const queueWait = document.getElementById('queueWait');
+    const statusUrl = waitingRoom.dataset.statusUrl;
+
+    // Un ritardo casuale evita che gli utenti arrivati insieme interroghino il server insieme
+    function schedule(seconds) {
+        const delay = seconds * 1000 * (0.75 + Math.random() * 0.5);
+        setTimeout(checkStatus, delay);
+    }
+
+    function checkStatus() {
+        fetch(statusUrl, { credentials: 'same-origin', cache: 'no-store' })
+            .then(function (response) {
+                if (!response.ok) {
+                    throw new Error('HTTP ' + response.status);
+                }
+                return response.json();
+            })
+            .then(function (status) {
+                if (status.admitted) {
+                    window.location.href = status.next;
+                    return;
+                }
+                queueAhead.textContent = status.ahead;
+                queueWait.textContent = status.wait;
+                schedule(status.poll);
+            })
+            .catch(function () {
+                // Server sovraccarico o connessione assente: si riprova più tardi
+                schedule(parseInt(waitingRoom.dataset.poll) * 2);
+            });
+    }
+
+    schedule(parseInt(waitingRoom.dataset.poll));
+});
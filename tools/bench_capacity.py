@@ -0,0 +1,366 @@
+"""
+Confronto tra il contatore di capienza su una riga di event_days e i contatori a strisce.
+
+Con il contatore su una riga ogni acquisto incrementa current_attendees del giorno con un
+UPDATE condizionale, come tickets_dao.create_ticket. Con i contatori a strisce ogni giorno
+ha N righe in day_stripes (quota, usati) la cui somma delle quote è la capienza: l'acquisto
+sceglie a caso una striscia con quota residua e la incrementa; se la striscia scelta è
+esaurita le viene spostata metà della quota residua della striscia più capiente. La
+disponibilità si legge sommando le strisce o da un totale in cache.
+
+Entrambi gli schemi vengono eseguiti con lo stesso carico (più processi, ognuno con più
+thread, una connessione per acquisto come nei DAO) su un database temporaneo. Lo strumento
+riporta throughput, percentili di latenza, errori di database bloccato e costo delle letture,
+ed esce con codice 1 se la capienza viene superata o i contatori non corrispondono agli acquisti.
+
+SQLite blocca in scrittura l'intero database, non la singola riga: le strisce non rendono
+parallele le transazioni di acquisto, aggiungono solo statement. Il benchmark serve a
+verificarlo quando cambiano motore, journal mode o carico.
+
+Uso:
+    python -m tools.bench_capacity [--stripes 1,4,16] [--processes 4] [--threads 16]
+        [--capacity 2000] [--attempts 3000] [--journal delete|wal]
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from tools.loadtest import percentile
+
+# Giorno conteso: le strisce sono indipendenti per giorno, ne basta uno
+DAY_ID = 1
+# Una connessione attende il lock al massimo questo tempo prima di "database is locked"
+CONNECT_TIMEOUT = 5.0
+# Intervallo di validità del totale in cache, in secondi
+CACHE_TTL = 1.0
+READ_CALLS = 20_000
+
+# Esito di un acquisto: (esito, latenza in secondi)
+Outcome = Tuple[str, float]
+
+
+def _connect(db_path: str) -> sqlite3.Connection:
+    return sqlite3.connect(db_path, timeout=CONNECT_TIMEOUT, isolation_level=None)
+
+
+def build_database(db_path: str, capacity: int, stripes: int, journal: str) -> None:
+    """
+    Crea il database del benchmark: la riga del giorno, le strisce con la capienza
+    divisa in parti uguali e la tabella degli acquisti
+
+    Parameters:
+        db_path (str): Percorso del database da creare
+        capacity (int): Capienza del giorno conteso
+        stripes (int): Numero di strisce, 0 per lo schema a una riga
+        journal (str): journal_mode di SQLite
+    """
+
+    conn = _connect(db_path)
+    conn.execute(f"PRAGMA journal_mode = {journal}")
+    conn.executescript(
+        """
+        CREATE TABLE event_days (
+            id INTEGER PRIMARY KEY,
+            current_attendees INTEGER NOT NULL DEFAULT 0,
+            max_attendees INTEGER NOT NULL
+        );
+        CREATE TABLE day_stripes (
+            day_id INTEGER NOT NULL,
+            stripe INTEGER NOT NULL,
+            quota INTEGER NOT NULL,
+            used INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day_id, stripe)
+        );
+        CREATE TABLE purchases (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            day_id INTEGER NOT NULL,
+            stripe INTEGER
+        );
+        """
+    )
+    conn.execute("INSERT INTO event_days (id, max_attendees) VALUES (?, ?)", (DAY_ID, capacity))
+    conn.executemany(
+        "INSERT INTO day_stripes (day_id, stripe, quota) VALUES (?, ?, ?)",
+        [
+            (DAY_ID, stripe, capacity // stripes + (1 if stripe < capacity % stripes else 0))
+            for stripe in range(stripes)
+        ],
+    )
+    conn.close()
+
+
+def buy_single(conn: sqlite3.Connection) -> bool:
+    """Acquisto con il contatore su una riga: un UPDATE condizionale"""
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        cursor = conn.execute(
+            "UPDATE event_days SET current_attendees = current_attendees + 1 "
+            "WHERE id = ? AND current_attendees < max_attendees",
+            (DAY_ID,),
+        )
+        if cursor.rowcount != 1:
+            conn.execute("ROLLBACK")
+            return False
+        conn.execute("INSERT INTO purchases (day_id) VALUES (?)", (DAY_ID,))
+        conn.execute("COMMIT")
+        return True
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+
+
+def buy_striped(conn: sqlite3.Connection, stripes: int, rng: random.Random) -> bool:
+    """
+    Acquisto con i contatori a strisce: incrementa una striscia scelta a caso e, se è
+    esaurita, le sposta metà della quota residua della striscia più capiente
+    """
+
+    stripe = rng.randrange(stripes)
+    increment = (
+        "UPDATE day_stripes SET used = used + 1 "
+        "WHERE day_id = ? AND stripe = ? AND used < quota"
+    )
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if conn.execute(increment, (DAY_ID, stripe)).rowcount != 1:
+            donor = conn.execute(
+                "SELECT stripe, quota - used FROM day_stripes WHERE day_id = ? "
+                "ORDER BY quota - used DESC LIMIT 1",
+                (DAY_ID,),
+            ).fetchone()
+            if donor is None or donor[1] <= 0:
+                conn.execute("ROLLBACK")
+                return False
+
+            moved = (donor[1] + 1) // 2
+            conn.executemany(
+                "UPDATE day_stripes SET quota = quota + ? WHERE day_id = ? AND stripe = ?",
+                [(-moved, DAY_ID, donor[0]), (moved, DAY_ID, stripe)],
+            )
+            conn.execute(increment, (DAY_ID, stripe))
+
+        conn.execute("INSERT INTO purchases (day_id, stripe) VALUES (?, ?)", (DAY_ID, stripe))
+        conn.execute("COMMIT")
+        return True
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+
+
+def worker(
+    db_path: str, stripes: int, attempts: int, threads: int, start_at: float, seed: int, results: Any
+) -> None:
+    """
+    Processo di carico: divide gli acquisti tra i thread, attende l'istante di partenza
+    comune a tutti i processi e invia gli esiti nella coda
+    """
+
+    outcomes: List[Outcome] = []
+    lock = threading.Lock()
+
+    def run(count: int, thread_seed: int) -> None:
+        rng = random.Random(thread_seed)
+        local: List[Outcome] = []
+        time.sleep(max(0.0, start_at - time.time()))
+        for _ in range(count):
+            start = time.perf_counter()
+            conn = _connect(db_path)
+            try:
+                sold = buy_striped(conn, stripes, rng) if stripes else buy_single(conn)
+                outcome = "ok" if sold else "esaurito"
+            except sqlite3.OperationalError as e:
+                outcome = "bloccato" if "locked" in str(e) or "busy" in str(e) else "errore"
+            finally:
+                conn.close()
+            local.append((outcome, time.perf_counter() - start))
+        with lock:
+            outcomes.extend(local)
+
+    pool = [
+        threading.Thread(
+            target=run, args=(attempts // threads + (1 if i < attempts % threads else 0), seed * 1000 + i)
+        )
+        for i in range(threads)
+    ]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+
+    results.put(outcomes)
+
+
+def bench_reads(db_path: str, stripes: int) -> Dict[str, float]:
+    """
+    Costo della lettura della disponibilità, in microsecondi per chiamata: dalla riga
+    del giorno, dalla somma delle strisce e dal totale in cache
+
+    Returns:
+        dict: Microsecondi per chiamata per ciascun metodo di lettura
+    """
+
+    conn = _connect(db_path)
+    single = "SELECT max_attendees - current_attendees FROM event_days WHERE id = ?"
+    summed = "SELECT SUM(quota - used) FROM day_stripes WHERE day_id = ?"
+
+    def measure(call) -> float:
+        start = time.perf_counter()
+        for _ in range(READ_CALLS):
+            call()
+        return (time.perf_counter() - start) / READ_CALLS * 1e6
+
+    cache: Dict[str, Any] = {"value": None, "loaded_at": -CACHE_TTL}
+
+    def cached() -> Optional[int]:
+        now = time.monotonic()
+        if now - cache["loaded_at"] > CACHE_TTL:
+            cache["value"] = conn.execute(summed, (DAY_ID,)).fetchone()[0]
+            cache["loaded_at"] = now
+        return cache["value"]
+
+    query = summed if stripes else single
+    timings = {"query": measure(lambda: conn.execute(query, (DAY_ID,)).fetchone())}
+    if stripes:
+        timings["cache"] = measure(cached)
+    conn.close()
+    return timings
+
+
+def check_invariants(db_path: str, stripes: int, sold: int) -> List[str]:
+    """Verifica che la capienza non sia superata e che i contatori corrispondano agli acquisti"""
+
+    conn = _connect(db_path)
+    violations = []
+    purchases = conn.execute("SELECT COUNT(*) FROM purchases").fetchone()[0]
+    current, capacity = conn.execute(
+        "SELECT current_attendees, max_attendees FROM event_days WHERE id = ?", (DAY_ID,)
+    ).fetchone()
+
+    if stripes:
+        quota, used, over = conn.execute(
+            "SELECT SUM(quota), SUM(used), SUM(used > quota) FROM day_stripes WHERE day_id = ?", (DAY_ID,)
+        ).fetchone()
+        if quota != capacity:
+            violations.append(f"la somma delle quote ({quota}) è diversa dalla capienza ({capacity})")
+        if over:
+            violations.append(f"{over} strisce oltre la propria quota")
+        current = used
+
+    if current > capacity:
+        violations.append(f"{current} posti venduti oltre la capienza di {capacity}")
+    if current != purchases:
+        violations.append(f"il contatore vale {current} ma gli acquisti sono {purchases}")
+    if purchases != sold:
+        violations.append(f"{sold} acquisti confermati ma {purchases} nel database")
+
+    conn.close()
+    return violations
+
+
+def run_scheme(args: argparse.Namespace, work_dir: str, stripes: int) -> Tuple[Dict[str, Any], List[str]]:
+    """Esegue il carico con uno schema (0 = una riga, N = N strisce) e ne raccoglie i risultati"""
+
+    db_path = os.path.join(work_dir, f"capacity-{stripes}.db")
+    build_database(db_path, args.capacity, stripes, args.journal)
+
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    # Lascia ai processi il tempo di avviarsi: partono tutti nello stesso istante
+    start_at = time.time() + 1 + 0.3 * args.processes
+    processes = [
+        context.Process(
+            target=worker,
+            args=(
+                db_path,
+                stripes,
+                args.attempts // args.processes + (1 if i < args.attempts % args.processes else 0),
+                args.threads,
+                start_at,
+                args.seed * 100 + i,
+                queue,
+            ),
+        )
+        for i in range(args.processes)
+    ]
+    for p in processes:
+        p.start()
+    outcomes: List[Outcome] = []
+    for _ in processes:
+        outcomes.extend(queue.get())
+    for p in processes:
+        p.join()
+    elapsed = time.time() - start_at
+
+    by_outcome: Dict[str, int] = {}
+    for outcome, _ in outcomes:
+        by_outcome[outcome] = by_outcome.get(outcome, 0) + 1
+    # percentile richiede una lista ordinata
+    latencies = sorted(latency for _, latency in outcomes)
+
+    result = {
+        "schema": f"{stripes} strisce" if stripes else "una riga",
+        "elapsed": elapsed,
+        "throughput": len(outcomes) / elapsed,
+        "p50": percentile(latencies, 50),
+        "p99": percentile(latencies, 99),
+        "outcomes": by_outcome,
+        "reads": bench_reads(db_path, stripes),
+    }
+    return result, check_invariants(db_path, stripes, by_outcome.get("ok", 0))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--stripes", default="4,16", help="numeri di strisce da confrontare con la riga singola")
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=16, help="thread per processo")
+    parser.add_argument("--capacity", type=int, default=2000, help="capienza del giorno conteso")
+    parser.add_argument("--attempts", type=int, default=3000, help="acquisti tentati in totale")
+    parser.add_argument("--journal", choices=("delete", "wal"), default="delete")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    schemes = [0] + [int(value) for value in args.stripes.split(",") if value.strip()]
+    work_dir = tempfile.mkdtemp(prefix="sonosphere-capacity-")
+
+    print(
+        f"{args.attempts} acquisti da {args.processes} processi x {args.threads} thread, "
+        f"capienza {args.capacity}, journal {args.journal}"
+    )
+    print(
+        f"{'schema':<12} {'acquisti/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'venduti':>8} "
+        f"{'esauriti':>8} {'bloccati':>8} {'lettura µs':>11} {'cache µs':>9}"
+    )
+
+    failures = 0
+    for stripes in schemes:
+        result, violations = run_scheme(args, work_dir, stripes)
+        outcomes = result["outcomes"]
+        reads = result["reads"]
+        cached = f"{reads['cache']:>9.2f}" if "cache" in reads else f"{'-':>9}"
+        print(
+            f"{result['schema']:<12} {result['throughput']:>10.1f} {result['p50'] * 1000:>8.1f} "
+            f"{result['p99'] * 1000:>8.1f} {outcomes.get('ok', 0):>8} {outcomes.get('esaurito', 0):>8} "
+            f"{outcomes.get('bloccato', 0):>8} {reads['query']:>11.1f} {cached}"
+        )
+        for violation in violations:
+            print(f"  INVARIANTE VIOLATO: {violation}")
+        failures += bool(violations)
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,424 @@
+"""
+Microbenchmark delle funzioni dei DAO su database sintetici di dimensioni crescenti.
+
+Per ogni scala viene creato (o riusato dalla cache) un database sintetico e ogni
+funzione pubblica di utils/*_dao.py viene eseguita ripetutamente misurando la latenza
+per chiamata con time.perf_counter e la memoria allocata con tracemalloc. Ogni scala
+viene eseguita in un processo separato, perché il percorso del database è letto
+all'import di utils. Fallisce se una funzione DAO non ha un benchmark.
+
+Uso:
+    python -m tools.bench_dao [--scales piccola,media] [--min-time 0.5] [--output bench.json]
+"""
+
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Any, Callable, Dict, List, NamedTuple, Tuple
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Scala -> (performance, utenti); i biglietti sono metà degli utenti
+SCALES = {
+    "piccola": (50, 1_000),
+    "media": (5_000, 100_000),
+    "grande": (100_000, 1_000_000),
+}
+DEFAULT_SCALES = "piccola,media"
+# Numero massimo di chiamate per benchmark, anche se il tempo minimo non è raggiunto
+MAX_CALLS = 10_000
+
+BENCH_STAGE = "Palco benchmark"
+
+
+class Benchmark(NamedTuple):
+    """Una chiamata da misurare e le funzioni DAO che esercita"""
+
+    name: str
+    call: Callable[[], Any]
+    covers: Tuple[str, ...]
+
+
+def prepare_database(path: str, performances: int, users: int) -> None:
+    """
+    Crea il database sintetico della scala e lo adatta ai benchmark di scrittura:
+    capienza illimitata dei giorni e un palco vuoto per aggiungere performance.
+    """
+
+    from initialize_db import generate_synthetic_data
+
+    generate_synthetic_data(path, performances, users, tickets=users // 2)
+
+    conn = sqlite3.connect(path)
+    conn.execute("UPDATE event_days SET max_attendees = ?", (users * 10 + 1000,))
+    conn.execute(
+        "INSERT INTO stages (name, description, image) VALUES (?, ?, ?)",
+        (BENCH_STAGE, "Palco riservato ai benchmark", ""),
+    )
+    conn.commit()
+    conn.close()
+
+
+def build_benchmarks(db_path: str, users: int) -> List[Benchmark]:
+    """
+    Elenco dei benchmark. I parametri sono scelti tra i dati del database
+    sintetico; le scritture usano valori sempre nuovi per restare ripetibili.
+    """
+
+    from utils import (
+        event_days_dao,
+        genres_dao,
+        idempotency_dao,
+        performances_dao,
+        stages_dao,
+        ticket_holds_dao,
+        ticket_types_dao,
+        tickets_dao,
+        users_dao,
+        waiting_room_dao,
+    )
+
+    conn = sqlite3.connect(db_path)
+    last_user_id = conn.execute("SELECT MAX(id) FROM users").fetchone()[0]
+    organizer_id = conn.execute("SELECT id FROM users WHERE role = 1 ORDER BY id LIMIT 1").fetchone()[0]
+    published_id = conn.execute(
+        "SELECT id FROM performances WHERE is_published = 1 ORDER BY id DESC LIMIT 1"
+    ).fetchone()[0]
+    draft = conn.execute(
+        """SELECT id, artist_name, start_time, duration, description, image_path, day_id, stage_id, genre_id
+        FROM performances WHERE is_published = 0 ORDER BY id DESC LIMIT 1"""
+    ).fetchone()
+    stage_id = conn.execute("SELECT id FROM stages WHERE name = ?", (BENCH_STAGE,)).fetchone()[0]
+    ticket_holder = conn.execute("SELECT user_id FROM tickets ORDER BY id DESC LIMIT 1").fetchone()[0]
+    # Utenti sintetici senza biglietto, in ordine: ognuno acquista una sola volta
+    buyers = conn.execute(
+        "SELECT id FROM users WHERE role = 0 AND id NOT IN (SELECT user_id FROM tickets) ORDER BY id"
+    ).fetchall()
+    conn.close()
+
+    last_username = f"utente{users - 1:07d}"
+    buyer_ids = iter([row[0] for row in buyers])
+    counter = itertools.count()
+
+    def add_and_delete_performance():
+        performance_id, message = performances_dao.add_performance(
+            f"Benchmark {next(counter)}", "14:00", 30, "Benchmark", "", 1, stage_id, 1, organizer_id
+        )
+        if performance_id < 0:
+            raise RuntimeError(message)
+        performances_dao.delete_performance(performance_id)
+
+    def new_user():
+        i = next(counter)
+        users_dao.new_user(f"bench{i}", "Bench", "User", f"bench{i}@example.com", "hash", "")
+
+    def create_ticket():
+        buyer_id = next(buyer_ids, None)
+        if buyer_id is None:
+            raise RuntimeError("utenti senza biglietto esauriti")
+        tickets_dao.create_ticket(buyer_id, 1, [1])
+
+    def hold_and_convert():
+        buyer_id = next(buyer_ids, None)
+        if buyer_id is None:
+            raise RuntimeError("utenti senza biglietto esauriti")
+        ticket_holds_dao.create_hold(buyer_id, 1, [2])
+        ticket_holds_dao.convert_hold(buyer_id)
+
+    def claim_and_complete():
+        key = f"{next(counter):032x}"
+        idempotency_dao.claim_idempotency_key(key, last_user_id, "tickets.buy")
+        idempotency_dao.complete_idempotency_key(key, 302, "/profile/", None, [])
+
+    def claim_and_release():
+        key = f"{next(counter):032x}"
+        idempotency_dao.claim_idempotency_key(key, last_user_id, "tickets.buy")
+        idempotency_dao.release_idempotency_key(key)
+
+    def hold_and_release():
+        ticket_holds_dao.create_hold(holder_id, 1, [3])
+        ticket_holds_dao.release_hold(holder_id)
+
+    # Un utente senza biglietto riservato alle prenotazioni annullate, con una prenotazione attiva da leggere
+    holder_id = next(buyer_ids)
+    ticket_holds_dao.create_hold(holder_id, 1, [3])
+
+    # Una risposta salvata da leggere
+    replay_key = "f" * 32
+    idempotency_dao.claim_idempotency_key(replay_key, last_user_id, "tickets.buy")
+    idempotency_dao.complete_idempotency_key(replay_key, 302, "/profile/", None, [])
+
+    return [
+        Benchmark("event_days_dao.get_all_days", event_days_dao.get_all_days, ("event_days_dao.get_all_days",)),
+        Benchmark("event_days_dao.get_day_by_id", lambda: event_days_dao.get_day_by_id(1), ("event_days_dao.get_day_by_id",)),
+        Benchmark("event_days_dao.get_days_attendees", event_days_dao.get_days_attendees, ("event_days_dao.get_days_attendees",)),
+        Benchmark("event_days_dao.update_day_attendees", lambda: event_days_dao.update_day_attendees(1, 0), ("event_days_dao.update_day_attendees",)),
+        Benchmark("event_days_dao.get_attendee_counts", event_days_dao.get_attendee_counts, ("event_days_dao.get_attendee_counts",)),
+        Benchmark("event_days_dao.reconcile_day_attendees", event_days_dao.reconcile_day_attendees, ("event_days_dao.reconcile_day_attendees",)),
+        Benchmark("genres_dao.get_all_genres", genres_dao.get_all_genres, ("genres_dao.get_all_genres",)),
+        Benchmark("genres_dao.get_genre_by_id", lambda: genres_dao.get_genre_by_id(1), ("genres_dao.get_genre_by_id",)),
+        Benchmark("stages_dao.get_all_stages", stages_dao.get_all_stages, ("stages_dao.get_all_stages",)),
+        Benchmark("stages_dao.get_stage_by_id", lambda: stages_dao.get_stage_by_id(1), ("stages_dao.get_stage_by_id",)),
+        Benchmark("ticket_types_dao.get_all_ticket_types", ticket_types_dao.get_all_ticket_types, ("ticket_types_dao.get_all_ticket_types",)),
+        Benchmark("ticket_types_dao.get_ticket_type_by_id", lambda: ticket_types_dao.get_ticket_type_by_id(1), ("ticket_types_dao.get_ticket_type_by_id",)),
+        Benchmark("users_dao.get_user_by_id", lambda: users_dao.get_user_by_id(last_user_id), ("users_dao.get_user_by_id",)),
+        Benchmark("users_dao.user_from_nickname", lambda: users_dao.user_from_nickname(last_username), ("users_dao.user_from_nickname",)),
+        Benchmark("users_dao.user_from_email", lambda: users_dao.user_from_email(f"{last_username}@example.com"), ("users_dao.user_from_email",)),
+        Benchmark("users_dao.new_user", new_user, ("users_dao.new_user",)),
+        Benchmark("users_dao.update_user", lambda: users_dao.update_user(last_user_id, name="Nome"), ("users_dao.update_user",)),
+        Benchmark("users_dao.update_user_pfp", lambda: users_dao.update_user_pfp(last_user_id, ""), ("users_dao.update_user_pfp",)),
+        Benchmark("tickets_dao.get_ticket_by_user_id", lambda: tickets_dao.get_ticket_by_user_id(ticket_holder), ("tickets_dao.get_ticket_by_user_id",)),
+        Benchmark("tickets_dao.create_ticket", create_ticket, ("tickets_dao.create_ticket",)),
+        Benchmark("ticket_holds_dao.get_hold_by_user_id", lambda: ticket_holds_dao.get_hold_by_user_id(holder_id), ("ticket_holds_dao.get_hold_by_user_id",)),
+        Benchmark("ticket_holds_dao.get_hold_expirations", ticket_holds_dao.get_hold_expirations, ("ticket_holds_dao.get_hold_expirations",)),
+        Benchmark("ticket_holds_dao.expire_holds", ticket_holds_dao.expire_holds, ("ticket_holds_dao.expire_holds",)),
+        Benchmark(
+            "ticket_holds_dao.create_hold+convert_hold",
+            hold_and_convert,
+            ("ticket_holds_dao.create_hold", "ticket_holds_dao.convert_hold"),
+        ),
+        Benchmark(
+            "ticket_holds_dao.create_hold+release_hold",
+            hold_and_release,
+            ("ticket_holds_dao.create_hold", "ticket_holds_dao.release_hold"),
+        ),
+        Benchmark("performances_dao.get_all_performances", performances_dao.get_all_performances, ("performances_dao.get_all_performances",)),
+        Benchmark(
+            "performances_dao.get_all_performances(include_unpublished)",
+            lambda: performances_dao.get_all_performances(include_unpublished=True),
+            ("performances_dao.get_all_performances",),
+        ),
+        Benchmark(
+            "performances_dao.get_all_performances_with_details",
+            performances_dao.get_all_performances_with_details,
+            ("performances_dao.get_all_performances_with_details",),
+        ),
+        Benchmark(
+            "performances_dao.get_all_performances_with_details(organizer)",
+            lambda: performances_dao.get_all_performances_with_details(True, organizer_id=organizer_id),
+            ("performances_dao.get_all_performances_with_details",),
+        ),
+        Benchmark("performances_dao.get_performance_by_id", lambda: performances_dao.get_performance_by_id(published_id), ("performances_dao.get_performance_by_id",)),
+        Benchmark("performances_dao.get_performance_details", lambda: performances_dao.get_performance_details(published_id), ("performances_dao.get_performance_details",)),
+        Benchmark(
+            "performances_dao.get_performances_by_organizer",
+            lambda: performances_dao.get_performances_by_organizer(organizer_id, include_unpublished=True),
+            ("performances_dao.get_performances_by_organizer",),
+        ),
+        Benchmark("performances_dao.get_featured_performances", performances_dao.get_featured_performances, ("performances_dao.get_featured_performances",)),
+        Benchmark("performances_dao.check_artist_exists", lambda: performances_dao.check_artist_exists("Artista inesistente"), ("performances_dao.check_artist_exists",)),
+        Benchmark(
+            "performances_dao.check_time_slot_available",
+            lambda: performances_dao.check_time_slot_available(draft[6], draft[7], draft[2], draft[3], draft[0]),
+            ("performances_dao.check_time_slot_available",),
+        ),
+        Benchmark(
+            "performances_dao.update_performance",
+            lambda: performances_dao.update_performance(*draft),
+            ("performances_dao.update_performance",),
+        ),
+        Benchmark(
+            "performances_dao.add_performance+delete_performance",
+            add_and_delete_performance,
+            ("performances_dao.add_performance", "performances_dao.delete_performance"),
+        ),
+        # La sala d'attesa resta aperta fino all'ultimo benchmark, così la riserva dei numeri aggiorna la riga
+        Benchmark("waiting_room_dao.open_waiting_room", lambda: waiting_room_dao.open_waiting_room(100), ("waiting_room_dao.open_waiting_room",)),
+        Benchmark("waiting_room_dao.set_waiting_room_rate", lambda: waiting_room_dao.set_waiting_room_rate(100), ("waiting_room_dao.set_waiting_room_rate",)),
+        Benchmark("waiting_room_dao.get_waiting_room", waiting_room_dao.get_waiting_room, ("waiting_room_dao.get_waiting_room",)),
+        Benchmark(
+            "waiting_room_dao.reserve_queue_serials",
+            lambda: waiting_room_dao.reserve_queue_serials(20),
+            ("waiting_room_dao.reserve_queue_serials",),
+        ),
+        Benchmark("waiting_room_dao.close_waiting_room", waiting_room_dao.close_waiting_room, ("waiting_room_dao.close_waiting_room",)),
+        Benchmark(
+            "idempotency_dao.claim_idempotency_key+complete_idempotency_key",
+            claim_and_complete,
+            ("idempotency_dao.claim_idempotency_key", "idempotency_dao.complete_idempotency_key"),
+        ),
+        Benchmark(
+            "idempotency_dao.claim_idempotency_key+release_idempotency_key",
+            claim_and_release,
+            ("idempotency_dao.claim_idempotency_key", "idempotency_dao.release_idempotency_key"),
+        ),
+        Benchmark(
+            "idempotency_dao.get_idempotency_key",
+            lambda: idempotency_dao.get_idempotency_key(replay_key),
+            ("idempotency_dao.get_idempotency_key",),
+        ),
+    ]
+
+
+def measure(benchmark: Benchmark, min_time: float) -> Dict[str, Any]:
+    """
+    Misura una chiamata: latenza ripetendola per almeno min_time secondi
+    e memoria con tracemalloc su una chiamata separata.
+    """
+
+    benchmark.call()  # riscaldamento: cache di SQLite e del sistema operativo
+
+    timings = []
+    deadline = time.perf_counter() + min_time
+    while len(timings) < MAX_CALLS:
+        start = time.perf_counter()
+        benchmark.call()
+        timings.append(time.perf_counter() - start)
+        if time.perf_counter() >= deadline:
+            break
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    benchmark.call()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings.sort()
+    return {
+        "calls": len(timings),
+        "min_us": round(timings[0] * 1e6, 1),
+        "median_us": round(statistics.median(timings) * 1e6, 1),
+        "mean_us": round(statistics.fmean(timings) * 1e6, 1),
+        "p95_us": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1e6, 1),
+        "peak_kib": round((peak - before) / 1024, 1),
+        "retained_kib": round((current - before) / 1024, 1),
+    }
+
+
+def run_scale(scale: str, db_path: str, min_time: float) -> Dict[str, Any]:
+    """Esegue tutti i benchmark su una scala, nel processo corrente"""
+
+    from tools.explain_audit import dao_modules
+
+    _, users = SCALES[scale]
+    benchmarks = build_benchmarks(db_path, users)
+
+    public = {
+        f"{module.__name__.split('.')[-1]}.{name}"
+        for module in dao_modules()
+        for name, function in vars(module).items()
+        if callable(function)
+        and getattr(function, "__module__", None) == module.__name__
+        and not name.startswith("_")
+        and not isinstance(function, type)
+    }
+    covered = {name for benchmark in benchmarks for name in benchmark.covers}
+
+    results = {}
+    for benchmark in benchmarks:
+        results[benchmark.name] = measure(benchmark, min_time)
+        stats = results[benchmark.name]
+        print(
+            f"[{scale}] {benchmark.name:<64} {stats['median_us']:>12.1f} µs "
+            f"p95 {stats['p95_us']:>12.1f} µs  picco {stats['peak_kib']:>9.1f} KiB  ({stats['calls']} chiamate)",
+            flush=True,
+        )
+
+    return {"benchmarks": results, "missing": sorted(public - covered)}
+
+
+def _database_for(scale: str, cache_dir: str) -> str:
+    import initialize_db
+
+    performances, users = SCALES[scale]
+    # Il nome dipende dallo schema: dopo una modifica delle tabelle il database viene ricreato
+    schema = hashlib.sha1(
+        "".join(initialize_db.table_schemas + initialize_db.index_schemas).encode()
+    ).hexdigest()[:8]
+    path = os.path.join(cache_dir, f"bench_{scale}_{performances}_{users}_{schema}.db")
+    if not os.path.exists(path):
+        print(f"Creazione del database per la scala {scale} ({performances} performance, {users} utenti)...")
+        start = time.perf_counter()
+        prepare_database(path, performances, users)
+        print(f"Database creato in {time.perf_counter() - start:.1f} s")
+    return path
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scales", default=DEFAULT_SCALES, help=f"scale da eseguire tra {', '.join(SCALES)}")
+    parser.add_argument("--min-time", type=float, default=0.5, help="secondi minimi di misura per benchmark")
+    parser.add_argument("--cache-dir", default=os.path.join(tempfile.gettempdir(), "sonosphere-bench"),
+                        help="directory dei database sintetici, riusati tra esecuzioni")
+    parser.add_argument("--output", help="file JSON in cui scrivere i risultati")
+    # Uso interno: esegue una sola scala in un sottoprocesso
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        scale, db_path, result_path = args.worker.split(os.pathsep)
+        # I benchmark di scrittura modificano il database: si lavora su una copia
+        work_path = result_path + ".db"
+        with sqlite3.connect(db_path) as source, sqlite3.connect(work_path) as target:
+            source.backup(target)
+        os.environ["SONOSPHERE_DB_PATH"] = work_path
+        sys.path.insert(0, ROOT_DIR)
+        result = run_scale(scale, work_path, args.min_time)
+        os.remove(work_path)
+        with open(result_path, "w") as output:
+            json.dump(result, output)
+        return 0
+
+    scales = [scale.strip() for scale in args.scales.split(",")]
+    for scale in scales:
+        if scale not in SCALES:
+            parser.error(f"Scala sconosciuta: {scale}")
+
+    os.makedirs(args.cache_dir, exist_ok=True)
+    sys.path.insert(0, ROOT_DIR)
+
+    report: Dict[str, Any] = {
+        "meta": {"date": datetime.now().isoformat(timespec="seconds"), "args": vars(args)},
+        "scales": {},
+    }
+    missing: List[str] = []
+
+    for scale in scales:
+        db_path = _database_for(scale, args.cache_dir)
+        result_path = os.path.join(tempfile.mkdtemp(prefix="sonosphere-bench-"), "result.json")
+        subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "tools.bench_dao",
+                "--min-time",
+                str(args.min_time),
+                "--worker",
+                os.pathsep.join((scale, db_path, result_path)),
+            ],
+            cwd=ROOT_DIR,
+            check=True,
+        )
+        with open(result_path) as result_file:
+            result = json.load(result_file)
+        report["scales"][scale] = {
+            "performances": SCALES[scale][0],
+            "users": SCALES[scale][1],
+            "benchmarks": result["benchmarks"],
+        }
+        missing = result["missing"]
+
+    for qualname in missing:
+        print(f"[ERRORE] {qualname}: funzione senza benchmark, aggiungerla a build_benchmarks")
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+        print(f"Risultati scritti in {args.output}")
+
+    return 1 if missing else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,284 @@
+"""
+Verifica con EXPLAIN QUERY PLAN tutti gli statement SQL eseguiti dai DAO.
+
+Lo strumento crea un database sintetico, esegue ogni funzione pubblica dei moduli
+utils/*_dao.py raccogliendo gli statement tramite utils.db.set_statement_hook e
+fallisce se uno statement esegue una SCAN completa di una tabella più grande della
+soglia, oppure se una funzione DAO non viene esercitata (va aggiunta a exercise_daos).
+
+Uso:
+    python -m tools.explain_audit [--threshold 1000] [--performances 5000] [--users 10000]
+"""
+
+import argparse
+import functools
+import glob
+import importlib
+import inspect
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+from typing import Any, Dict, List, Set, Tuple
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Funzioni DAO che per loro natura leggono l'intera tabella, con la motivazione
+ALLOWED_SCANS = {
+    "performances_dao.get_all_performances": "lineup e gestione: leggono quasi tutte le righe",
+    "performances_dao.get_all_performances_with_details": "lineup e gestione: leggono quasi tutte le righe",
+}
+
+_SCAN_RE = re.compile(r"^SCAN (\w+)(?: (USING (?:COVERING )?INDEX \w+))?")
+_ALIAS_RE = re.compile(r"\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?", re.IGNORECASE)
+_SQL_KEYWORDS = {"WHERE", "JOIN", "LEFT", "INNER", "ON", "ORDER", "GROUP", "LIMIT", "SET", "VALUES"}
+
+
+def dao_modules() -> List[Any]:
+    """Importa tutti i moduli utils/*_dao.py"""
+
+    names = sorted(
+        os.path.splitext(os.path.basename(path))[0]
+        for path in glob.glob(os.path.join(ROOT_DIR, "utils", "*_dao.py"))
+    )
+    return [importlib.import_module(f"utils.{name}") for name in names]
+
+
+def exercise_daos() -> None:
+    """
+    Esegue ogni funzione pubblica dei DAO con parametri realistici.
+    Ogni nuova funzione DAO va aggiunta qui, altrimenti l'audit fallisce.
+    """
+
+    from utils import (
+        event_days_dao,
+        genres_dao,
+        idempotency_dao,
+        performances_dao,
+        stages_dao,
+        ticket_holds_dao,
+        ticket_types_dao,
+        tickets_dao,
+        users_dao,
+        waiting_room_dao,
+    )
+
+    event_days_dao.get_all_days()
+    event_days_dao.get_day_by_id(1)
+    event_days_dao.get_days_attendees()
+    event_days_dao.get_days_attendees(1)
+    event_days_dao.update_day_attendees(1, 0)
+    event_days_dao.update_day_attendees(1, 1)
+    event_days_dao.get_attendee_counts()
+    event_days_dao.reconcile_day_attendees()
+
+    genres_dao.get_all_genres()
+    genres_dao.get_genre_by_id(1)
+
+    stages_dao.get_all_stages()
+    stages_dao.get_stage_by_id(1)
+
+    ticket_types_dao.get_all_ticket_types()
+    ticket_types_dao.get_ticket_type_by_id(1)
+
+    users_dao.get_user_by_id(1)
+    users_dao.user_from_nickname("musicmaestro")
+    users_dao.user_from_email("marco.rossi@example.com")
+    user_id = users_dao.new_user(
+        "audit_user", "Audit", "User", "audit@example.com", "hash", ""
+    )
+    users_dao.update_user(user_id, name="Audit", email="audit@example.com")
+    users_dao.update_user_pfp(user_id, "")
+
+    tickets_dao.get_ticket_by_user_id(5)
+    tickets_dao.create_ticket(user_id, 1, [1])
+
+    holder_id = users_dao.new_user("audit_holder", "Audit", "Holder", "holder@example.com", "hash", "")
+    ticket_holds_dao.create_hold(holder_id, 1, [1])
+    ticket_holds_dao.get_hold_by_user_id(holder_id)
+    ticket_holds_dao.get_hold_expirations()
+    ticket_holds_dao.release_hold(holder_id)
+    ticket_holds_dao.create_hold(holder_id, 1, [1, 2], ttl=0)
+    ticket_holds_dao.expire_holds()
+    ticket_holds_dao.create_hold(holder_id, 1, [1])
+    ticket_holds_dao.convert_hold(holder_id)
+
+    performances_dao.get_all_performances()
+    performances_dao.get_all_performances(include_unpublished=True)
+    performances_dao.get_performance_by_id(1)
+    performances_dao.get_performance_details(1)
+    performances_dao.get_all_performances_with_details()
+    performances_dao.get_all_performances_with_details(include_unpublished=True)
+    performances_dao.get_all_performances_with_details(True, organizer_id=1)
+    performances_dao.get_performances_by_organizer(1)
+    performances_dao.get_performances_by_organizer(1, include_unpublished=True)
+    performances_dao.get_featured_performances()
+    performances_dao.check_artist_exists("Lunar Echo")
+    performances_dao.check_time_slot_available(1, 1, "14:00", 30)
+    performances_dao.check_time_slot_available(1, 1, "14:00", 30, 1)
+    performance_id, _ = performances_dao.add_performance(
+        "Audit Artist", "14:00", 30, "Audit", "", 1, 1, 1, 1
+    )
+    performances_dao.update_performance(
+        performance_id, "Audit Artist", "14:00", 30, "Audit", "", 1, 1, 1
+    )
+    performances_dao.delete_performance(performance_id)
+
+    waiting_room_dao.open_waiting_room(10)
+    waiting_room_dao.reserve_queue_serials(20)
+    waiting_room_dao.set_waiting_room_rate(20)
+    waiting_room_dao.get_waiting_room()
+    waiting_room_dao.close_waiting_room()
+
+    idempotency_dao.claim_idempotency_key("0" * 32, user_id, "tickets.buy")
+    idempotency_dao.claim_idempotency_key("0" * 32, user_id, "tickets.buy")
+    idempotency_dao.complete_idempotency_key("0" * 32, 302, "/profile/", None, [("success", "Audit")])
+    idempotency_dao.get_idempotency_key("0" * 32)
+    idempotency_dao.claim_idempotency_key("1" * 32, user_id, "tickets.buy")
+    idempotency_dao.release_idempotency_key("1" * 32)
+
+
+def collect_statements() -> Tuple[Dict[str, Tuple[str, Any, str]], Set[str]]:
+    """
+    Esegue i DAO raccogliendo gli statement emessi.
+
+    Returns:
+        dict: Statement normalizzato -> (sql, parametri, funzione DAO che lo ha emesso)
+        set: Funzioni DAO pubbliche mai chiamate
+    """
+
+    from utils import db
+
+    current: List[str] = []
+    called: Set[str] = set()
+    public: Set[str] = set()
+
+    def track(qualname, function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            called.add(qualname)
+            current.append(qualname)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                current.pop()
+
+        return wrapper
+
+    for module in dao_modules():
+        for name, function in list(vars(module).items()):
+            if (
+                inspect.isfunction(function)
+                and function.__module__ == module.__name__
+                and not name.startswith("_")
+            ):
+                qualname = f"{module.__name__.split('.')[-1]}.{name}"
+                public.add(qualname)
+                setattr(module, name, track(qualname, function))
+
+    statements: Dict[str, Tuple[str, Any, str]] = {}
+
+    def hook(sql, parameters):
+        key = db.normalize_statement(sql)
+        statements.setdefault(key, (sql, parameters, current[-1] if current else "?"))
+
+    db.set_statement_hook(hook)
+    try:
+        exercise_daos()
+    finally:
+        db.set_statement_hook(None)
+
+    return statements, public - called
+
+
+def _aliases(sql: str) -> Dict[str, str]:
+    aliases = {}
+    for table, alias in _ALIAS_RE.findall(sql):
+        aliases[table] = table
+        if alias and alias.upper() not in _SQL_KEYWORDS:
+            aliases[alias] = table
+    return aliases
+
+
+def audit(db_path: str, threshold: int) -> bool:
+    """
+    Esegue l'audit e stampa il risultato.
+
+    Parameters:
+        db_path (str): Database popolato su cui eseguire EXPLAIN QUERY PLAN
+        threshold (int): Numero di righe oltre il quale una SCAN completa è un errore
+
+    Returns:
+        bool: True se nessuno statement viola la soglia
+    """
+
+    statements, not_exercised = collect_statements()
+
+    conn = sqlite3.connect(db_path)
+    table_sizes = {
+        name: conn.execute(f'SELECT COUNT(*) FROM "{name}"').fetchone()[0]
+        for (name,) in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+        )
+    }
+
+    failures = 0
+    for key, (sql, parameters, function) in sorted(statements.items(), key=lambda item: item[1][2]):
+        plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, parameters)]
+        aliases = _aliases(sql)
+        problems = []
+
+        for detail in plan:
+            match = _SCAN_RE.match(detail)
+            if not match or match.group(2):
+                continue
+            table = aliases.get(match.group(1), match.group(1))
+            rows = table_sizes.get(table, 0)
+            if rows > threshold and function not in ALLOWED_SCANS:
+                problems.append(f"SCAN completa di {table} ({rows} righe)")
+
+        allowed = function in ALLOWED_SCANS and any(_SCAN_RE.match(d) for d in plan)
+        status = "ERRORE" if problems else ("OK*" if allowed else "OK")
+        print(f"[{status}] {function}: {key}")
+        for detail in plan:
+            print(f"        {detail}")
+        for problem in problems:
+            print(f"    -> {problem}")
+        if allowed:
+            print(f"    -> SCAN consentita: {ALLOWED_SCANS[function]}")
+
+        failures += bool(problems)
+
+    conn.close()
+
+    for qualname in sorted(not_exercised):
+        print(f"[ERRORE] {qualname}: funzione non esercitata, aggiungerla a exercise_daos")
+
+    print("-" * 60)
+    print(f"Statement analizzati: {len(statements)}, con SCAN oltre la soglia: {failures}")
+
+    return failures == 0 and not not_exercised
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--threshold", type=int, default=1000, help="righe oltre cui una SCAN è un errore")
+    parser.add_argument("--performances", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--tickets", type=int, default=5000)
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(prefix="sonosphere-audit-"), "audit.db")
+    # Deve precedere qualsiasi import di utils: DB_PATH viene letto all'import
+    os.environ["SONOSPHERE_DB_PATH"] = db_path
+
+    from initialize_db import generate_synthetic_data
+
+    generate_synthetic_data(db_path, args.performances, args.users, args.tickets)
+
+    return 0 if audit(db_path, args.threshold) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,551 @@
+"""
+Test di carico HTTP dell'applicazione servita da waitress.
+
+Lo strumento crea un database sintetico, avvia wsgi.py su una porta locale e simula
+N utenti virtuali concorrenti che eseguono un mix pesato di scenari (navigazione
+anonima della lineup, login e profilo, modifica di performance da parte di un
+organizzatore, acquisto di un biglietto). Al termine riporta throughput e percentili
+p50/p95/p99 per route e scrive i risultati in JSON per il confronto tra commit.
+
+Uso:
+    python -m tools.loadtest [--users 20] [--duration 30] [--mix browse=60,profile=20,organizer=10,purchase=10]
+        [--threads 4] [--workers 1] [--scaling 1,2,4] [--output loadtest.json] [--url http://host:port]
+
+Con --scaling il test viene ripetuto avviando wsgi.py con ciascun numero di worker,
+ogni volta sullo stesso database iniziale, e viene riportato lo speedup del throughput.
+"""
+
+import argparse
+import itertools
+import json
+import math
+import os
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime
+from http.cookiejar import CookieJar
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_MIX = "browse=60,profile=20,organizer=10,purchase=10"
+# Tempo massimo di attesa per l'avvio del server
+STARTUP_TIMEOUT = 60
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    """I redirect non vengono seguiti: ogni route viene misurata separatamente"""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class Results:
+    """Latenze ed esiti raccolti da tutti gli utenti virtuali, per route"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.statuses: Dict[str, Dict[int, int]] = {}
+        self.scenarios: Dict[str, int] = {}
+
+    def add(self, route: str, latency: float, status: int, error: bool) -> None:
+        with self._lock:
+            self.latencies.setdefault(route, []).append(latency)
+            statuses = self.statuses.setdefault(route, {})
+            statuses[status] = statuses.get(status, 0) + 1
+            if error:
+                self.errors[route] = self.errors.get(route, 0) + 1
+
+    def scenario_done(self, name: str) -> None:
+        with self._lock:
+            self.scenarios[name] = self.scenarios.get(name, 0) + 1
+
+
+class VirtualUser:
+    """Client HTTP con un proprio cookie jar, che registra ogni richiesta in Results"""
+
+    def __init__(self, base_url: str, results: Results, rng: random.Random) -> None:
+        self.base_url = base_url
+        self.results = results
+        self.rng = rng
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(CookieJar()), _NoRedirect()
+        )
+
+    def request(
+        self, route: str, path: str, data: Optional[Dict[str, Any]] = None
+    ) -> Tuple[int, str]:
+        """
+        Esegue una richiesta GET (o POST se data non è None) e ne registra la latenza.
+
+        Returns:
+            int: Codice di stato HTTP, 0 in caso di errore di connessione
+            str: Header Location della risposta, vuoto se assente
+        """
+
+        body = urllib.parse.urlencode(data, doseq=True).encode() if data is not None else None
+        start = time.perf_counter()
+        status, location = 0, ""
+        try:
+            with self.opener.open(self.base_url + path, body, timeout=30) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            status, location = e.code, e.headers.get("Location", "")
+        except (urllib.error.URLError, OSError):
+            status = 0
+        latency = time.perf_counter() - start
+
+        self.results.add(route, latency, status, status == 0 or status >= 500)
+        return status, location
+
+    def get(self, route: str, path: str) -> Tuple[int, str]:
+        return self.request(f"GET {route}", path)
+
+    def post(self, route: str, path: str, data: Dict[str, Any]) -> Tuple[int, str]:
+        return self.request(f"POST {route}", path, data)
+
+    def login(self, username: str, password: str) -> bool:
+        status, location = self.post(
+            "auth.login", "/auth/login", {"usernameoremail": username, "password": password}
+        )
+        # In caso di errore il login reindirizza di nuovo alla pagina di login
+        return status == 302 and not location.endswith("/auth/login")
+
+
+class Dataset:
+    """Dati del database sintetico usati per parametrizzare gli scenari"""
+
+    def __init__(self, db_path: str, users: int, tickets: int) -> None:
+        from initialize_db import SYNTHETIC_PASSWORD
+        import initialize_db
+
+        conn = sqlite3.connect(db_path)
+        self.performance_ids = [
+            row[0] for row in conn.execute("SELECT id FROM performances WHERE is_published = 1")
+        ]
+        organizers = {
+            username.lower(): password
+            for username, _, _, _, password, _, role in initialize_db.default_users
+            if role == 1
+        }
+        # Bozze modificabili di ciascun organizzatore, con i campi del form dell'editor
+        self.organizers: List[Tuple[str, str, List[Dict[str, Any]]]] = []
+        for user_id, username in conn.execute("SELECT id, username FROM users WHERE role = 1"):
+            drafts = [
+                {
+                    "id": row[0],
+                    "artist_name": row[1],
+                    "start_time": row[2],
+                    "duration": row[3],
+                    "description": row[4],
+                    "day_id": row[5],
+                    "stage_id": row[6],
+                    "genre_id": row[7],
+                }
+                for row in conn.execute(
+                    """SELECT id, artist_name, start_time, duration, description, day_id, stage_id, genre_id
+                    FROM performances WHERE organizer_id = ? AND is_published = 0""",
+                    (user_id,),
+                )
+            ]
+            if username in organizers and drafts:
+                self.organizers.append((username, organizers[username], drafts))
+        conn.close()
+
+        self.password = SYNTHETIC_PASSWORD
+        # I biglietti sintetici sono assegnati ai primi utenti: gli altri possono acquistare
+        self.ticket_holders = min(users, tickets)
+        self.users = users
+        self._buyers = itertools.count(self.ticket_holders)
+        self._buyers_lock = threading.Lock()
+
+    def next_buyer(self) -> Optional[str]:
+        with self._buyers_lock:
+            index = next(self._buyers)
+        return f"utente{index:07d}" if index < self.users else None
+
+
+def scenario_browse(user: VirtualUser, data: Dataset) -> None:
+    """Visitatore anonimo: home, lineup, qualche dettaglio e informazioni"""
+
+    user.get("main.home", "/")
+    user.get("main.lineup", "/lineup")
+    for performance_id in user.rng.sample(data.performance_ids, min(3, len(data.performance_ids))):
+        user.get("performances.detail", f"/performances/{performance_id}")
+    user.get("main.info", "/info")
+
+
+def scenario_profile(user: VirtualUser, data: Dataset) -> None:
+    """Partecipante con biglietto: login, profilo, pagina dei biglietti e logout"""
+
+    if not data.ticket_holders:
+        return scenario_browse(user, data)
+
+    username = f"utente{user.rng.randrange(data.ticket_holders):07d}"
+    if user.login(username, data.password):
+        user.get("profile.index", "/profile/")
+        user.get("tickets.index", "/tickets/")
+        user.get("auth.logout", "/auth/logout")
+
+
+def scenario_organizer(user: VirtualUser, data: Dataset) -> None:
+    """Organizzatore: login, gestione, modifica di una propria bozza e logout"""
+
+    if not data.organizers:
+        return scenario_browse(user, data)
+
+    username, password, drafts = user.rng.choice(data.organizers)
+    if not user.login(username, password):
+        return
+
+    user.get("performances.management", "/performances/management")
+    draft = user.rng.choice(drafts)
+    path = f"/performances/management/edit/{draft['id']}"
+    user.get("performances.editor", path)
+    form = {key: value for key, value in draft.items() if key != "id"}
+    form["description"] = f"Aggiornata dal test di carico {user.rng.randrange(10**6)}"
+    user.post("performances.editor", path, form)
+    user.get("auth.logout", "/auth/logout")
+
+
+def scenario_purchase(user: VirtualUser, data: Dataset) -> None:
+    """Nuovo partecipante: login, scelta, prenotazione e conferma di un biglietto, profilo"""
+
+    username = data.next_buyer()
+    if username is None:
+        # Tutti gli utenti sintetici hanno già acquistato: si ripiega sulla navigazione
+        return scenario_browse(user, data)
+
+    if not user.login(username, data.password):
+        return
+
+    user.get("tickets.index", "/tickets/")
+    ticket_type_id, days = user.rng.choice([(1, [user.rng.randint(1, 3)]), (2, [1, 2]), (2, [2, 3]), (3, [1, 2, 3])])
+    status, location = user.post("tickets.buy", "/tickets/buy", {"ticket_type_id": ticket_type_id, "days": days})
+    # Il biglietto viene creato solo alla conferma della prenotazione
+    if status == 302 and location.endswith("/tickets/confirm"):
+        user.get("tickets.confirm", "/tickets/confirm")
+        user.post("tickets.confirm", "/tickets/confirm", {})
+    user.get("profile.index", "/profile/")
+    user.get("auth.logout", "/auth/logout")
+
+
+SCENARIOS: Dict[str, Callable[[VirtualUser, Dataset], None]] = {
+    "browse": scenario_browse,
+    "profile": scenario_profile,
+    "organizer": scenario_organizer,
+    "purchase": scenario_purchase,
+}
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise ValueError(f"Scenario sconosciuto: {name} (disponibili: {', '.join(SCENARIOS)})")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def percentile(values: List[float], q: float) -> float:
+    """
+    Percentile con il metodo nearest-rank su una lista già ordinata: il valore di rango
+    ceil(q / 100 * n), il più piccolo che ha almeno il q% dei valori minori o uguali.
+
+    >>> percentile(list(range(1, 101)), 95)
+    95
+    >>> percentile(list(range(1, 21)), 95)
+    19
+    """
+
+    if not values:
+        return 0.0
+    # q * n / 100 invece di q / 100 * n: con q intero il rango è esatto (0.07 * 100 = 7.000000000000001)
+    index = max(0, min(len(values) - 1, math.ceil(q * len(values) / 100) - 1))
+    return values[index]
+
+
+def summarize(results: Results, elapsed: float) -> Dict[str, Any]:
+    routes = {}
+    all_latencies: List[float] = []
+    for route, latencies in sorted(results.latencies.items()):
+        latencies = sorted(latencies)
+        all_latencies.extend(latencies)
+        routes[route] = {
+            "requests": len(latencies),
+            "errors": results.errors.get(route, 0),
+            "throughput": round(len(latencies) / elapsed, 2),
+            "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+            "max_ms": round(latencies[-1] * 1000, 2),
+            "statuses": {str(status): count for status, count in sorted(results.statuses[route].items())},
+        }
+
+    all_latencies.sort()
+    total = {
+        "requests": len(all_latencies),
+        "errors": sum(results.errors.values()),
+        "throughput": round(len(all_latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(all_latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(all_latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(all_latencies, 99) * 1000, 2),
+        "scenarios": dict(sorted(results.scenarios.items())),
+    }
+    return {"total": total, "routes": routes}
+
+
+def run_load(
+    base_url: str,
+    data: Dataset,
+    users: int,
+    duration: float,
+    mix: Dict[str, float],
+    think: float = 0.0,
+    seed: int = 0,
+) -> Tuple[Results, float]:
+    """
+    Esegue gli utenti virtuali per la durata indicata.
+
+    Returns:
+        Results: Le misure raccolte
+        float: Durata effettiva del test in secondi
+    """
+
+    results = Results()
+    deadline = time.perf_counter() + duration
+    names = list(mix)
+    weights = [mix[name] for name in names]
+
+    def virtual_user(index: int) -> None:
+        rng = random.Random(seed * 100003 + index)
+        while time.perf_counter() < deadline:
+            name = rng.choices(names, weights)[0]
+            # Ogni scenario parte con una sessione nuova
+            SCENARIOS[name](VirtualUser(base_url, results, rng), data)
+            results.scenario_done(name)
+            if think:
+                time.sleep(rng.expovariate(1 / think))
+
+    threads = [
+        threading.Thread(target=virtual_user, args=(i,), name=f"vu-{i}", daemon=True)
+        for i in range(users)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return results, time.perf_counter() - start
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(
+    db_path: str, work_dir: str, port: int, server_args: List[str]
+) -> subprocess.Popen:
+    """
+    Avvia wsgi.py in un sottoprocesso sul database indicato e attende che risponda.
+    La directory di lavoro è quella temporanea, così immagini e log generati
+    durante il test non finiscono nel repository.
+    """
+
+    env = dict(os.environ, SONOSPHERE_DB_PATH=db_path)
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT_DIR, "wsgi.py"), "--host", "127.0.0.1", "--port", str(port)]
+        + server_args,
+        cwd=work_dir,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=open(os.path.join(work_dir, "server.err"), "wb"),
+    )
+
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Il server è terminato all'avvio, vedere {work_dir}/server.err")
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1).read()
+            return process
+        except OSError:
+            time.sleep(0.2)
+
+    process.terminate()
+    raise RuntimeError("Il server non ha risposto entro il tempo massimo di avvio")
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(
+        f"{'route':<36} {'req':>7} {'err':>5} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}"
+    )
+    for route, stats in report["routes"].items():
+        print(
+            f"{route:<36} {stats['requests']:>7} {stats['errors']:>5} {stats['throughput']:>8} "
+            f"{stats['p50_ms']:>8} {stats['p95_ms']:>8} {stats['p99_ms']:>8} {stats['max_ms']:>8}"
+        )
+    total = report["total"]
+    print("-" * 98)
+    print(
+        f"{'totale':<36} {total['requests']:>7} {total['errors']:>5} {total['throughput']:>8} "
+        f"{total['p50_ms']:>8} {total['p95_ms']:>8} {total['p99_ms']:>8}"
+    )
+    if total["scenarios"]:
+        print(f"Scenari completati: {total['scenarios']}")
+
+
+def print_scaling(runs: List[Dict[str, Any]]) -> None:
+    base = runs[0]["total"]["throughput"] or 1
+    print(
+        f"{'worker':>6} {'req/s':>9} {'speedup':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+        f"{'errori':>7} {'CPU client':>10}"
+    )
+    for run in runs:
+        total = run["total"]
+        print(
+            f"{run['meta']['workers']:>6} {total['throughput']:>9} {total['throughput'] / base:>7.2f}x "
+            f"{total['p50_ms']:>8} {total['p95_ms']:>8} {total['p99_ms']:>8} {total['errors']:>7} "
+            f"{run['meta']['client_cpu']:>9.0%}"
+        )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=20, help="utenti virtuali concorrenti")
+    parser.add_argument("--duration", type=float, default=30, help="durata del test in secondi")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="pesi degli scenari")
+    parser.add_argument("--think", type=float, default=0.0, help="pausa media tra scenari in secondi")
+    parser.add_argument("--threads", type=int, default=4, help="thread di waitress per ogni worker")
+    parser.add_argument("--workers", type=int, default=1, help="processi worker di wsgi.py")
+    parser.add_argument(
+        "--scaling",
+        help="numeri di worker da confrontare in esecuzioni successive, es. 1,2,4 (sostituisce --workers)",
+    )
+    parser.add_argument("--performances", type=int, default=500)
+    parser.add_argument("--db-users", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--url", help="server già avviato da usare, es. http://127.0.0.1:5000 (con il suo database)")
+    parser.add_argument("--db", help="database del server indicato con --url, per parametrizzare gli scenari")
+    parser.add_argument("--output", help="file JSON in cui scrivere i risultati")
+    args = parser.parse_args()
+
+    try:
+        mix = parse_mix(args.mix)
+        worker_counts = [int(n) for n in args.scaling.split(",")] if args.scaling else [args.workers]
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.url and args.scaling:
+        parser.error("--scaling richiede che il server venga avviato dallo strumento (senza --url)")
+
+    sys.path.insert(0, ROOT_DIR)
+    work_dir = tempfile.mkdtemp(prefix="sonosphere-loadtest-")
+    tickets = args.db_users // 2
+
+    if args.url:
+        if not args.db:
+            parser.error("con --url va indicato anche --db")
+        db_path, base_url = args.db, args.url.rstrip("/")
+    else:
+        db_path = os.path.join(work_dir, "loadtest.db")
+        pristine_path = os.path.join(work_dir, "pristine.db")
+        # Deve precedere qualsiasi import di utils: DB_PATH viene letto all'import
+        os.environ["SONOSPHERE_DB_PATH"] = db_path
+        from initialize_db import generate_synthetic_data
+
+        generate_synthetic_data(pristine_path, args.performances, args.db_users, tickets, args.seed)
+
+    runs = []
+    for workers in worker_counts:
+        process = None
+        if not args.url:
+            # Ogni esecuzione parte dallo stesso database: gli acquisti consumano i partecipanti
+            shutil.copyfile(pristine_path, db_path)
+            port = _free_port()
+            server_args = ["--threads", str(args.threads), "--workers", str(workers)]
+            if workers > 1:
+                server_args.append("--preload")
+            process = start_server(db_path, work_dir, port, server_args)
+            base_url = f"http://127.0.0.1:{port}"
+
+        try:
+            data = Dataset(db_path, args.db_users, tickets)
+            print(
+                f"Test di carico su {base_url} ({workers} worker da {args.threads} thread): "
+                f"{args.users} utenti per {args.duration:g} s, mix {mix}"
+            )
+            cpu_start = time.process_time()
+            results, elapsed = run_load(
+                base_url, data, args.users, args.duration, mix, args.think, args.seed
+            )
+            client_cpu = (time.process_time() - cpu_start) / elapsed
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait(timeout=60)
+
+        report = summarize(results, elapsed)
+        report["meta"] = {
+            "commit": _git_commit(),
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "elapsed": round(elapsed, 3),
+            "workers": workers,
+            # CPU usata dal generatore di carico: vicino al 100% il limite è il client
+            "client_cpu": round(client_cpu, 3),
+            "args": vars(args),
+        }
+        print_report(report)
+        print()
+        runs.append(report)
+
+    if len(runs) > 1:
+        print_scaling(runs)
+        print(f"CPU disponibili: {os.cpu_count()}")
+        output: Dict[str, Any] = {"scaling": runs}
+    else:
+        output = runs[0]
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(output, output_file, indent=2)
+        print(f"Risultati scritti in {args.output}")
+
+    return 1 if any(run["total"]["errors"] for run in runs) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,400 @@
+"""
+Stress test di concorrenza sulla vendita dei biglietti.
+
+Lo strumento crea un database sintetico con un giorno a capienza ridotta e lancia
+migliaia di acquisti concorrenti da più processi, ognuno con più thread, tramite
+tickets.buy e tickets.confirm (modalità http, con wsgi.py avviato su una porta locale:
+prenotazione e conferma) oppure chiamando direttamente tickets_dao.create_ticket (modalità dao). Una parte degli utenti invia
+due acquisti contemporanei. Al termine verifica gli invarianti:
+
+- nessun giorno supera la capienza;
+- current_attendees e held_attendees coincidono con i biglietti e le prenotazioni per giorno;
+- nessun utente possiede due biglietti;
+- gli utenti a cui l'acquisto è stato confermato sono quelli con un biglietto nel database.
+
+Riporta latenze, esiti ed eventuali errori di contesa (database bloccato, retry)
+ed esce con codice 1 se un invariante è violato.
+
+Uso:
+    python -m tools.oversell_stress [--mode http|dao] [--processes 4] [--threads 25]
+        [--buyers 2000] [--capacity 100] [--duplicate-rate 0.05]
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from typing import Any, Dict, List, Set, Tuple
+
+from tools.loadtest import _NoRedirect, percentile
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ADMIN_TOKEN = "oversell-stress"
+# Metriche esportate dall'applicazione che misurano la contesa sul database
+_CONTENTION_METRIC_RE = re.compile(r"^(sonosphere_db_\w*(?:busy|retr|lock)\w*)(\{[^}]*\})? (\S+)$")
+
+# Esito di un acquisto: (user_id, esito, latenza in secondi)
+Outcome = Tuple[int, str, float]
+
+
+class _ContentionHandler(logging.Handler):
+    """Conta i messaggi di log che segnalano un database bloccato"""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.count = 0
+
+    def emit(self, record: logging.LogRecord) -> None:
+        message = record.getMessage().lower()
+        if "locked" in message or "busy" in message:
+            self.count += 1
+
+
+def _post_http(url: str, cookie: str, data: bytes) -> str:
+    """Esegue una POST senza seguire i redirect: restituisce la destinazione o l'esito"""
+
+    opener = urllib.request.build_opener(_NoRedirect())
+    request = urllib.request.Request(url, data=data, headers={"Cookie": f"session={cookie}"})
+    try:
+        with opener.open(request, timeout=60) as response:
+            response.read()
+            return f"http_{response.status}"
+    except urllib.error.HTTPError as e:
+        e.read()
+        if e.code == 302:
+            return e.headers.get("Location", "")
+        return f"http_{e.code}"
+    except (urllib.error.URLError, OSError):
+        return "errore_connessione"
+
+
+def _buy_http(base_url: str, cookie: str, day: int) -> str:
+    """
+    Esegue tickets.buy (prenotazione) e tickets.confirm con la sessione indicata
+    e ne deduce l'esito dai redirect
+    """
+
+    location = _post_http(f"{base_url}/tickets/buy", cookie, f"ticket_type_id=1&days={day}".encode())
+    if location.endswith("/tickets/confirm"):
+        location = _post_http(f"{base_url}/tickets/confirm", cookie, b"")
+
+    # Dopo un acquisto riuscito si viene reindirizzati al profilo
+    if location.endswith("/profile/"):
+        return "ok"
+    if location.startswith(("http_", "errore")):
+        return location
+    return "rifiutato"
+
+
+def worker(
+    mode: str,
+    target: str,
+    items: List[Tuple[int, str]],
+    threads: int,
+    day: int,
+    start_at: float,
+    results: Any,
+) -> None:
+    """
+    Processo di carico: divide gli acquisti tra i thread, attende l'istante di
+    partenza comune a tutti i processi e invia i risultati nella coda.
+
+    Parameters:
+        mode (str): "http" o "dao"
+        target (str): URL del server (http) o percorso del database (dao)
+        items (list): Coppie (user_id, cookie di sessione) da far acquistare
+        threads (int): Thread del processo
+        day (int): Giorno del biglietto giornaliero da acquistare
+        start_at (float): Istante (time.time) in cui iniziare gli acquisti
+        results: Coda multiprocessing su cui inviare esiti e contesa
+    """
+
+    contention = _ContentionHandler()
+
+    if mode == "dao":
+        os.environ["SONOSPHERE_DB_PATH"] = target
+        sys.path.insert(0, ROOT_DIR)
+        from utils import tickets_dao
+
+        logging.getLogger().addHandler(contention)
+
+    outcomes: List[Outcome] = []
+    lock = threading.Lock()
+
+    def run(chunk: List[Tuple[int, str]]) -> None:
+        local: List[Outcome] = []
+        time.sleep(max(0.0, start_at - time.time()))
+        for user_id, cookie in chunk:
+            start = time.perf_counter()
+            if mode == "dao":
+                try:
+                    success, _ = tickets_dao.create_ticket(user_id, 1, [day])
+                    outcome = "ok" if success else "rifiutato"
+                except sqlite3.OperationalError as e:
+                    outcome = f"eccezione: {e}"
+            else:
+                outcome = _buy_http(target, cookie, day)
+            local.append((user_id, outcome, time.perf_counter() - start))
+        with lock:
+            outcomes.extend(local)
+
+    pool = [
+        threading.Thread(target=run, args=(items[i::threads],), daemon=True)
+        for i in range(threads)
+    ]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+
+    results.put((outcomes, contention.count))
+
+
+def build_items(
+    db_path: str, buyers: int, duplicate_rate: float, seed: int, mode: str
+) -> List[Tuple[int, str]]:
+    """
+    Elenco degli acquisti da eseguire: ogni utente generato una volta, una parte
+    due volte. In modalità http ogni acquisto ha una sessione Flask-Login firmata
+    con la SECRET_KEY dell'applicazione, per non pagare scrypt ad ogni login.
+    """
+
+    conn = sqlite3.connect(db_path)
+    user_ids = [
+        row[0]
+        for row in conn.execute(
+            "SELECT id FROM users WHERE username LIKE 'utente%' ORDER BY id LIMIT ?", (buyers,)
+        )
+    ]
+    conn.close()
+
+    rng = random.Random(seed)
+    items = user_ids + rng.sample(user_ids, int(len(user_ids) * duplicate_rate))
+    rng.shuffle(items)
+
+    if mode != "http":
+        return [(user_id, "") for user_id in items]
+
+    from app import app
+
+    serializer = app.session_interface.get_signing_serializer(app)
+    return [
+        (user_id, serializer.dumps({"_user_id": str(user_id), "_fresh": True}))
+        for user_id in items
+    ]
+
+
+def check_invariants(
+    db_path: str, day: int, confirmed: Set[int]
+) -> Tuple[List[str], Dict[str, Any]]:
+    """
+    Verifica gli invarianti sul database al termine del test.
+
+    Returns:
+        list: Descrizione degli invarianti violati
+        dict: Stato finale dei giorni e dei biglietti
+    """
+
+    conn = sqlite3.connect(db_path)
+    violations = []
+
+    days = conn.execute(
+        "SELECT id, name, current_attendees, max_attendees, held_attendees FROM event_days ORDER BY id"
+    ).fetchall()
+    state: Dict[str, Any] = {"days": {}}
+
+    for day_id, name, current, maximum, held in days:
+        bit = 1 << (day_id - 1)
+        actual = conn.execute("SELECT COUNT(*) FROM tickets WHERE days & ?", (bit,)).fetchone()[0]
+        holds = conn.execute("SELECT COUNT(*) FROM ticket_holds WHERE days & ?", (bit,)).fetchone()[0]
+        state["days"][name] = {
+            "current_attendees": current,
+            "tickets": actual,
+            "held_attendees": held,
+            "max_attendees": maximum,
+        }
+        if actual + holds > maximum:
+            violations.append(f"{name}: {actual} biglietti e {holds} prenotazioni oltre la capienza di {maximum}")
+        if current != actual:
+            violations.append(f"{name}: current_attendees = {current} ma i biglietti sono {actual}")
+        if held != holds:
+            violations.append(f"{name}: held_attendees = {held} ma le prenotazioni sono {holds}")
+
+    duplicated = conn.execute(
+        "SELECT COUNT(*) FROM (SELECT user_id FROM tickets GROUP BY user_id HAVING COUNT(*) > 1)"
+    ).fetchone()[0]
+    if duplicated:
+        violations.append(f"{duplicated} utenti possiedono più di un biglietto")
+
+    # Il secondo acquisto di un utente viene rediretto al profilo come uno riuscito:
+    # il confronto è tra insiemi di utenti, non tra numeri di conferme
+    holders = {
+        row[0]
+        for row in conn.execute(
+            "SELECT user_id FROM tickets WHERE days & ? AND user_id IN "
+            "(SELECT id FROM users WHERE username LIKE 'utente%')",
+            (1 << (day - 1),),
+        )
+    }
+    state["sold"] = len(holders)
+    if holders - confirmed:
+        violations.append(f"{len(holders - confirmed)} biglietti nel database senza conferma al client")
+    if confirmed - holders:
+        violations.append(f"{len(confirmed - holders)} acquisti confermati al client senza biglietto")
+
+    conn.close()
+    return violations, state
+
+
+def scrape_contention(base_url: str) -> Dict[str, float]:
+    """Legge da /admin/metrics le metriche di contesa sul database, se esportate"""
+
+    request = urllib.request.Request(
+        f"{base_url}/admin/metrics", headers={"Authorization": f"Bearer {ADMIN_TOKEN}"}
+    )
+    metrics: Dict[str, float] = {}
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            for line in response.read().decode().splitlines():
+                match = _CONTENTION_METRIC_RE.match(line)
+                if match:
+                    name = match.group(1) + (match.group(2) or "")
+                    metrics[name] = float(match.group(3))
+    except OSError:
+        pass
+    return metrics
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--mode", choices=("http", "dao"), default="http")
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=25, help="thread per processo")
+    parser.add_argument("--buyers", type=int, default=2000, help="utenti che tentano l'acquisto")
+    parser.add_argument("--capacity", type=int, default=100, help="capienza del giorno conteso")
+    parser.add_argument("--day", type=int, choices=(1, 2, 3), default=1)
+    parser.add_argument("--duplicate-rate", type=float, default=0.05,
+                        help="frazione di utenti che invia due acquisti contemporanei")
+    parser.add_argument("--server-threads", type=int, default=8, help="thread di waitress (modalità http)")
+    parser.add_argument("--server-workers", type=int, default=1, help="processi worker di wsgi.py (modalità http)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="sonosphere-oversell-")
+    db_path = os.path.join(work_dir, "oversell.db")
+    # Deve precedere qualsiasi import di utils: DB_PATH viene letto all'import
+    os.environ["SONOSPHERE_DB_PATH"] = db_path
+    sys.path.insert(0, ROOT_DIR)
+
+    from initialize_db import generate_synthetic_data
+
+    generate_synthetic_data(db_path, 0, args.buyers, 0, args.seed)
+    conn = sqlite3.connect(db_path)
+    conn.execute("UPDATE event_days SET max_attendees = ? WHERE id = ?", (args.capacity, args.day))
+    conn.commit()
+    conn.close()
+
+    items = build_items(db_path, args.buyers, args.duplicate_rate, args.seed, args.mode)
+
+    process = None
+    target = db_path
+    if args.mode == "http":
+        from tools.loadtest import _free_port, start_server
+
+        os.environ["SONOSPHERE_ADMIN_TOKEN"] = ADMIN_TOKEN
+        port = _free_port()
+        server_args = ["--threads", str(args.server_threads), "--workers", str(args.server_workers)]
+        process = start_server(db_path, work_dir, port, server_args)
+        target = f"http://127.0.0.1:{port}"
+
+    print(
+        f"{len(items)} acquisti ({args.buyers} utenti, {args.duplicate_rate:.0%} doppi) da "
+        f"{args.processes} processi x {args.threads} thread, modalità {args.mode}, capienza {args.capacity}"
+    )
+
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    # Lascia ai processi il tempo di avviarsi: partono tutti nello stesso istante
+    start_at = time.time() + 2 + 0.5 * args.processes
+    processes = [
+        context.Process(
+            target=worker,
+            args=(args.mode, target, items[i::args.processes], args.threads, args.day, start_at, queue),
+        )
+        for i in range(args.processes)
+    ]
+
+    try:
+        for p in processes:
+            p.start()
+        outcomes: List[Outcome] = []
+        contention = 0
+        for _ in processes:
+            process_outcomes, process_contention = queue.get()
+            outcomes.extend(process_outcomes)
+            contention += process_contention
+        for p in processes:
+            p.join()
+        elapsed = time.time() - start_at
+        contention_metrics = scrape_contention(target) if args.mode == "http" else {}
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+
+    # percentile richiede liste ordinate
+    by_outcome: Dict[str, List[float]] = {}
+    for _, outcome, latency in sorted(outcomes, key=lambda item: item[2]):
+        by_outcome.setdefault(outcome, []).append(latency)
+    latencies = sorted(latency for _, _, latency in outcomes)
+
+    print(f"Durata: {elapsed:.2f} s, {len(outcomes) / elapsed:.1f} acquisti/s")
+    for outcome, values in sorted(by_outcome.items()):
+        print(
+            f"  {outcome:<24} {len(values):>6}  p50 {percentile(values, 50) * 1000:8.1f} ms  "
+            f"p95 {percentile(values, 95) * 1000:8.1f} ms  p99 {percentile(values, 99) * 1000:8.1f} ms"
+        )
+    print(
+        f"  {'totale':<24} {len(latencies):>6}  p50 {percentile(latencies, 50) * 1000:8.1f} ms  "
+        f"p95 {percentile(latencies, 95) * 1000:8.1f} ms  p99 {percentile(latencies, 99) * 1000:8.1f} ms"
+    )
+
+    print("Contesa sul database:")
+    if args.mode == "dao":
+        print(f"  errori di database bloccato nei log: {contention}")
+    elif contention_metrics:
+        for name, value in sorted(contention_metrics.items()):
+            print(f"  {name} = {value:g}")
+    else:
+        print("  nessuna metrica di contesa esportata dall'applicazione")
+
+    confirmed = {user_id for user_id, outcome, _ in outcomes if outcome == "ok"}
+    violations, state = check_invariants(db_path, args.day, confirmed)
+    for name, day_state in state["days"].items():
+        print(
+            f"  {name}: {day_state['tickets']} biglietti, current_attendees {day_state['current_attendees']}, "
+            f"capienza {day_state['max_attendees']}"
+        )
+
+    if violations:
+        print("INVARIANTI VIOLATI:")
+        for violation in violations:
+            print(f"  - {violation}")
+        return 1
+
+    print("Tutti gli invarianti sono rispettati")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
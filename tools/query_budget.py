@@ -0,0 +1,319 @@
+"""
+Verifica il numero di query SQL eseguite da ogni route dell'applicazione.
+
+Lo strumento crea un database sintetico, esegue ogni route dei blueprint tramite il
+test client di Flask e conta gli statement emessi durante la richiesta (compresa la
+query del user_loader di Flask-Login). BEGIN, COMMIT, SAVEPOINT e gli altri statement di
+controllo delle transazioni non sono contati: il thread di scrittura li condivide tra le
+operazioni di più richieste. Fallisce se una route supera il budget
+dichiarato in BUDGETS o se una route registrata non ha un budget.
+
+Uso:
+    python -m tools.query_budget [--performances 500] [--users 200]
+"""
+
+import argparse
+import io
+import os
+import re
+import sys
+import tempfile
+from typing import Any, Dict, List, NamedTuple, Optional
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Credenziali degli utenti predefiniti usati dagli scenari
+ORGANIZER = ("musicmaestro", "Admin2025!")
+PARTICIPANT = ("music_fan", "Fan2025!")
+
+_TRANSACTION_RE = re.compile(r"^\s*(BEGIN|COMMIT|END|ROLLBACK|SAVEPOINT|RELEASE)\b", re.IGNORECASE)
+
+
+def _image() -> io.BytesIO:
+    """Piccola immagine PNG per le route che accettano un upload"""
+
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 64), (200, 30, 30)).save(buffer, "PNG")
+    buffer.seek(0)
+    return buffer
+
+
+class Budget(NamedTuple):
+    """Una richiesta da eseguire e il numero massimo di query che può emettere"""
+
+    endpoint: str
+    method: str
+    url: str
+    client: str
+    budget: int
+    data: Optional[Dict[str, Any]] = None
+
+
+def build_budgets(performance_to_publish: int, performance_to_delete: int) -> List[Budget]:
+    """
+    Elenco ordinato delle richieste da verificare. I client sono "anonymous",
+    "organizer", "participant" (con biglietto), "buyer" e "waiter" (senza biglietto).
+    """
+
+    editor_form = {
+        "day_id": "1",
+        "stage_id": "1",
+        "start_time": "14:00",
+        "duration": "30",
+        "description": "Performance creata dal controllo dei budget",
+        "genre_id": "1",
+    }
+
+    return [
+        Budget("main.home", "GET", "/", "anonymous", 1),
+        Budget("main.info", "GET", "/info", "anonymous", 2),
+        Budget("main.lineup", "GET", "/lineup", "anonymous", 4),
+        Budget("performances.detail", "GET", "/performances/1", "anonymous", 1),
+        Budget("performances.detail", "GET", f"/performances/{performance_to_publish}", "organizer", 2),
+        Budget("auth.login", "GET", "/auth/login", "anonymous", 0),
+        Budget("auth.signup", "GET", "/auth/signup", "anonymous", 0),
+        Budget(
+            "auth.signup",
+            "POST",
+            "/auth/signup",
+            "anonymous",
+            4,
+            {
+                "username": "budget_user",
+                "name": "Budget",
+                "surname": "User",
+                "email": "budget@example.com",
+                "password": "Budget2025!",
+                "role": "0",
+                "profile_picture": (_image(), "budget.png"),
+            },
+        ),
+        Budget("performances.management", "GET", "/performances/management", "organizer", 2),
+        Budget("performances.editor", "GET", "/performances/management/add", "organizer", 4),
+        Budget(
+            "performances.editor",
+            "POST",
+            "/performances/management/add",
+            "organizer",
+            6,
+            dict(editor_form, artist_name="Budget Artist", idempotency_key="c" * 32),
+        ),
+        Budget(
+            "performances.editor",
+            "GET",
+            f"/performances/management/edit/{performance_to_publish}",
+            "organizer",
+            5,
+        ),
+        Budget(
+            "performances.editor",
+            "POST",
+            f"/performances/management/edit/{performance_to_publish}",
+            "organizer",
+            5,
+            dict(editor_form, artist_name="Budget Publish"),
+        ),
+        Budget(
+            "performances.publish",
+            "POST",
+            "/performances/publish",
+            "organizer",
+            8,
+            {"performance_id": str(performance_to_publish), "is_featured": "0"},
+        ),
+        Budget(
+            "performances.delete",
+            "POST",
+            "/performances/delete",
+            "organizer",
+            4,
+            {"performance_id": str(performance_to_delete)},
+        ),
+        Budget("profile.index", "GET", "/profile/", "organizer", 3),
+        # Il profilo del partecipante legge i giorni del festival per mostrare la validità del biglietto
+        Budget("profile.index", "GET", "/profile/", "participant", 3),
+        Budget(
+            "profile.update",
+            "POST",
+            "/profile/update",
+            "participant",
+            2,
+            {"current_password": PARTICIPANT[1], "name": "Luca", "surname": "Romano"},
+        ),
+        Budget(
+            "profile.update_picture",
+            "POST",
+            "/profile/update_picture",
+            "participant",
+            2,
+            {"profile_picture": (_image(), "budget.png")},
+        ),
+        # Una query in più al massimo una volta al secondo: lo stato della sala d'attesa.
+        # Con la chiave di idempotenza le richieste eseguono 3 query in più (scadute, riserva, risposta)
+        Budget("tickets.index", "GET", "/tickets/", "buyer", 6),
+        Budget(
+            "tickets.buy",
+            "POST",
+            "/tickets/buy",
+            "buyer",
+            10,
+            {"ticket_type_id": "3", "days": ["1", "2", "3"], "idempotency_key": "a" * 32},
+        ),
+        Budget("tickets.confirm", "GET", "/tickets/confirm", "buyer", 3),
+        Budget("tickets.confirm", "POST", "/tickets/confirm", "buyer", 9, {"idempotency_key": "b" * 32}),
+        # Nuovo invio dello stesso modulo: la risposta salvata viene restituita senza riacquistare
+        Budget("tickets.confirm", "POST", "/tickets/confirm", "buyer", 4, {"idempotency_key": "b" * 32}),
+        # Il partecipante "waiter" prenota e annulla la prenotazione
+        Budget(
+            "tickets.buy",
+            "POST",
+            "/tickets/buy",
+            "waiter",
+            7,
+            {"ticket_type_id": "1", "days": ["2"]},
+        ),
+        Budget("tickets.release", "POST", "/tickets/release", "waiter", 3),
+        # Sala d'attesa: il partecipante "waiter" riceve un numero di coda e interroga lo stato
+        Budget("admin.waiting_room_open", "POST", "/admin/waiting-room/open?rate=0.001", "admin", 3),
+        Budget("admin.waiting_room_rate", "POST", "/admin/waiting-room/rate?rate=0.001", "admin", 2),
+        Budget("admin.waiting_room_status", "GET", "/admin/waiting-room", "admin", 1),
+        Budget("tickets.index", "GET", "/tickets/", "waiter", 1),
+        Budget("tickets.waiting", "GET", "/tickets/waiting", "waiter", 2),
+        Budget("tickets.waiting_status", "GET", "/tickets/waiting/status", "waiter", 0),
+        Budget("admin.waiting_room_close", "POST", "/admin/waiting-room/close", "admin", 3),
+        Budget("admin.metrics", "GET", "/admin/metrics", "admin", 0),
+        Budget("admin.admission_status", "GET", "/admin/admission", "admin", 0),
+        Budget("admin.profiler_start", "POST", "/admin/profiler/start?seconds=0.1", "admin", 0),
+        Budget("admin.profiler_stop", "POST", "/admin/profiler/stop", "admin", 0),
+        Budget("admin.profiler_status", "GET", "/admin/profiler/status", "admin", 0),
+        Budget("admin.profiler_stacks", "GET", "/admin/profiler/stacks", "admin", 0),
+        Budget("admin.profiler_token", "GET", "/admin/profiler/token", "admin", 0),
+        Budget("admin.memory_tracing_start", "POST", "/admin/memory/tracing/start", "admin", 0),
+        Budget("admin.memory_snapshot", "POST", "/admin/memory/snapshots/budget", "admin", 0),
+        Budget("admin.memory_snapshots", "GET", "/admin/memory/snapshots", "admin", 0),
+        Budget("admin.memory_diff", "GET", "/admin/memory/diff?from=budget", "admin", 0),
+        Budget("admin.memory_tracing_stop", "POST", "/admin/memory/tracing/stop", "admin", 0),
+        Budget("admin.memory_history_start", "POST", "/admin/memory/history/start?interval=1", "admin", 0),
+        Budget("admin.memory_history", "GET", "/admin/memory/history", "admin", 0),
+        Budget("admin.memory_history_stop", "POST", "/admin/memory/history/stop", "admin", 0),
+        Budget("auth.logout", "GET", "/auth/logout", "participant", 1),
+    ]
+
+
+def run(users: int) -> bool:
+    """
+    Esegue tutte le richieste e confronta le query emesse con i budget.
+
+    Returns:
+        bool: True se tutte le route rispettano il budget
+    """
+
+    from app import app
+    from initialize_db import SYNTHETIC_PASSWORD
+    from utils import db, performances_dao
+
+    app.config["TESTING"] = True
+    app.config["ADMIN_TOKEN"] = "query-budget"
+
+    clients = {
+        name: app.test_client()
+        for name in ("anonymous", "organizer", "participant", "buyer", "waiter", "admin")
+    }
+    # I biglietti sintetici sono assegnati ai primi utenti: gli ultimi non ne hanno
+    buyer = (f"utente{users - 1:07d}", SYNTHETIC_PASSWORD)
+    waiter = (f"utente{users - 2:07d}", SYNTHETIC_PASSWORD)
+    for name, (username, password) in (
+        ("organizer", ORGANIZER),
+        ("participant", PARTICIPANT),
+        ("buyer", buyer),
+        ("waiter", waiter),
+    ):
+        clients[name].post("/auth/login", data={"usernameoremail": username, "password": password})
+
+    # Due bozze dell'organizzatore: una da pubblicare e una da eliminare
+    ids = []
+    for artist_name in ("Budget Draft", "Budget Delete"):
+        performance_id, message = performances_dao.add_performance(
+            artist_name, "14:00", 30, "Bozza", "", 1, 1, 1, 1
+        )
+        if performance_id < 0:
+            raise RuntimeError(message)
+        ids.append(performance_id)
+
+    budgets = build_budgets(ids[0], ids[1])
+
+    executed = [0]
+    def count(sql: str, parameters: Any) -> None:
+        if not _TRANSACTION_RE.match(sql):
+            executed[0] += 1
+
+    db.set_statement_hook(count)
+
+    failures = 0
+    try:
+        for budget in budgets:
+            client = clients[budget.client]
+            headers = {"Authorization": "Bearer query-budget"} if budget.client == "admin" else {}
+
+            executed[0] = 0
+            response = client.open(
+                budget.url,
+                method=budget.method,
+                data=budget.data,
+                headers=headers,
+                content_type="multipart/form-data" if budget.data else None,
+            )
+            queries = executed[0]
+
+            ok = queries <= budget.budget and response.status_code < 500
+            failures += not ok
+            print(
+                f"[{'OK' if ok else 'ERRORE'}] {budget.endpoint:<26} {budget.method:<4} "
+                f"{budget.url:<40} {budget.client:<11} query {queries:>2}/{budget.budget:<2} "
+                f"HTTP {response.status_code}"
+            )
+    finally:
+        db.set_statement_hook(None)
+
+    covered = {budget.endpoint for budget in budgets}
+    missing = sorted(
+        rule.endpoint
+        for rule in app.url_map.iter_rules()
+        if rule.endpoint != "static" and rule.endpoint not in covered
+    )
+    for endpoint in missing:
+        print(f"[ERRORE] {endpoint}: nessun budget dichiarato, aggiungerlo a build_budgets")
+
+    print("-" * 60)
+    print(f"Richieste verificate: {len(budgets)}, fuori budget: {failures}")
+
+    return failures == 0 and not missing
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--performances", type=int, default=500)
+    parser.add_argument("--users", type=int, default=200)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="sonosphere-budget-")
+    db_path = os.path.join(work_dir, "budget.db")
+    # Deve precedere qualsiasi import di utils: DB_PATH viene letto all'import
+    os.environ["SONOSPHERE_DB_PATH"] = db_path
+
+    from initialize_db import generate_synthetic_data
+
+    generate_synthetic_data(db_path, args.performances, args.users, tickets=args.users // 2)
+
+    # Le immagini generate dalle route (QR code, ...) sono scritte relativamente alla
+    # directory corrente: si lavora nella directory temporanea per non sporcare static/
+    sys.path.insert(0, ROOT_DIR)
+    os.chdir(work_dir)
+
+    return 0 if run(args.users) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
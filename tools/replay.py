@@ -0,0 +1,331 @@
+"""
+Riproduzione del traffico registrato da utils/capture.py (SONOSPHERE_TRAFFIC_CAPTURE).
+
+Lo strumento legge un file di cattura e reinvia le richieste contro un'istanza locale,
+rispettando gli intervalli tra gli arrivi alla velocità indicata (1 = tempo reale,
+10 = dieci volte più veloce, 0 = senza pause). Senza --url crea un database sintetico e
+avvia wsgi.py su una porta locale come tools/loadtest.py.
+
+La cattura non contiene valori né credenziali: ogni client autenticato viene associato
+a un utente sintetico (un organizzatore se ha usato la gestione delle performance,
+altrimenti un partecipante senza biglietto) con una sessione firmata con la SECRET_KEY,
+gli ID nei percorsi vengono rimappati su righe esistenti e i campi dei form vengono
+riempiti con valori validi. Al termine riporta throughput e percentili per route.
+
+Uso:
+    python -m tools.replay cattura.jsonl [--speed 1] [--concurrency 64] [--output replay.json]
+"""
+
+import argparse
+import itertools
+import json
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Percorsi che identificano un client come organizzatore
+_ORGANIZER_PATH_RE = re.compile(r"^/performances/(management|publish|delete)")
+_DETAIL_RE = re.compile(r"^/performances/(\d+)$")
+_EDIT_RE = re.compile(r"^/performances/management/edit/(\d+)$")
+_ID_RE = re.compile(r"/\d+(?=/|$)")
+
+
+def load_capture(path: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Legge un file di cattura. Se contiene più sessioni di cattura, gli istanti
+    vengono resi consecutivi.
+    """
+
+    records: List[Dict[str, Any]] = []
+    offset = 0.0
+    last = 0.0
+    with open(path) as capture:
+        for line in capture:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if "capture" in record:
+                offset = last
+                continue
+            record["t"] = record["t"] + offset
+            last = record["t"]
+            records.append(record)
+            if limit and len(records) >= limit:
+                break
+
+    records.sort(key=lambda record: record["t"])
+    return records
+
+
+def route_label(record: Dict[str, Any]) -> str:
+    return f"{record['m']} {_ID_RE.sub('/<id>', record['p'])}"
+
+
+class ReplayContext:
+    """Associa i client catturati a utenti sintetici e riempie i form"""
+
+    def __init__(self, base_url: str, db_path: str, records: List[Dict[str, Any]], data: Any) -> None:
+        from app import app
+
+        self.base_url = base_url
+        self.data = data
+        self._serializer = app.session_interface.get_signing_serializer(app)
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+        self._clients: Dict[str, Dict[str, Any]] = {}
+
+        conn = sqlite3.connect(db_path)
+        self._user_ids = dict(conn.execute("SELECT username, id FROM users"))
+        conn.close()
+
+        self._organizer_clients = {
+            record["c"]
+            for record in records
+            if "c" in record and _ORGANIZER_PATH_RE.match(record["p"])
+        }
+
+    def client(self, client_id: Optional[str]) -> Dict[str, Any]:
+        """Utente sintetico e opener HTTP associati a un client della cattura"""
+
+        if client_id is None:
+            return {"opener": self._opener(None), "username": None, "password": None, "drafts": []}
+
+        with self._lock:
+            client = self._clients.get(client_id)
+            if client is None:
+                if client_id in self._organizer_clients and self.data.organizers:
+                    username, password, drafts = self.data.organizers[
+                        len(self._clients) % len(self.data.organizers)
+                    ]
+                else:
+                    username = self.data.next_buyer() or f"utente{self.data.users - 1:07d}"
+                    password, drafts = self.data.password, []
+                client = {
+                    "opener": self._opener(self._user_ids.get(username)),
+                    "username": username,
+                    "password": password,
+                    "drafts": drafts,
+                }
+                self._clients[client_id] = client
+        return client
+
+    def _opener(self, user_id: Optional[int]) -> urllib.request.OpenerDirector:
+        from http.cookiejar import Cookie, CookieJar
+
+        from tools.loadtest import _NoRedirect
+
+        jar = CookieJar()
+        if user_id is not None:
+            session = self._serializer.dumps({"_user_id": str(user_id), "_fresh": True})
+            host = urllib.parse.urlparse(self.base_url).hostname
+            jar.set_cookie(
+                Cookie(0, "session", session, None, False, host, False, False, "/", True,
+                       False, None, False, None, None, {})
+            )
+        return urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar), _NoRedirect())
+
+    def rewrite_path(self, path: str, client: Dict[str, Any]) -> str:
+        """Rimappa gli ID dei percorsi su righe esistenti nel database di replay"""
+
+        match = _EDIT_RE.match(path)
+        if match and client["drafts"]:
+            draft = client["drafts"][int(match.group(1)) % len(client["drafts"])]
+            return f"/performances/management/edit/{draft['id']}"
+
+        match = _DETAIL_RE.match(path)
+        if match and self.data.performance_ids:
+            ids = self.data.performance_ids
+            return f"/performances/{ids[int(match.group(1)) % len(ids)]}"
+
+        return path
+
+    def fill_form(self, path: str, fields: List[str], client: Dict[str, Any]) -> Dict[str, Any]:
+        """Valori validi per i campi del form catturato (i file non vengono inviati)"""
+
+        n = next(self._counter)
+        draft = client["drafts"][n % len(client["drafts"])] if client["drafts"] else {}
+        username = client["username"] or f"utente{n % max(self.data.ticket_holders, 1):07d}"
+        password = client["password"] or self.data.password
+
+        values: Dict[str, Any] = {
+            "usernameoremail": username,
+            "password": password if path == "/auth/login" else "Replay2025!",
+            "remember": "on",
+            "username": f"replay{n}_{os.getpid()}",
+            "name": "Nome",
+            "surname": "Cognome",
+            "email": f"replay{n}_{os.getpid()}@example.com",
+            "role": "0",
+            "current_password": password,
+            "new_password": "",
+            "confirm_password": "",
+            "ticket_type_id": "1",
+            "days": "1",
+            "performance_id": str(draft.get("id", 0)),
+            "is_featured": "0",
+            "artist_name": f"{draft.get('artist_name', 'Replay')}",
+        }
+        for key in ("day_id", "stage_id", "start_time", "duration", "description", "genre_id"):
+            if key in draft:
+                values[key] = draft[key]
+
+        return {
+            field: values.get(field, "")
+            for field in fields
+            if not field.startswith("file:")
+        }
+
+
+def replay(
+    records: List[Dict[str, Any]],
+    context: ReplayContext,
+    speed: float,
+    concurrency: int,
+) -> Any:
+    """
+    Reinvia le richieste rispettando gli istanti di arrivo scalati per speed.
+
+    Returns:
+        Results: Le misure raccolte (vedere tools/loadtest.py)
+        float: Durata della riproduzione in secondi
+        float: Ritardo massimo di invio rispetto alla pianificazione, in secondi
+    """
+
+    from tools.loadtest import Results
+
+    results = Results()
+    max_lag = [0.0]
+
+    def send(record: Dict[str, Any], planned: float) -> None:
+        max_lag[0] = max(max_lag[0], time.perf_counter() - planned)
+        client = context.client(record.get("c"))
+        path = context.rewrite_path(record["p"], client)
+        query = urllib.parse.urlencode(record.get("q", {}))
+        url = context.base_url + path + (f"?{query}" if query else "")
+        body = None
+        if record["m"] == "POST":
+            body = urllib.parse.urlencode(context.fill_form(path, record.get("f", []), client)).encode()
+
+        start = time.perf_counter()
+        try:
+            with client["opener"].open(urllib.request.Request(url, body, method=record["m"]), timeout=60) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            status = e.code
+        except (urllib.error.URLError, OSError):
+            status = 0
+        results.add(route_label(record), time.perf_counter() - start, status, status == 0 or status >= 500)
+
+    first = records[0]["t"] if records else 0.0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for record in records:
+            planned = start + (record["t"] - first) / speed if speed > 0 else time.perf_counter()
+            delay = planned - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(send, record, planned)
+
+    return results, time.perf_counter() - start, max_lag[0]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("capture", help="file di cattura JSON lines")
+    parser.add_argument("--speed", type=float, default=1.0, help="1 = tempo reale, 0 = senza pause")
+    parser.add_argument("--concurrency", type=int, default=64, help="richieste contemporanee al massimo")
+    parser.add_argument("--limit", type=int, help="numero massimo di richieste da riprodurre")
+    parser.add_argument("--threads", type=int, default=4, help="thread di waitress per ogni worker")
+    parser.add_argument("--workers", type=int, default=1, help="processi worker di wsgi.py")
+    parser.add_argument("--performances", type=int, default=500)
+    parser.add_argument("--db-users", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--url", help="server già avviato da usare (con il suo database, vedere --db)")
+    parser.add_argument("--db", help="database del server indicato con --url")
+    parser.add_argument("--output", help="file JSON in cui scrivere i risultati")
+    args = parser.parse_args()
+
+    records = load_capture(args.capture, args.limit)
+    if not records:
+        parser.error("la cattura non contiene richieste")
+
+    work_dir = tempfile.mkdtemp(prefix="sonosphere-replay-")
+    tickets = args.db_users // 2
+    process = None
+
+    if args.url:
+        if not args.db:
+            parser.error("con --url va indicato anche --db")
+        db_path, base_url = args.db, args.url.rstrip("/")
+        os.environ["SONOSPHERE_DB_PATH"] = db_path
+        sys.path.insert(0, ROOT_DIR)
+    else:
+        db_path = os.path.join(work_dir, "replay.db")
+        # Deve precedere qualsiasi import di utils: DB_PATH viene letto all'import
+        os.environ["SONOSPHERE_DB_PATH"] = db_path
+        sys.path.insert(0, ROOT_DIR)
+        from tools.loadtest import _free_port, start_server
+        from initialize_db import generate_synthetic_data
+
+        generate_synthetic_data(db_path, args.performances, args.db_users, tickets, args.seed)
+        port = _free_port()
+        server_args = ["--threads", str(args.threads), "--workers", str(args.workers)]
+        process = start_server(db_path, work_dir, port, server_args)
+        base_url = f"http://127.0.0.1:{port}"
+
+    from tools.loadtest import Dataset, _git_commit, print_report, summarize
+
+    span = records[-1]["t"] - records[0]["t"]
+    print(
+        f"Riproduzione di {len(records)} richieste ({span:.1f} s registrati) su {base_url}, "
+        f"velocità {'massima' if args.speed <= 0 else f'{args.speed:g}x'}"
+    )
+
+    try:
+        context = ReplayContext(base_url, db_path, records, Dataset(db_path, args.db_users, tickets))
+        results, elapsed, max_lag = replay(records, context, args.speed, args.concurrency)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+
+    report = summarize(results, elapsed)
+    report["meta"] = {
+        "commit": _git_commit(),
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "capture": os.path.abspath(args.capture),
+        "elapsed": round(elapsed, 3),
+        "max_lag": round(max_lag, 3),
+        "args": vars(args),
+    }
+
+    print_report(report)
+    print(f"Durata: {elapsed:.1f} s, ritardo massimo di invio {max_lag * 1000:.0f} ms")
+    if args.speed > 0 and max_lag > 1:
+        print("Attenzione: il generatore non ha tenuto il ritmo, aumentare --concurrency o ridurre --speed")
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+        print(f"Risultati scritti in {args.output}")
+
+    return 1 if report["total"]["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,238 @@
+"""
+Misura il cold start dell'applicazione e verifica che resti entro un budget.
+
+Lo strumento esegue in processi Python nuovi:
+
+- l'import di app.py con -X importtime, riportando i moduli più costosi (tempo
+  cumulativo e proprio) e verificando che i moduli pesanti caricati in modo lazy
+  dalle route (LAZY_MODULES) non vengano importati all'avvio;
+- l'avvio di wsgi.py, misurando il tempo tra la creazione del processo e la prima
+  risposta a GET / (time-to-first-response) e leggendo da /admin/metrics le fasi
+  misurate dall'applicazione (sonosphere_startup_seconds).
+
+Ogni misura viene ripetuta --runs volte e si considera la mediana. Esce con codice 1
+se un modulo lazy viene importato all'avvio o se la mediana supera --import-budget
+o --budget (in millisecondi).
+
+Uso:
+    python -m tools.startup_report [--runs 5] [--budget 1500] [--import-budget 800]
+"""
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from collections import defaultdict
+from typing import Any, Dict, List, Tuple
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Moduli che devono essere importati solo dalle route che li usano
+LAZY_MODULES = ("PIL", "qrcode")
+ADMIN_TOKEN = "startup-report"
+STARTUP_TIMEOUT = 30
+# Intervallo tra i tentativi di connessione durante l'avvio del server, in secondi
+POLL_INTERVAL = 0.005
+
+_IMPORTTIME_RE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+_STARTUP_METRIC_RE = re.compile(r'^sonosphere_startup_seconds\{phase="(\w+)"\} (\S+)$', re.M)
+
+
+def _env(db_path: str, **extra: str) -> Dict[str, str]:
+    env = dict(os.environ, SONOSPHERE_DB_PATH=db_path, **extra)
+    env.pop("SONOSPHERE_TRAFFIC_CAPTURE", None)
+    env["PYTHONPATH"] = ROOT_DIR + os.pathsep + env.get("PYTHONPATH", "")
+    # Senza bytecode in cache l'avvio non sarebbe rappresentativo dei riavvii in produzione
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    return env
+
+
+def measure_import(db_path: str, work_dir: str) -> Tuple[float, List[Tuple[str, int, int, int]]]:
+    """
+    Importa app.py in un processo nuovo con -X importtime.
+
+    Returns:
+        float: Durata dell'import di app in secondi
+        list: Righe (modulo, livello, tempo proprio in µs, tempo cumulativo in µs)
+    """
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"],
+        cwd=work_dir,
+        env=_env(db_path),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    modules = []
+    total = 0.0
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME_RE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us = int(match.group(1)), int(match.group(2))
+        level = len(match.group(3)) // 2
+        name = match.group(4)
+        modules.append((name, level, self_us, cumulative_us))
+        if name == "app" and level == 0:
+            total = cumulative_us / 1e6
+    return total, modules
+
+
+def measure_first_response(db_path: str, work_dir: str) -> Tuple[float, Dict[str, float]]:
+    """
+    Avvia wsgi.py e misura il tempo fino alla prima risposta a GET /.
+
+    Returns:
+        float: Secondi tra la creazione del processo e la prima risposta
+        dict: Fasi misurate dall'applicazione (sonosphere_startup_seconds)
+    """
+
+    from tools.loadtest import _free_port
+
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT_DIR, "wsgi.py"), "--host", "127.0.0.1", "--port", str(port)],
+        cwd=work_dir,
+        env=_env(db_path, SONOSPHERE_ADMIN_TOKEN=ADMIN_TOKEN),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+    try:
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError("Il server è terminato durante l'avvio")
+            if time.perf_counter() - start > STARTUP_TIMEOUT:
+                raise RuntimeError("Il server non ha risposto entro il tempo massimo di avvio")
+            try:
+                urllib.request.urlopen(base_url + "/", timeout=5).read()
+                break
+            except OSError:
+                time.sleep(POLL_INTERVAL)
+        elapsed = time.perf_counter() - start
+
+        request = urllib.request.Request(
+            base_url + "/admin/metrics", headers={"Authorization": f"Bearer {ADMIN_TOKEN}"}
+        )
+        with urllib.request.urlopen(request, timeout=5) as response:
+            exposition = response.read().decode()
+        phases = {
+            phase: float(value) for phase, value in _STARTUP_METRIC_RE.findall(exposition)
+        }
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+    return elapsed, phases
+
+
+def summarize_imports(modules: List[Tuple[str, int, int, int]], top: int) -> Dict[str, Any]:
+    """Moduli con il maggior tempo cumulativo (dipendenze dirette di app) e proprio"""
+
+    packages: Dict[str, int] = defaultdict(int)
+    for name, _, self_us, _ in modules:
+        packages[name.split(".")[0]] += self_us
+
+    direct = [(name, cumulative) for name, level, _, cumulative in modules if level == 1]
+    return {
+        "direct": sorted(direct, key=lambda item: -item[1])[:top],
+        "packages": sorted(packages.items(), key=lambda item: -item[1])[:top],
+        "lazy_imported": sorted(
+            {name for name, _, _, _ in modules if name.split(".")[0] in LAZY_MODULES}
+        ),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="ripetizioni di ogni misura")
+    parser.add_argument("--top", type=int, default=12, help="moduli da riportare")
+    parser.add_argument("--budget", type=float, default=1500, help="ms massimi fino alla prima risposta")
+    parser.add_argument("--import-budget", type=float, default=800, help="ms massimi per l'import di app")
+    parser.add_argument("--output", help="file JSON in cui scrivere i risultati")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="sonosphere-startup-")
+    db_path = os.path.join(work_dir, "startup.db")
+    # Deve precedere qualsiasi import di utils: DB_PATH viene letto all'import
+    os.environ["SONOSPHERE_DB_PATH"] = db_path
+    sys.path.insert(0, ROOT_DIR)
+    from initialize_db import generate_synthetic_data
+
+    generate_synthetic_data(db_path)
+
+    # Un primo import non misurato compila il bytecode dei moduli dell'applicazione
+    measure_import(db_path, work_dir)
+
+    import_times: List[float] = []
+    modules: List[Tuple[str, int, int, int]] = []
+    for _ in range(args.runs):
+        total, modules = measure_import(db_path, work_dir)
+        import_times.append(total)
+
+    first_responses: List[float] = []
+    phases: Dict[str, List[float]] = defaultdict(list)
+    for _ in range(args.runs):
+        elapsed, run_phases = measure_first_response(db_path, work_dir)
+        first_responses.append(elapsed)
+        for phase, value in run_phases.items():
+            phases[phase].append(value)
+
+    imports = summarize_imports(modules, args.top)
+    report = {
+        "import_ms": round(statistics.median(import_times) * 1000, 1),
+        "first_response_ms": round(statistics.median(first_responses) * 1000, 1),
+        "phases_ms": {
+            phase: round(statistics.median(values) * 1000, 1) for phase, values in phases.items()
+        },
+        "imports": imports,
+        "runs": args.runs,
+    }
+
+    print(f"Import di app: mediana {report['import_ms']:.0f} ms su {args.runs} esecuzioni")
+    print("\nDipendenze dirette di app per tempo cumulativo:")
+    for name, cumulative in imports["direct"]:
+        print(f"  {name:<40} {cumulative / 1000:>8.1f} ms")
+    print("\nPacchetti per tempo di import proprio:")
+    for name, self_us in imports["packages"]:
+        print(f"  {name:<40} {self_us / 1000:>8.1f} ms")
+
+    print(f"\nPrima risposta a GET /: mediana {report['first_response_ms']:.0f} ms dalla creazione del processo")
+    for phase, value in report["phases_ms"].items():
+        print(f"  {phase:<40} {value:>8.1f} ms dall'import di app.py")
+
+    failures: List[str] = []
+    if imports["lazy_imported"]:
+        failures.append(f"moduli lazy importati all'avvio: {', '.join(imports['lazy_imported'])}")
+    if report["import_ms"] > args.import_budget:
+        failures.append(f"import di app {report['import_ms']:.0f} ms > budget {args.import_budget:.0f} ms")
+    if report["first_response_ms"] > args.budget:
+        failures.append(f"prima risposta {report['first_response_ms']:.0f} ms > budget {args.budget:.0f} ms")
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+        print(f"\nRisultati scritti in {args.output}")
+
+    if failures:
+        print("\nFALLITO:")
+        for failure in failures:
+            print(f"  {failure}")
+        return 1
+
+    print("\nAvvio entro il budget")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,297 @@
+import math
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional
+
+from werkzeug.wsgi import ClosingIterator
+
+from utils import metrics
+from utils.logger import get_logger
+
+logger = get_logger()
+
+# Attesa massima in coda prima di rispondere 503, in secondi
+DEFAULT_MAX_QUEUE_WAIT = 2.0
+# Peso dell'ultima osservazione nella media mobile del tempo di servizio
+SERVICE_TIME_ALPHA = 0.1
+# Limiti del valore di Retry-After, in secondi
+MIN_RETRY_AFTER = 1
+MAX_RETRY_AFTER = 30
+
+_LINEUP_RE = re.compile(r"^/(|info|lineup|performances/\d+)$")
+
+# Controllore attivo nel processo, esposto da /admin/admission
+active_controller: Optional["AdmissionController"] = None
+
+_SHED_BODY = (
+    "<!doctype html><html lang=\"it\"><head><meta charset=\"utf-8\">"
+    "<title>Sonosphere - Troppe richieste</title></head><body>"
+    "<h1>Troppe richieste in questo momento</h1>"
+    "<p>Il servizio è momentaneamente sovraccarico. Riprova tra qualche secondo.</p>"
+    "</body></html>"
+).encode()
+
+
+class RouteClass(NamedTuple):
+    """Budget di una classe di route"""
+
+    name: str
+    # Richieste della classe servite contemporaneamente al massimo
+    limit: int
+    # Richieste della classe in attesa al massimo
+    queue: int
+    # A parità di condizioni le classi con priorità più alta vengono servite prima
+    priority: int
+    # Se False la classe non occupa la capacità condivisa (es. file statici)
+    shared: bool = True
+
+
+def default_classes(capacity: int) -> Dict[str, RouteClass]:
+    """
+    Budget predefiniti per una capacità totale: l'acquisto ha la priorità più alta e
+    può usare tutta la capacità, la navigazione anonima ne lascia sempre una parte
+    libera, login e registrazione (scrypt) ne usano al massimo metà.
+
+    Parameters:
+        capacity (int): Richieste servite contemporaneamente al massimo
+
+    Returns:
+        dict: Classi di route per nome
+    """
+
+    return {
+        "purchase": RouteClass("purchase", capacity, capacity * 8, 3),
+        "auth": RouteClass("auth", max(1, capacity // 2), capacity * 4, 2),
+        "other": RouteClass("other", capacity, capacity * 4, 1),
+        "lineup": RouteClass("lineup", max(1, capacity * 3 // 4), capacity * 2, 0),
+        "static": RouteClass("static", capacity * 2, capacity * 2, 0, shared=False),
+    }
+
+
+def classify(method: str, path: str) -> Optional[str]:
+    """
+    Classe di una richiesta in base al percorso. Restituisce None per gli endpoint
+    di amministrazione, che non sono mai soggetti a limitazione.
+    """
+
+    if path.startswith("/static/"):
+        return "static"
+    if path.startswith("/admin/"):
+        return None
+    if path.startswith("/tickets/waiting"):
+        # Pagina di attesa e polling sono leggeri: non devono occupare i posti dell'acquisto
+        return "lineup"
+    if path.startswith("/tickets"):
+        return "purchase"
+    if path.startswith("/auth/"):
+        return "auth"
+    if method in ("GET", "HEAD") and _LINEUP_RE.match(path):
+        return "lineup"
+    return "other"
+
+
+class _Waiter:
+    __slots__ = ("route_class", "seq", "event", "admitted")
+
+    def __init__(self, route_class: RouteClass, seq: int) -> None:
+        self.route_class = route_class
+        self.seq = seq
+        self.event = threading.Event()
+        self.admitted = False
+
+
+class AdmissionController:
+    """
+    Limita le richieste servite contemporaneamente per classe di route e in totale.
+
+    Le richieste oltre il limite attendono in coda, servite per priorità della classe
+    e poi in ordine di arrivo. Una richiesta viene rifiutata subito se la coda della
+    sua classe è piena o se l'attesa stimata supera max_wait, altrimenti dopo max_wait
+    secondi di attesa.
+    """
+
+    def __init__(
+        self,
+        capacity: int,
+        classes: Optional[Dict[str, RouteClass]] = None,
+        max_wait: float = DEFAULT_MAX_QUEUE_WAIT,
+    ) -> None:
+        self.capacity = capacity
+        self.classes = classes or default_classes(capacity)
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._in_flight: Dict[str, int] = {name: 0 for name in self.classes}
+        self._queued: Dict[str, int] = {name: 0 for name in self.classes}
+        self._shared_in_flight = 0
+        self._waiters: List[_Waiter] = []
+        self._seq = 0
+        # Media mobile del tempo di servizio per classe, per stimare l'attesa
+        self._service_time: Dict[str, float] = {name: 0.05 for name in self.classes}
+
+    def acquire(self, name: str) -> Optional[float]:
+        """
+        Attende un posto per una richiesta della classe indicata.
+
+        Returns:
+            float: Secondi di attesa in coda, o None se la richiesta va rifiutata
+        """
+
+        route_class = self.classes[name]
+        start = time.perf_counter()
+
+        with self._lock:
+            if not self._queued[name] and self._can_run(route_class):
+                self._start(route_class)
+                return 0.0
+
+            if self._queued[name] >= route_class.queue:
+                metrics.ADMISSION_SHED.inc((name, "queue_full"))
+                return None
+            if self._estimated_wait(route_class) > self.max_wait:
+                metrics.ADMISSION_SHED.inc((name, "latency"))
+                return None
+
+            self._seq += 1
+            waiter = _Waiter(route_class, self._seq)
+            self._waiters.append(waiter)
+            self._waiters.sort(key=lambda w: (-w.route_class.priority, w.seq))
+            self._queued[name] += 1
+            metrics.ADMISSION_QUEUED.set(self._queued[name], (name,))
+
+        waiter.event.wait(self.max_wait)
+
+        with self._lock:
+            if not waiter.admitted:
+                self._waiters.remove(waiter)
+                self._queued[name] -= 1
+                metrics.ADMISSION_QUEUED.set(self._queued[name], (name,))
+                metrics.ADMISSION_SHED.inc((name, "timeout"))
+                return None
+
+        waited = time.perf_counter() - start
+        metrics.ADMISSION_WAIT.observe(waited, (name,))
+        return waited
+
+    def release(self, name: str, service_time: float) -> None:
+        """Libera il posto di una richiesta terminata e ammette le richieste in coda"""
+
+        route_class = self.classes[name]
+        with self._lock:
+            self._in_flight[name] -= 1
+            if route_class.shared:
+                self._shared_in_flight -= 1
+            metrics.ADMISSION_IN_FLIGHT.set(self._in_flight[name], (name,))
+            self._service_time[name] += SERVICE_TIME_ALPHA * (
+                service_time - self._service_time[name]
+            )
+            self._dispatch()
+
+    def retry_after(self, name: str) -> int:
+        """Secondi suggeriti al client prima di riprovare (header Retry-After)"""
+
+        with self._lock:
+            estimate = self._estimated_wait(self.classes[name])
+        return max(MIN_RETRY_AFTER, min(MAX_RETRY_AFTER, math.ceil(estimate)))
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "capacity": self.capacity,
+                "in_flight": self._shared_in_flight,
+                "max_wait": self.max_wait,
+                "classes": {
+                    name: {
+                        "limit": route_class.limit,
+                        "queue": route_class.queue,
+                        "priority": route_class.priority,
+                        "in_flight": self._in_flight[name],
+                        "queued": self._queued[name],
+                        "service_time_ms": round(self._service_time[name] * 1000, 2),
+                    }
+                    for name, route_class in self.classes.items()
+                },
+            }
+
+    def _can_run(self, route_class: RouteClass) -> bool:
+        if self._in_flight[route_class.name] >= route_class.limit:
+            return False
+        return not route_class.shared or self._shared_in_flight < self.capacity
+
+    def _start(self, route_class: RouteClass) -> None:
+        self._in_flight[route_class.name] += 1
+        if route_class.shared:
+            self._shared_in_flight += 1
+        metrics.ADMISSION_IN_FLIGHT.set(self._in_flight[route_class.name], (route_class.name,))
+
+    def _dispatch(self) -> None:
+        # Le attese sono ordinate per priorità e arrivo: vengono ammesse le prime che possono partire
+        for waiter in list(self._waiters):
+            if self._can_run(waiter.route_class):
+                self._waiters.remove(waiter)
+                name = waiter.route_class.name
+                self._queued[name] -= 1
+                metrics.ADMISSION_QUEUED.set(self._queued[name], (name,))
+                self._start(waiter.route_class)
+                waiter.admitted = True
+                waiter.event.set()
+
+    def _estimated_wait(self, route_class: RouteClass) -> float:
+        # Richieste da servire prima di questa, smaltite dai posti disponibili per la classe
+        ahead = sum(
+            1 for waiter in self._waiters if waiter.route_class.priority >= route_class.priority
+        )
+        slots = route_class.limit if not route_class.shared else min(route_class.limit, self.capacity)
+        return (ahead + 1) * self._service_time[route_class.name] / max(1, slots)
+
+
+class AdmissionMiddleware:
+    """
+    Middleware WSGI che applica il controllo di ammissione: le richieste rifiutate
+    ricevono subito 503 con Retry-After invece di restare in coda in waitress.
+    """
+
+    def __init__(self, app: Callable, controller: AdmissionController) -> None:
+        global active_controller
+
+        self.app = app
+        self.controller = controller
+        active_controller = controller
+        logger.info(
+            f"Controllo di ammissione attivo: capacità {controller.capacity}, "
+            f"attesa massima {controller.max_wait:g} s"
+        )
+
+    def __call__(self, environ: Dict[str, Any], start_response: Callable) -> Iterable[bytes]:
+        name = classify(environ.get("REQUEST_METHOD", "GET"), environ.get("PATH_INFO", "/"))
+        if name is None:
+            return self.app(environ, start_response)
+
+        if self.controller.acquire(name) is None:
+            retry_after = self.controller.retry_after(name)
+            start_response(
+                "503 Service Unavailable",
+                [
+                    ("Content-Type", "text/html; charset=utf-8"),
+                    ("Content-Length", str(len(_SHED_BODY))),
+                    ("Retry-After", str(retry_after)),
+                    ("Cache-Control", "no-store"),
+                ],
+            )
+            return [_SHED_BODY]
+
+        start = time.perf_counter()
+        released = False
+
+        def release() -> None:
+            nonlocal released
+            if not released:
+                released = True
+                self.controller.release(name, time.perf_counter() - start)
+
+        try:
+            # Il posto viene liberato quando la risposta è stata inviata per intero
+            return ClosingIterator(self.app(environ, start_response), release)
+        except BaseException:
+            release()
+            raise
@@ -0,0 +1,189 @@
+import atexit
+import base64
+import hashlib
+import io
+import json
+import os
+import queue
+import threading
+import time
+import zlib
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from urllib.parse import parse_qsl
+
+from werkzeug.formparser import parse_form_data
+
+from utils.logger import get_logger
+
+logger = get_logger()
+
+# Il corpo delle richieste viene letto per ricavare i nomi dei campi solo sotto questa soglia
+CAPTURE_MAX_BODY = 1024 * 1024
+# Parametri della query il cui valore viene conservato: gli altri vengono sostituiti da ""
+CAPTURE_SAFE_QUERY_PARAMS = frozenset({"day_id", "stage_id", "from", "source_name", "thread"})
+# Ogni quanto il thread di scrittura svuota il buffer su disco, in secondi
+CAPTURE_FLUSH_INTERVAL = 1.0
+
+
+class TrafficCaptureMiddleware:
+    """
+    Middleware WSGI che registra i metadati delle richieste in un file JSON lines
+    in sola aggiunta, per poterle riprodurre con tools/replay.py.
+
+    Ogni riga contiene l'istante relativo all'avvio della cattura ("t", in secondi),
+    metodo, percorso, parametri della query (valori conservati solo per quelli in
+    CAPTURE_SAFE_QUERY_PARAMS), nomi dei campi del form e dei file, un identificativo
+    anonimo del client derivato dal cookie di sessione, stato e durata della risposta.
+    Valori dei form, cookie, header e indirizzi non vengono mai scritti.
+    La scrittura avviene in un thread separato, le richieste non attendono il disco.
+    """
+
+    def __init__(self, app: Callable, path: str) -> None:
+        self.app = app
+        self.path = path
+        self._start = time.monotonic()
+        # Sale casuale per catture diverse: gli identificativi dei client non sono collegabili
+        self._salt = os.urandom(16)
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "a") as capture:
+            capture.write(
+                json.dumps({"capture": "start", "date": time.strftime("%Y-%m-%d %H:%M:%S")}) + "\n"
+            )
+
+        self._start_writer()
+        if hasattr(os, "register_at_fork"):
+            # Nei worker creati con fork (wsgi.py --workers) il thread di scrittura va ricreato
+            os.register_at_fork(after_in_child=self._start_writer)
+        atexit.register(self.close)
+        logger.info(f"Cattura del traffico attiva su {path}")
+
+    def __call__(self, environ: Dict[str, Any], start_response: Callable) -> Iterable[bytes]:
+        arrival = time.monotonic()
+        record: Dict[str, Any] = {
+            "t": round(arrival - self._start, 4),
+            "m": environ.get("REQUEST_METHOD", "GET"),
+            "p": environ.get("PATH_INFO", "/"),
+        }
+
+        query = self._sanitize_query(environ.get("QUERY_STRING", ""))
+        if query:
+            record["q"] = query
+
+        client = self._client_id(environ.get("HTTP_COOKIE", ""))
+        if client:
+            record["c"] = client
+
+        if record["m"] in ("POST", "PUT", "PATCH"):
+            fields = self._form_fields(environ)
+            if fields:
+                record["f"] = fields
+
+        status_holder: List[str] = []
+
+        def capture_start_response(status, headers, exc_info=None):
+            status_holder.append(status)
+            return start_response(status, headers, exc_info)
+
+        try:
+            return self.app(environ, capture_start_response)
+        finally:
+            record["s"] = int(status_holder[0].split(" ", 1)[0]) if status_holder else 500
+            record["d"] = round((time.monotonic() - arrival) * 1000, 2)
+            self._queue.put(json.dumps(record, separators=(",", ":")))
+
+    def close(self) -> None:
+        """Scrive le righe in attesa e ferma il thread di scrittura"""
+
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
+
+    def _start_writer(self) -> None:
+        self._queue: "queue.SimpleQueue[Optional[str]]" = queue.SimpleQueue()
+        self._writer = threading.Thread(
+            target=self._write_loop, name="sonosphere-capture", daemon=True
+        )
+        self._writer.start()
+
+    def _write_loop(self) -> None:
+        # Ogni blocco di righe complete è scritto con una sola write in O_APPEND:
+        # più processi possono aggiungere righe allo stesso file senza mescolarle
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        pending: List[str] = []
+        last_flush = time.monotonic()
+        try:
+            while True:
+                try:
+                    line = self._queue.get(timeout=CAPTURE_FLUSH_INTERVAL)
+                except queue.Empty:
+                    line = ""
+                if line is None:
+                    break
+                if line:
+                    pending.append(line)
+                if pending and time.monotonic() - last_flush >= CAPTURE_FLUSH_INTERVAL:
+                    os.write(fd, ("\n".join(pending) + "\n").encode())
+                    pending.clear()
+                    last_flush = time.monotonic()
+        finally:
+            if pending:
+                os.write(fd, ("\n".join(pending) + "\n").encode())
+            os.close(fd)
+
+    @staticmethod
+    def _sanitize_query(query_string: str) -> Dict[str, str]:
+        return {
+            key: value if key in CAPTURE_SAFE_QUERY_PARAMS else ""
+            for key, value in parse_qsl(query_string, keep_blank_values=True)
+        }
+
+    def _client_id(self, cookie_header: str) -> Optional[str]:
+        # Il cookie di sessione cambia ad ogni modifica della sessione (es. messaggi flash):
+        # l'identificativo deriva dall'utente autenticato, stabile per tutta la visita
+        for cookie in cookie_header.split(";"):
+            name, _, value = cookie.strip().partition("=")
+            if name == "session" and value:
+                user_id = _session_user_id(value)
+                if user_id is not None:
+                    return hashlib.blake2b(
+                        user_id.encode(), key=self._salt, digest_size=6
+                    ).hexdigest()
+        return None
+
+    @staticmethod
+    def _form_fields(environ: Dict[str, Any]) -> List[str]:
+        try:
+            length = int(environ.get("CONTENT_LENGTH") or 0)
+        except ValueError:
+            return []
+        if not 0 < length <= CAPTURE_MAX_BODY:
+            return []
+
+        # Il corpo viene letto e poi restituito all'applicazione tramite un nuovo stream
+        body = environ["wsgi.input"].read(length)
+        environ["wsgi.input"] = io.BytesIO(body)
+
+        parse_environ = dict(environ, **{"wsgi.input": io.BytesIO(body)})
+        _, form, files = parse_form_data(parse_environ)
+        return sorted(set(form.keys()) | {f"file:{name}" for name in files.keys()})
+
+
+def _session_user_id(cookie: str) -> Optional[str]:
+    """
+    Legge _user_id dal cookie di sessione di Flask senza verificarne la firma:
+    il contenuto è solo codificato, non cifrato, e serve unicamente a raggruppare
+    le richieste dello stesso utente.
+    """
+
+    compressed = cookie.startswith(".")
+    payload = cookie[1:] if compressed else cookie
+    payload = payload.split(".", 1)[0]
+    try:
+        data = base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4))
+        if compressed:
+            data = zlib.decompress(data)
+        user_id = json.loads(data).get("_user_id")
+    except (ValueError, zlib.error, AttributeError):
+        return None
+    return str(user_id) if user_id is not None else None
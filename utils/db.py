@@ -0,0 +1,303 @@
+import random
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+from functools import lru_cache
+from typing import Any, Callable, Iterable, List, Optional, Tuple
+
+from utils import metrics
+from utils.logger import get_logger
+from utils.vars import DB_PATH, ROOT_PATH
+
+logger = get_logger()
+
+# Gli statement più lenti di questa soglia (in secondi) vengono registrati nel log
+SLOW_QUERY_THRESHOLD = 0.1
+# In debug viene segnalata ogni richiesta che ripete lo stesso statement più di N volte
+REPEATED_STATEMENT_THRESHOLD = 3
+# busy_timeout delle connessioni: attesa del lock dentro SQLite per ogni tentativo, in secondi
+BUSY_TIMEOUT = 1.0
+# Tentativi ripetuti di uno statement che trova il database bloccato, prima di DatabaseBusyError
+BUSY_RETRIES = 4
+# Attesa tra i tentativi: backoff esponenziale con jitter completo, in secondi
+BUSY_BACKOFF_BASE = 0.05
+BUSY_BACKOFF_MAX = 1.0
+
+_local = threading.local()
+# Funzione chiamata con (sql, parametri) per ogni statement eseguito, usata dagli strumenti di analisi
+_statement_hook: Optional[Callable[[str, Any], None]] = None
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+
+
+class DatabaseBusyError(sqlite3.OperationalError):
+    """
+    Il database è rimasto bloccato da altre connessioni anche dopo BUSY_RETRIES tentativi.
+    Le route la trasformano in una risposta 503: la richiesta si può ripetere più tardi.
+    """
+
+
+def is_busy_error(error: BaseException) -> bool:
+    """True se l'errore è SQLITE_BUSY o SQLITE_LOCKED (anche nelle varianti estese)"""
+
+    if not isinstance(error, sqlite3.OperationalError):
+        return False
+    code = getattr(error, "sqlite_errorcode", None)
+    if code is not None:
+        return code & 0xFF in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    return "locked" in str(error) or "busy" in str(error)
+
+
+def _execute_with_retry(call: Callable[[str, Any], Any], sql: str, parameters: Any) -> Any:
+    # Ogni tentativo attende il lock fino a BUSY_TIMEOUT dentro SQLite; in caso di SQLITE_BUSY
+    # lo statement viene ripetuto dopo un'attesa casuale crescente. Con BEGIN IMMEDIATE il lock
+    # si ottiene all'inizio della transazione: ripetere BEGIN, COMMIT o uno statement fuori
+    # da una transazione è sicuro.
+    start = time.perf_counter()
+    retries = 0
+    while True:
+        try:
+            result = call(sql, parameters)
+        except sqlite3.OperationalError as e:
+            if not is_busy_error(e):
+                raise
+            if retries >= BUSY_RETRIES:
+                waited = time.perf_counter() - start
+                metrics.DB_LOCK_WAIT.observe(waited)
+                metrics.DB_BUSY_ERRORS.inc((normalize_statement(sql),))
+                logger.error(
+                    f"Database bloccato dopo {retries} nuovi tentativi ({waited * 1000:.0f} ms): "
+                    f"{normalize_statement(sql)}"
+                )
+                raise DatabaseBusyError(str(e)) from e
+
+            retries += 1
+            metrics.DB_BUSY_RETRIES.inc((normalize_statement(sql),))
+            time.sleep(random.uniform(0, min(BUSY_BACKOFF_MAX, BUSY_BACKOFF_BASE * 2 ** retries)))
+            continue
+
+        if retries:
+            metrics.DB_LOCK_WAIT.observe(time.perf_counter() - start)
+        return result
+
+
+class QueryStats:
+    """
+    Statistiche delle query eseguite dal thread corrente durante una richiesta.
+
+    Attributes:
+        endpoint (str): Endpoint Flask che sta eseguendo le query.
+        count (int): Numero di statement eseguiti.
+        time (float): Tempo totale passato in SQLite, in secondi.
+        statements (Counter): Esecuzioni per statement normalizzato, solo se richiesto.
+    """
+
+    __slots__ = ("endpoint", "count", "time", "statements")
+
+    def __init__(self, endpoint: str, track_statements: bool) -> None:
+        self.endpoint = endpoint
+        self.count = 0
+        self.time = 0.0
+        self.statements: Optional[Counter] = Counter() if track_statements else None
+
+
+@lru_cache(maxsize=512)
+def normalize_statement(sql: str) -> str:
+    """
+    Normalizza uno statement SQL sostituendo i letterali con "?" e compattando
+    gli spazi, così che esecuzioni con parametri diversi risultino uguali.
+
+    Parameters:
+        sql (str): Lo statement SQL
+
+    Returns:
+        str: Lo statement normalizzato
+    """
+
+    sql = _LITERAL_RE.sub("?", sql)
+    sql = _IN_LIST_RE.sub("(?)", sql)
+    return _WHITESPACE_RE.sub(" ", sql).strip()
+
+
+def begin_request_stats(
+    endpoint: str = "<fuori richiesta>", track_statements: bool = False
+) -> QueryStats:
+    """
+    Inizia a raccogliere le statistiche delle query per il thread corrente.
+
+    Parameters:
+        endpoint (str): Endpoint che sta servendo la richiesta, riportato nei log delle query lente
+        track_statements (bool): Se True conta le esecuzioni di ogni statement per individuare pattern N+1
+
+    Returns:
+        QueryStats: Le statistiche, aggiornate ad ogni query.
+    """
+
+    stats = QueryStats(endpoint, track_statements)
+    _local.stats = stats
+    return stats
+
+
+def end_request_stats() -> Optional[QueryStats]:
+    """
+    Termina la raccolta delle statistiche per il thread corrente, segnalando nel log
+    gli statement ripetuti più di REPEATED_STATEMENT_THRESHOLD volte.
+
+    Returns:
+        QueryStats: Le statistiche raccolte, o None se la raccolta non era attiva.
+    """
+
+    stats = getattr(_local, "stats", None)
+    _local.stats = None
+
+    if stats is not None:
+        for sql, executions in repeated_statements(stats):
+            logger.warning(
+                f"Possibile N+1 in {stats.endpoint}: statement eseguito {executions} volte: {sql}"
+            )
+
+    return stats
+
+
+def get_request_stats() -> Optional[QueryStats]:
+    """Restituisce le statistiche in raccolta nel thread corrente, se attive"""
+
+    return getattr(_local, "stats", None)
+
+
+def swap_request_stats(stats: Optional[QueryStats]) -> Optional[QueryStats]:
+    """
+    Attribuisce le query del thread corrente alle statistiche indicate, usato dal thread
+    di scrittura per contare le query nella richiesta che le ha inviate.
+
+    Parameters:
+        stats (QueryStats, optional): Le statistiche da aggiornare, None per nessuna
+
+    Returns:
+        QueryStats: Le statistiche attive in precedenza, da ripristinare al termine
+    """
+
+    previous = getattr(_local, "stats", None)
+    _local.stats = stats
+    return previous
+
+
+def repeated_statements(
+    stats: QueryStats, threshold: int = REPEATED_STATEMENT_THRESHOLD
+) -> List[Tuple[str, int]]:
+    """
+    Restituisce gli statement eseguiti più di threshold volte durante una richiesta.
+
+    Parameters:
+        stats (QueryStats): Statistiche raccolte con track_statements=True
+        threshold (int): Numero massimo di ripetizioni tollerate
+
+    Returns:
+        list: Coppie (statement normalizzato, numero di esecuzioni)
+    """
+
+    if not stats.statements:
+        return []
+
+    return [
+        (sql, executions)
+        for sql, executions in stats.statements.most_common()
+        if executions > threshold
+    ]
+
+
+def set_statement_hook(hook: Optional[Callable[[str, Any], None]]) -> None:
+    """
+    Imposta una funzione da chiamare con (sql, parametri) per ogni statement eseguito
+    dai DAO. Pensata per gli strumenti di analisi, non per l'uso durante il servizio.
+
+    Parameters:
+        hook (callable, optional): La funzione da chiamare, None per disattivarla
+    """
+
+    global _statement_hook
+    _statement_hook = hook
+
+
+def _record(elapsed: float, sql: Optional[str] = None) -> None:
+    stats = getattr(_local, "stats", None)
+
+    if sql is not None and elapsed > SLOW_QUERY_THRESHOLD:
+        endpoint = stats.endpoint if stats is not None else "<fuori richiesta>"
+        logger.warning(
+            f"Query lenta ({elapsed * 1000:.1f} ms) in {endpoint}: {normalize_statement(sql)}"
+        )
+
+    if stats is not None:
+        stats.time += elapsed
+        if sql is not None:
+            stats.count += 1
+            if stats.statements is not None:
+                stats.statements[normalize_statement(sql)] += 1
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursore che misura il tempo passato in SQLite per ogni operazione"""
+
+    def execute(self, sql: str, parameters: Any = (), /) -> "InstrumentedCursor":
+        if _statement_hook is not None:
+            _statement_hook(sql, parameters)
+        start = time.perf_counter()
+        try:
+            return _execute_with_retry(super().execute, sql, parameters)
+        finally:
+            _record(time.perf_counter() - start, sql)
+
+    def executemany(
+        self, sql: str, seq_of_parameters: Iterable[Any], /
+    ) -> "InstrumentedCursor":
+        start = time.perf_counter()
+        # Il generatore dei parametri non si può consumare due volte in caso di nuovo tentativo
+        seq_of_parameters = list(seq_of_parameters)
+        try:
+            return _execute_with_retry(super().executemany, sql, seq_of_parameters)
+        finally:
+            _record(time.perf_counter() - start, sql)
+
+    def fetchone(self) -> Any:
+        start = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            _record(time.perf_counter() - start)
+
+    def fetchall(self) -> list:
+        start = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            _record(time.perf_counter() - start)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Connessione i cui cursori sono strumentati con InstrumentedCursor"""
+
+    def cursor(self, factory: Any = InstrumentedCursor) -> Any:
+        return super().cursor(factory)
+
+    def execute(self, sql: str, parameters: Any = (), /) -> Any:
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql: str, seq_of_parameters: Iterable[Any], /) -> Any:
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def get_connection() -> sqlite3.Connection:
+    """
+    Apre una connessione al database dell'applicazione.
+
+    Returns:
+        sqlite3.Connection: Connessione strumentata per la raccolta delle statistiche,
+            con busy_timeout di BUSY_TIMEOUT secondi e nuovi tentativi su SQLITE_BUSY.
+    """
+
+    return sqlite3.connect(ROOT_PATH + DB_PATH, timeout=BUSY_TIMEOUT, factory=InstrumentedConnection)
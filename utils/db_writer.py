@@ -0,0 +1,183 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List, NamedTuple, Optional
+
+from utils import db, metrics
+from utils.logger import get_logger
+
+logger = get_logger()
+
+# Operazioni eseguite al massimo in una sola transazione
+MAX_BATCH = 64
+
+
+class Rollback(Exception):
+    """
+    Sollevata da un'operazione di scrittura per annullare le proprie modifiche senza
+    segnalare un errore: il chiamante riceve value come risultato dell'operazione.
+    """
+
+    def __init__(self, value: Any = None) -> None:
+        super().__init__(value)
+        self.value = value
+
+
+class _Operation(NamedTuple):
+    function: Callable[..., Any]
+    args: tuple
+    future: Future
+    submitted_at: float
+    # Statistiche della richiesta che ha inviato l'operazione, a cui attribuire le query
+    stats: Optional[db.QueryStats]
+
+
+class DatabaseWriter:
+    """
+    Thread che esegue tutte le scritture del processo su una sola connessione.
+
+    Le operazioni arrivano da una coda e quelle in attesa vengono eseguite insieme in
+    un'unica transazione (group commit): un solo lock di scrittura e un solo fsync per
+    gruppo invece che per operazione, e i thread delle richieste non si contendono più
+    il lock del database. Ogni operazione è isolata da un SAVEPOINT: se fallisce o solleva
+    Rollback vengono annullate solo le sue modifiche. I risultati sono consegnati ai
+    chiamanti tramite Future solo dopo il COMMIT del gruppo.
+    """
+
+    def __init__(self, max_batch: int = MAX_BATCH) -> None:
+        self.max_batch = max_batch
+        self._reset()
+
+    def _reset(self) -> None:
+        self._queue: "queue.SimpleQueue[_Operation]" = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(self, function: Callable[..., Any], *args: Any) -> Future:
+        """
+        Accoda un'operazione di scrittura. L'operazione riceve un cursore con la transazione
+        già aperta e non deve eseguire BEGIN, COMMIT o ROLLBACK.
+
+        Parameters:
+            function (callable): Funzione chiamata con (cursor, *args)
+            *args: Argomenti dell'operazione
+
+        Returns:
+            Future: Il valore restituito dall'operazione o l'eccezione sollevata
+        """
+
+        if self._thread is None:
+            self._start()
+
+        future: Future = Future()
+        self._queue.put(_Operation(function, args, future, time.perf_counter(), db.get_request_stats()))
+        return future
+
+    def execute(self, function: Callable[..., Any], *args: Any) -> Any:
+        """Accoda un'operazione di scrittura e ne attende il risultato (vedi submit)"""
+
+        if threading.current_thread() is self._thread:
+            raise RuntimeError("Un'operazione di scrittura non può accodarne un'altra")
+        return self.submit(function, *args).result()
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="sonosphere-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        conn = None
+        try:
+            while True:
+                batch = [self._queue.get()]
+                # Le operazioni arrivate durante il gruppo precedente vengono eseguite insieme
+                while len(batch) < self.max_batch:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+                try:
+                    # Anche l'apertura della connessione può fallire (file bloccato o non
+                    # raggiungibile): il gruppo fallisce e il thread resta attivo
+                    if conn is None:
+                        conn = db.get_connection()
+                        conn.isolation_level = None
+                    self._commit_batch(conn, batch)
+                except Exception as e:
+                    logger.error(f"Errore durante il commit di {len(batch)} scritture: {e}")
+                    metrics.DB_WRITE_OPERATIONS.inc(("failed",), len(batch))
+                    for operation in batch:
+                        if not operation.future.done():
+                            operation.future.set_exception(e)
+                    # La connessione viene riaperta per il gruppo successivo
+                    if conn is not None:
+                        conn.close()
+                        conn = None
+        finally:
+            # Se il thread termina comunque, la prossima scrittura ne avvia uno nuovo
+            # invece di attendere per sempre un risultato che nessuno produrrà
+            with self._lock:
+                if self._thread is threading.current_thread():
+                    self._thread = None
+            logger.error("Thread di scrittura terminato inaspettatamente")
+
+    def _commit_batch(self, conn: Any, batch: List[_Operation]) -> None:
+        started = time.perf_counter()
+        for operation in batch:
+            metrics.DB_WRITE_QUEUE_WAIT.observe(started - operation.submitted_at)
+        metrics.DB_WRITE_BATCH_SIZE.observe(len(batch))
+
+        cursor = conn.cursor()
+        results = []
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            for operation in batch:
+                previous = db.swap_request_stats(operation.stats)
+                try:
+                    results.append(self._apply(cursor, operation))
+                finally:
+                    db.swap_request_stats(previous)
+            cursor.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                cursor.execute("ROLLBACK")
+            raise
+        finally:
+            cursor.close()
+
+        for operation, (outcome, value, error) in zip(batch, results):
+            metrics.DB_WRITE_OPERATIONS.inc((outcome,))
+            if error is not None:
+                operation.future.set_exception(error)
+            else:
+                operation.future.set_result(value)
+
+    def _apply(self, cursor: Any, operation: _Operation) -> tuple:
+        # Restituisce (esito, valore, eccezione); gli errori del database che rendono
+        # inutilizzabile la transazione si propagano e fanno fallire l'intero gruppo
+        cursor.execute("SAVEPOINT operation")
+        try:
+            value = operation.function(cursor, *operation.args)
+        except Rollback as e:
+            cursor.execute("ROLLBACK TO operation")
+            cursor.execute("RELEASE operation")
+            return "rolled_back", e.value, None
+        except Exception as e:
+            cursor.execute("ROLLBACK TO operation")
+            cursor.execute("RELEASE operation")
+            return "failed", None, e
+
+        cursor.execute("RELEASE operation")
+        return "committed", value, None
+
+
+writer = DatabaseWriter()
+
+if hasattr(os, "register_at_fork"):
+    # Thread e connessione non sopravvivono al fork: nei worker (wsgi.py --workers)
+    # il thread viene ricreato alla prima scrittura
+    os.register_at_fork(after_in_child=writer._reset)
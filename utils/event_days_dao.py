@@ -1,11 +1,39 @@
-import sqlite3
 from typing import Any, Dict, List, Optional, Union
 
+from utils.db import get_connection
+from utils.db_writer import writer
 from utils.logger import get_logger
-from utils.vars import DB_PATH, ROOT_PATH
 
 logger = get_logger()
 
+# Contatori dei giorni confrontati con il numero reale di biglietti e prenotazioni, con un solo
+# statement: i contatori e i conteggi vengono letti dallo stesso snapshot. I biglietti sono
+# raggruppati per maschera dei giorni con una scansione dell'indice idx_tickets_days (al più
+# una riga per combinazione di giorni), poi ogni giorno somma i gruppi che contengono il suo bit.
+_ATTENDEE_COUNTS_QUERY = """
+WITH t AS MATERIALIZED (SELECT days, COUNT(*) AS n FROM tickets GROUP BY days),
+    h AS MATERIALIZED (SELECT days, COUNT(*) AS n FROM ticket_holds GROUP BY days)
+SELECT d.id, d.name, d.current_attendees, d.held_attendees,
+    (SELECT IFNULL(SUM(t.n), 0) FROM t WHERE t.days & (1 << (d.id - 1))),
+    (SELECT IFNULL(SUM(h.n), 0) FROM h WHERE h.days & (1 << (d.id - 1)))
+FROM event_days d
+ORDER BY d.id
+"""
+
+
+def _attendee_counts(rows: List[Any]) -> List[Dict[str, Any]]:
+    return [
+        {
+            "id": row[0],
+            "name": row[1],
+            "current_attendees": row[2],
+            "held_attendees": row[3],
+            "actual_attendees": row[4],
+            "actual_held": row[5],
+        }
+        for row in rows
+    ]
+
 
 def get_all_days() -> List[Dict[str, Any]]:
     """
@@ -15,9 +43,9 @@ def get_all_days() -> List[Dict[str, Any]]:
         list: Lista di dizionari contenenti i dettagli dei giorni del festival
     """
 
-    query = "SELECT * FROM event_days"
+    query = "SELECT id, name, date, current_attendees, max_attendees, start_time, end_time, held_attendees FROM event_days"
 
-    conn = sqlite3.connect(ROOT_PATH + DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute(query)
     days = cursor.fetchall()
@@ -33,6 +61,9 @@ def get_all_days() -> List[Dict[str, Any]]:
             "max_attendees": day[4],
             "start_time": day[5],
             "end_time": day[6],
+            "held_attendees": day[7],
+            # Posti ancora acquistabili: quelli prenotati sono esclusi fino alla scadenza della prenotazione
+            "available": max(0, day[4] - day[3] - day[7]),
         }
         for day in days
     ]
@@ -49,9 +80,9 @@ def get_day_by_id(day_id: int) -> Optional[Dict[str, Any]]:
         dict: Dizionario contenente i dettagli del giorno, o None se non trovato
     """
 
-    query = "SELECT * FROM event_days WHERE id = ?"
+    query = "SELECT id, name, date, current_attendees, max_attendees, start_time, end_time, held_attendees FROM event_days WHERE id = ?"
 
-    conn = sqlite3.connect(ROOT_PATH + DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute(query, (day_id,))
     day = cursor.fetchone()
@@ -67,6 +98,9 @@ def get_day_by_id(day_id: int) -> Optional[Dict[str, Any]]:
             "max_attendees": day[4],
             "start_time": day[5],
             "end_time": day[6],
+            "held_attendees": day[7],
+            # Posti ancora acquistabili: quelli prenotati sono esclusi fino alla scadenza della prenotazione
+            "available": max(0, day[4] - day[3] - day[7]),
         }
 
     return None
@@ -77,7 +111,7 @@ def update_day_attendees(day_id: int, increment: int) -> None:
     Aggiorna il contatore di partecipanti per un giorno
 
     Parameters:
-        day_id (int): ID del giorno (1=venerdì, 2=sabato, 3=domenica)
+        day_id (int): ID del giorno
         increment (int): Valore da aggiungere al contatore (può essere negativo)
     """
 
@@ -85,12 +119,7 @@ def update_day_attendees(day_id: int, increment: int) -> None:
         "UPDATE event_days SET current_attendees = current_attendees + ? WHERE id = ?"
     )
 
-    conn = sqlite3.connect(ROOT_PATH + DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute(query, (increment, day_id))
-    conn.commit()
-    cursor.close()
-    conn.close()
+    writer.execute(lambda cursor: cursor.execute(query, (increment, day_id)))
 
 
 def get_days_attendees(
@@ -106,25 +135,28 @@ def get_days_attendees(
         dict: Dizionario con i dati di partecipazione
     """
 
-    conn = sqlite3.connect(ROOT_PATH + DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
 
     if day_id is None:
-        query = "SELECT id, name, current_attendees, max_attendees FROM event_days"
+        query = "SELECT id, name, current_attendees, max_attendees, held_attendees FROM event_days"
         cursor.execute(query)
         days = cursor.fetchall()
         cursor.close()
         conn.close()
 
         return [
-            {"name": day[1], "current_attendees": day[2], "max_attendees": day[3]}
+            {
+                "name": day[1],
+                "current_attendees": day[2],
+                "max_attendees": day[3],
+                "held_attendees": day[4],
+            }
             for day in days
         ]
 
     else:
-        query = (
-            "SELECT name, current_attendees, max_attendees FROM event_days WHERE id = ?"
-        )
+        query = "SELECT name, current_attendees, max_attendees, held_attendees FROM event_days WHERE id = ?"
         cursor.execute(query, (day_id,))
         day = cursor.fetchone()
         cursor.close()
@@ -135,6 +167,62 @@ def get_days_attendees(
                 "name": day[0],
                 "current_attendees": day[1],
                 "max_attendees": day[2],
+                "held_attendees": day[3],
             }
 
         return {}
+
+
+def get_attendee_counts() -> List[Dict[str, Any]]:
+    """
+    Confronta i contatori dei giorni con i biglietti e le prenotazioni realmente presenti
+
+    Returns:
+        list: Per ogni giorno id, nome, contatori (current_attendees, held_attendees)
+            e valori ricalcolati (actual_attendees, actual_held)
+    """
+
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(_ATTENDEE_COUNTS_QUERY)
+    rows = cursor.fetchall()
+    cursor.close()
+    conn.close()
+
+    return _attendee_counts(rows)
+
+
+def reconcile_day_attendees() -> List[Dict[str, Any]]:
+    """
+    Riporta i contatori dei giorni ai valori ricalcolati da tickets e ticket_holds.
+    Il calcolo e la correzione avvengono nella stessa transazione del thread di scrittura,
+    quindi nessun acquisto concorrente può inserirsi tra i due.
+
+    Returns:
+        list: I giorni corretti, con i contatori precedenti e i nuovi valori (vedi get_attendee_counts)
+    """
+
+    def write(cursor: Any) -> List[Dict[str, Any]]:
+        cursor.execute(_ATTENDEE_COUNTS_QUERY)
+        drifted = [
+            day
+            for day in _attendee_counts(cursor.fetchall())
+            if day["current_attendees"] != day["actual_attendees"]
+            or day["held_attendees"] != day["actual_held"]
+        ]
+        if not drifted:
+            return []
+
+        cursor.executemany(
+            "UPDATE event_days SET current_attendees = ?, held_attendees = ? WHERE id = ?",
+            [(day["actual_attendees"], day["actual_held"], day["id"]) for day in drifted],
+        )
+        return drifted
+
+    drifted = writer.execute(write)
+    for day in drifted:
+        logger.warning(
+            f"Contatori di {day['name']} corretti: partecipanti {day['current_attendees']} -> "
+            f"{day['actual_attendees']}, prenotati {day['held_attendees']} -> {day['actual_held']}"
+        )
+    return drifted
@@ -1,8 +1,7 @@
-import sqlite3
 from typing import Any, Dict, List, Optional
 
+from utils.db import get_connection
 from utils.logger import get_logger
-from utils.vars import DB_PATH, ROOT_PATH
 
 logger = get_logger()
 
@@ -17,7 +16,7 @@ def get_all_genres() -> List[Dict[str, Any]]:
 
     query = "SELECT * FROM genres"
 
-    conn = sqlite3.connect(ROOT_PATH + DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute(query)
     genres = cursor.fetchall()
@@ -40,7 +39,7 @@ def get_genre_by_id(genre_id: int) -> Optional[Dict[str, Any]]:
 
     query = "SELECT * FROM genres WHERE id = ?"
 
-    conn = sqlite3.connect(ROOT_PATH + DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute(query, (genre_id,))
     genre = cursor.fetchone()
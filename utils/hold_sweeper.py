@@ -0,0 +1,133 @@
+import heapq
+import os
+import threading
+import time
+from typing import List, Optional, Set, Tuple
+
+from utils import ticket_holds_dao
+from utils.logger import get_logger
+
+logger = get_logger()
+
+# Attesa prima di riprovare dopo un errore del database, in secondi
+RETRY_DELAY = 5.0
+
+
+class HoldSweeper:
+    """
+    Thread che elimina le prenotazioni dei biglietti alla loro scadenza.
+
+    Le scadenze sono in un min-heap: il thread dorme fino alla prima scadenza e viene
+    svegliato solo se arriva una prenotazione che scade prima. Le prenotazioni confermate
+    o annullate vengono segnate come cancellate e scartate quando arrivano in cima
+    all'heap, senza accedere al database. All'avvio l'heap viene ricostruito dalla
+    tabella ticket_holds, comprese le prenotazioni create da altri processi.
+    """
+
+    def __init__(self) -> None:
+        self._reset()
+
+    def _reset(self) -> None:
+        self._condition = threading.Condition()
+        self._heap: List[Tuple[float, int]] = []
+        self._scheduled: Set[int] = set()
+        self._cancelled: Set[int] = set()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Avvia il thread, se non è già attivo"""
+
+        with self._condition:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="sonosphere-holds", daemon=True)
+            self._thread.start()
+
+    def schedule(self, hold_id: int, expires_at: float) -> None:
+        """Aggiunge la scadenza di una nuova prenotazione"""
+
+        with self._condition:
+            heapq.heappush(self._heap, (expires_at, hold_id))
+            self._scheduled.add(hold_id)
+            # Il thread va svegliato solo se la nuova scadenza è la più vicina
+            if self._heap[0][1] == hold_id:
+                self._condition.notify()
+
+    def cancel(self, hold_id: int) -> None:
+        """Segna una prenotazione confermata o annullata, che non dovrà più essere fatta scadere"""
+
+        with self._condition:
+            # Le prenotazioni create da altri processi non sono nell'heap di questo processo
+            if hold_id in self._scheduled:
+                self._cancelled.add(hold_id)
+
+    def pending(self) -> int:
+        with self._condition:
+            return len(self._heap) - len(self._cancelled)
+
+    def _run(self) -> None:
+        try:
+            for expires_at, hold_id in ticket_holds_dao.get_hold_expirations():
+                self.schedule(hold_id, expires_at)
+        except Exception:
+            logger.exception("Impossibile caricare le scadenze delle prenotazioni")
+
+        while True:
+            with self._condition:
+                due = self._wait_for_due()
+
+            # Le prenotazioni scadute vengono eliminate tutte insieme, anche quelle di altri processi
+            try:
+                ticket_holds_dao.expire_holds()
+            except Exception:
+                logger.exception("Errore durante la scadenza delle prenotazioni, nuovo tentativo a breve")
+                with self._condition:
+                    retry_at = time.time() + RETRY_DELAY
+                    for _, hold_id in due:
+                        heapq.heappush(self._heap, (retry_at, hold_id))
+                        self._scheduled.add(hold_id)
+
+    def _wait_for_due(self) -> List[Tuple[float, int]]:
+        # Chiamata con il lock acquisito: attende che almeno una prenotazione attiva sia scaduta
+        while True:
+            while not self._heap:
+                self._condition.wait()
+
+            expires_at, hold_id = self._heap[0]
+            if hold_id in self._cancelled:
+                self._pop()
+                continue
+
+            delay = expires_at - time.time()
+            if delay > 0:
+                self._condition.wait(delay)
+                continue
+
+            due = []
+            while self._heap and self._heap[0][0] <= time.time():
+                cancelled = self._heap[0][1] in self._cancelled
+                entry = self._pop()
+                if not cancelled:
+                    due.append(entry)
+            if due:
+                return due
+
+    def _pop(self) -> Tuple[float, int]:
+        expires_at, hold_id = heapq.heappop(self._heap)
+        self._scheduled.discard(hold_id)
+        self._cancelled.discard(hold_id)
+        return expires_at, hold_id
+
+
+sweeper = HoldSweeper()
+
+if hasattr(os, "register_at_fork"):
+    # I thread non sopravvivono al fork: nei worker (wsgi.py --workers) il thread viene ricreato
+    # e l'heap ricostruito dal database
+    def _restart_in_child() -> None:
+        started = sweeper._thread is not None
+        sweeper._reset()
+        if started:
+            sweeper.start()
+
+    os.register_at_fork(after_in_child=_restart_in_child)
@@ -0,0 +1,107 @@
+import re
+import time
+import uuid
+from functools import wraps
+from typing import Any, Callable, Dict
+
+from flask import abort, flash, make_response, redirect, request, session
+from flask_login import current_user
+
+from utils import idempotency_dao, metrics
+from utils.logger import get_logger
+
+logger = get_logger()
+
+# Campo nascosto dei moduli con la chiave di idempotenza
+IDEMPOTENCY_FIELD = "idempotency_key"
+# Attesa massima della risposta originale quando lo stesso modulo arriva mentre è ancora in corso
+IN_PROGRESS_WAIT = 10.0
+# Intervallo tra le letture della chiave durante l'attesa, in secondi
+IN_PROGRESS_POLL = 0.1
+
+_KEY_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+def new_idempotency_key() -> str:
+    """Genera una chiave di idempotenza da inserire in un modulo (funzione globale dei template)"""
+
+    return uuid.uuid4().hex
+
+
+def _replay(record: Dict[str, Any]) -> Any:
+    # I messaggi flash vengono riemessi: la pagina di destinazione è la stessa dell'originale
+    for category, message in record["flashes"]:
+        flash(message, category)
+
+    if record["location"]:
+        return redirect(record["location"], code=record["status"])
+    return make_response(record["body"] or "", record["status"])
+
+
+def _wait_for_response(key: str) -> Any:
+    deadline = time.monotonic() + IN_PROGRESS_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(IN_PROGRESS_POLL)
+        record = idempotency_dao.get_idempotency_key(key)
+        if record is None:
+            # La richiesta originale è fallita e ha liberato la chiave
+            return None
+        if record["status"] is not None:
+            return record
+    return None
+
+
+def idempotent(view: Callable[..., Any]) -> Callable[..., Any]:
+    """
+    Rende idempotenti i POST che contengono il campo IDEMPOTENCY_FIELD: la prima richiesta
+    con una chiave viene eseguita e la sua risposta salvata, i nuovi invii dello stesso modulo
+    (doppio clic, ricarica, nuovo tentativo dopo un timeout) ricevono la risposta originale senza
+    ripetere l'operazione. Un invio che arriva mentre l'originale è in corso ne attende la
+    risposta per al massimo IN_PROGRESS_WAIT secondi, poi riceve 409.
+    Le richieste senza chiave (strumenti, test di carico) vengono eseguite normalmente.
+    Va applicato dopo login_required.
+    """
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.form.get(IDEMPOTENCY_FIELD) if request.method == "POST" else None
+        if not key or not _KEY_RE.match(key):
+            return view(*args, **kwargs)
+
+        record = idempotency_dao.claim_idempotency_key(key, current_user.id, request.endpoint)
+        if record is not None:
+            if record["user_id"] != current_user.id or record["endpoint"] != request.endpoint:
+                metrics.IDEMPOTENCY_REQUESTS.inc(("mismatch",))
+                abort(422)
+
+            if record["status"] is None:
+                record = _wait_for_response(key)
+                if record is None:
+                    metrics.IDEMPOTENCY_REQUESTS.inc(("conflict",))
+                    logger.warning(f"Modulo inviato di nuovo mentre è ancora in elaborazione: {request.endpoint}")
+                    abort(409)
+
+            metrics.IDEMPOTENCY_REQUESTS.inc(("replayed",))
+            logger.info(f"Risposta salvata restituita per un nuovo invio del modulo: {request.endpoint}")
+            return _replay(record)
+
+        flashed = len(session.get("_flashes", []))
+        try:
+            response = make_response(view(*args, **kwargs))
+        except Exception:
+            idempotency_dao.release_idempotency_key(key)
+            raise
+
+        if response.status_code >= 500:
+            # Gli errori del server non vengono salvati: il modulo si può inviare di nuovo
+            idempotency_dao.release_idempotency_key(key)
+            return response
+
+        location = response.headers.get("Location")
+        body = None if location else response.get_data(as_text=True)
+        flashes = [tuple(entry) for entry in session.get("_flashes", [])[flashed:]]
+        idempotency_dao.complete_idempotency_key(key, response.status_code, location, body, flashes)
+        metrics.IDEMPOTENCY_REQUESTS.inc(("executed",))
+        return response
+
+    return wrapper
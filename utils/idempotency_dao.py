@@ -0,0 +1,141 @@
+import json
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.db import get_connection
+from utils.db_writer import writer
+from utils.logger import get_logger
+
+logger = get_logger()
+
+# Durata di una chiave di idempotenza, in secondi: entro questo tempo un nuovo invio
+# dello stesso modulo riceve la risposta originale
+IDEMPOTENCY_TTL = 24 * 60 * 60
+
+_COLUMNS = "user_id, endpoint, status, location, body, flashes"
+
+
+def _to_dict(key: str, row: Any) -> Dict[str, Any]:
+    return {
+        "key": key,
+        "user_id": row[0],
+        "endpoint": row[1],
+        "status": row[2],
+        "location": row[3],
+        "body": row[4],
+        "flashes": [tuple(flash) for flash in json.loads(row[5])] if row[5] else [],
+    }
+
+
+def get_idempotency_key(key: str) -> Optional[Dict[str, Any]]:
+    """
+    Restituisce una chiave di idempotenza non scaduta
+
+    Parameters:
+        key (str): La chiave inviata con il modulo
+
+    Returns:
+        dict: Dizionario con utente, endpoint e risposta salvata (status None se la richiesta
+            originale è ancora in corso), o None se la chiave non esiste o è scaduta
+    """
+
+    query = f"SELECT {_COLUMNS} FROM idempotency_keys WHERE key = ? AND expires_at > ?"
+
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(query, (key, time.time()))
+    row = cursor.fetchone()
+    cursor.close()
+    conn.close()
+
+    return _to_dict(key, row) if row else None
+
+
+def claim_idempotency_key(
+    key: str, user_id: int, endpoint: str, ttl: float = IDEMPOTENCY_TTL
+) -> Optional[Dict[str, Any]]:
+    """
+    Riserva una chiave di idempotenza per la richiesta corrente. Nella stessa operazione
+    vengono eliminate le chiavi scadute, così la tabella non cresce senza limite.
+
+    Parameters:
+        key (str): La chiave inviata con il modulo
+        user_id (int): ID dell'utente che invia il modulo
+        endpoint (str): Endpoint Flask della richiesta
+        ttl (float): Durata della chiave in secondi
+
+    Returns:
+        dict: None se la chiave è stata riservata e la richiesta va eseguita, altrimenti
+            la chiave già esistente (vedi get_idempotency_key)
+    """
+
+    def write(cursor: Any) -> Optional[Tuple[Any, ...]]:
+        now = time.time()
+        cursor.execute("DELETE FROM idempotency_keys WHERE expires_at <= ?", (now,))
+        cursor.execute(
+            """INSERT INTO idempotency_keys (key, user_id, endpoint, created_at, expires_at)
+            VALUES (?, ?, ?, ?, ?) ON CONFLICT (key) DO NOTHING""",
+            (key, user_id, endpoint, now, now + ttl),
+        )
+        if cursor.rowcount == 1:
+            return None
+
+        cursor.execute(f"SELECT {_COLUMNS} FROM idempotency_keys WHERE key = ?", (key,))
+        return cursor.fetchone()
+
+    row = writer.execute(write)
+    return _to_dict(key, row) if row else None
+
+
+def complete_idempotency_key(
+    key: str,
+    status: int,
+    location: Optional[str],
+    body: Optional[str],
+    flashes: List[Tuple[str, str]],
+) -> bool:
+    """
+    Salva la risposta della richiesta che ha riservato la chiave
+
+    Parameters:
+        key (str): La chiave di idempotenza
+        status (int): Codice HTTP della risposta
+        location (str, optional): Destinazione del redirect
+        body (str, optional): Corpo della risposta, se non è un redirect
+        flashes (list): Messaggi flash (categoria, messaggio) emessi dalla richiesta
+
+    Returns:
+        bool: True se la chiave esisteva ancora
+    """
+
+    query = """
+    UPDATE idempotency_keys SET status = ?, location = ?, body = ?, flashes = ?
+    WHERE key = ? AND status IS NULL
+    """
+
+    def write(cursor: Any) -> int:
+        cursor.execute(query, (status, location, body, json.dumps(flashes), key))
+        return cursor.rowcount
+
+    return writer.execute(write) == 1
+
+
+def release_idempotency_key(key: str) -> bool:
+    """
+    Libera una chiave la cui richiesta non è andata a buon fine, così il modulo si può inviare di nuovo
+
+    Parameters:
+        key (str): La chiave di idempotenza
+
+    Returns:
+        bool: True se la chiave era ancora in attesa della risposta
+    """
+
+    def write(cursor: Any) -> int:
+        cursor.execute("DELETE FROM idempotency_keys WHERE key = ? AND status IS NULL", (key,))
+        return cursor.rowcount
+
+    released = writer.execute(write) == 1
+    if released:
+        logger.info("Chiave di idempotenza liberata dopo un errore")
+    return released
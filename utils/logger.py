@@ -1,25 +1,111 @@
+import atexit
+import json
 import logging
 import os
-from logging.handlers import RotatingFileHandler
+import queue
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Any, Optional
 
 logger = logging.getLogger("sonosphere")
+access_logger = logging.getLogger("sonosphere.access")
 
 LOG_FILENAME = "sonosphere.log"
+ACCESS_LOG_FILENAME = "access.log"
 LOG_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 LOG_PATH = os.path.join(LOG_DIR, LOG_FILENAME)
+ACCESS_LOG_PATH = os.path.join(LOG_DIR, ACCESS_LOG_FILENAME)
+
+# Dimensione massima della coda tra i thread delle richieste e il writer
+LOG_QUEUE_SIZE = 10000
+# Frazione di riempimento oltre la quale i record sotto WARNING vengono campionati
+LOG_QUEUE_HIGH_WATER = 0.8
+# Sotto pressione viene conservato un record informativo ogni LOG_SAMPLE_RATE
+LOG_SAMPLE_RATE = 10
+
+_listener: Optional[QueueListener] = None
+_queue_handler: Optional["DroppingQueueHandler"] = None
+_stopped_for_fork = False
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    QueueHandler che non blocca mai il thread chiamante.
+
+    Quando la coda supera la soglia di riempimento i record sotto WARNING vengono
+    campionati, quando è piena vengono scartati. I record scartati sono contati.
+    """
+
+    def __init__(self, log_queue: "queue.Queue[Any]", maxsize: int) -> None:
+        super().__init__(log_queue)
+        self.high_water = int(maxsize * LOG_QUEUE_HIGH_WATER)
+        self.dropped = 0
+        self._sampled = 0
+        self._drop_lock = threading.Lock()
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if record.levelno < logging.WARNING and self.queue.qsize() >= self.high_water:
+            self._sampled += 1
+            if self._sampled % LOG_SAMPLE_RATE:
+                self._drop()
+                return
+
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self._drop()
+
+    def _drop(self) -> None:
+        with self._drop_lock:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formatta i record come una riga JSON. I campi passati tramite
+    extra={"fields": {...}} vengono aggiunti al livello principale.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": self.formatTime(record, self.datefmt),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        payload.update(getattr(record, "fields", {}))
+        return json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+
+
+class _AccessFilter(logging.Filter):
+    """Separa i record di accesso da quelli applicativi"""
+
+    def __init__(self, access: bool) -> None:
+        super().__init__()
+        self.access = access
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return (record.name == access_logger.name) == self.access
 
 
 def setup_logger(level: int = logging.INFO) -> None:
     """
-    Configura il logger con un formattatore personalizzato e gestori multipli.
+    Configura il logging dell'intero processo.
+
+    I record vengono messi in una coda limitata da un QueueHandler collegato al
+    root logger e scritti su file e console da un QueueListener in background,
+    così le richieste non eseguono mai I/O sincrono sui log. I record di accesso
+    finiscono in un file separato in formato JSON.
 
     Parameters:
         level: Livello di logging (default: logging.INFO)
     """
 
+    global _listener, _queue_handler
+
     logger.setLevel(level)
 
-    if logger.handlers:
+    if _listener is not None:
         return
 
     formatter = logging.Formatter(
@@ -32,16 +118,136 @@ def setup_logger(level: int = logging.INFO) -> None:
     )
     file_handler.setFormatter(formatter)
     file_handler.setLevel(level)
-    logger.addHandler(file_handler)
+    file_handler.addFilter(_AccessFilter(access=False))
+
+    access_handler = RotatingFileHandler(
+        ACCESS_LOG_PATH, maxBytes=20 * 1024 * 1024, backupCount=3  # 20 MB
+    )
+    access_handler.setFormatter(JsonFormatter(datefmt="%Y-%m-%dT%H:%M:%S"))
+    access_handler.setLevel(level)
+    access_handler.addFilter(_AccessFilter(access=True))
 
     console_handler = logging.StreamHandler()
     console_handler.setFormatter(formatter)
     console_handler.setLevel(level)
-    logger.addHandler(console_handler)
+    console_handler.addFilter(_AccessFilter(access=False))
+
+    log_queue: "queue.Queue[Any]" = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    _queue_handler = DroppingQueueHandler(log_queue, LOG_QUEUE_SIZE)
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+
+    _listener = QueueListener(
+        log_queue,
+        file_handler,
+        access_handler,
+        console_handler,
+        respect_handler_level=True,
+    )
+    _listener.start()
+    atexit.register(stop_logger)
 
     logger.info("Logger configurato con successo")
 
 
+def stop_logger() -> None:
+    """
+    Svuota la coda dei log e ferma il thread di scrittura.
+    """
+
+    global _listener
+
+    if _listener is None:
+        return
+
+    if _queue_handler is not None and _queue_handler.dropped:
+        logger.warning(
+            f"Record di log scartati per saturazione della coda: {_queue_handler.dropped}"
+        )
+
+    _listener.stop()
+    _listener = None
+
+
+def _stop_before_fork() -> None:
+    # Un fork mentre il listener sta scrivendo copierebbe nel figlio i lock degli stream
+    # già acquisiti: il listener viene fermato (svuotando la coda) e riavviato dopo il fork
+    global _stopped_for_fork
+
+    if _listener is not None and _listener._thread is not None:
+        try:
+            _listener.stop()
+            _stopped_for_fork = True
+        except queue.Full:
+            # Coda piena: il listener resta attivo, il figlio crea comunque una coda nuova
+            pass
+
+
+def _restart_in_parent() -> None:
+    global _stopped_for_fork
+
+    if _stopped_for_fork:
+        _stopped_for_fork = False
+        _listener.start()
+
+
+def _restart_in_child() -> None:
+    """
+    Nel processo figlio creato con fork vengono creati una nuova coda e un nuovo
+    listener con gli stessi handler.
+    """
+
+    global _listener, _queue_handler
+
+    if _listener is None:
+        return
+
+    log_queue: "queue.Queue[Any]" = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    handler = DroppingQueueHandler(log_queue, LOG_QUEUE_SIZE)
+
+    root = logging.getLogger()
+    root.removeHandler(_queue_handler)
+    root.addHandler(handler)
+    _queue_handler = handler
+
+    _listener = QueueListener(log_queue, *_listener.handlers, respect_handler_level=True)
+    _listener.start()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(
+        before=_stop_before_fork,
+        after_in_parent=_restart_in_parent,
+        after_in_child=_restart_in_child,
+    )
+
+
+def get_dropped_records() -> int:
+    """
+    Restituisce il numero di record di log scartati per saturazione della coda.
+
+    Returns:
+        int: Numero di record scartati dall'avvio del processo.
+    """
+
+    return _queue_handler.dropped if _queue_handler is not None else 0
+
+
+def log_access(**fields: Any) -> None:
+    """
+    Scrive una riga del log di accesso in formato JSON.
+
+    Parameters:
+        fields: Campi strutturati della riga (endpoint, status, durata, ...)
+    """
+
+    access_logger.info("request", extra={"fields": fields})
+
+
 def get_logger() -> logging.Logger:
     """
     Ottiene l'istanza del logger già configurato.
@@ -0,0 +1,252 @@
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional
+
+from utils import metrics
+from utils.logger import get_logger
+
+logger = get_logger()
+
+# Numero massimo di snapshot conservate: le più vecchie vengono scartate
+MAX_SNAPSHOTS = 10
+# Campioni conservati dal registratore in background (con 10 s di intervallo circa 11 ore)
+HISTORY_SIZE = 4096
+DEFAULT_HISTORY_INTERVAL = 10.0
+
+# Le allocazioni di tracemalloc stesso e del sistema di import non interessano
+_SNAPSHOT_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+_snapshots: "OrderedDict[str, tracemalloc.Snapshot]" = OrderedDict()
+_snapshots_lock = threading.Lock()
+
+try:
+    _PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = 4096
+
+
+def rss_bytes() -> Optional[int]:
+    """
+    Memoria residente del processo in byte, letta da /proc (solo Linux).
+    Altrove restituisce il picco riportato da resource, o None se non disponibile.
+    """
+
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        pass
+
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss è in byte su macOS e in kilobyte sugli altri sistemi
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def python_heap_bytes() -> Optional[int]:
+    """
+    Memoria allocata da Python secondo tracemalloc, None se tracemalloc non è attivo.
+    In quel caso si può usare sys.getallocatedblocks() come indicatore di crescita.
+    """
+
+    if not tracemalloc.is_tracing():
+        return None
+    return tracemalloc.get_traced_memory()[0]
+
+
+def start_tracing(frames: int = 1) -> bool:
+    """
+    Avvia tracemalloc. Con frames > 1 le allocazioni conservano più livelli di stack,
+    con un costo di memoria e CPU maggiore.
+
+    Returns:
+        bool: False se tracemalloc era già attivo
+    """
+
+    if tracemalloc.is_tracing():
+        return False
+    tracemalloc.start(frames)
+    logger.info(f"tracemalloc avviato con {frames} frame per allocazione")
+    return True
+
+
+def stop_tracing() -> None:
+    """Ferma tracemalloc ed elimina le snapshot, che non sono più confrontabili"""
+
+    tracemalloc.stop()
+    with _snapshots_lock:
+        _snapshots.clear()
+    logger.info("tracemalloc fermato")
+
+
+def take_snapshot(name: str) -> Dict[str, Any]:
+    """
+    Registra una snapshot delle allocazioni con il nome indicato.
+
+    Parameters:
+        name (str): Nome della snapshot, sovrascrive una snapshot con lo stesso nome
+
+    Returns:
+        dict: Nome, memoria tracciata e numero di allocazioni della snapshot
+
+    Raises:
+        RuntimeError: Se tracemalloc non è attivo
+    """
+
+    if not tracemalloc.is_tracing():
+        raise RuntimeError("tracemalloc non è attivo")
+
+    snapshot = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+
+    with _snapshots_lock:
+        _snapshots.pop(name, None)
+        _snapshots[name] = snapshot
+        while len(_snapshots) > MAX_SNAPSHOTS:
+            _snapshots.popitem(last=False)
+
+    return {
+        "name": name,
+        "size": sum(trace.size for trace in snapshot.traces),
+        "allocations": len(snapshot.traces),
+    }
+
+
+def list_snapshots() -> List[str]:
+    with _snapshots_lock:
+        return list(_snapshots)
+
+
+def compare_snapshots(
+    old_name: str, new_name: Optional[str] = None, limit: int = 20
+) -> List[Dict[str, Any]]:
+    """
+    Confronta due snapshot raggruppando le allocazioni per file:riga.
+
+    Parameters:
+        old_name (str): Nome della snapshot di partenza
+        new_name (str, optional): Nome della snapshot di arrivo, None per lo stato attuale
+        limit (int): Numero di righe da restituire, ordinate per crescita della memoria
+
+    Returns:
+        list: Per ogni posizione la differenza di memoria e di allocazioni
+
+    Raises:
+        KeyError: Se una delle snapshot non esiste
+        RuntimeError: Se new_name è None e tracemalloc non è attivo
+    """
+
+    with _snapshots_lock:
+        old = _snapshots[old_name]
+        new = _snapshots[new_name] if new_name is not None else None
+
+    if new is None:
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("tracemalloc non è attivo")
+        new = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+
+    return [
+        {
+            "location": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+            "size_diff": stat.size_diff,
+            "size": stat.size,
+            "count_diff": stat.count_diff,
+            "count": stat.count,
+        }
+        for stat in new.compare_to(old, "lineno")[:limit]
+    ]
+
+
+class MemoryRecorder:
+    """
+    Registra periodicamente RSS e memoria di Python in un buffer circolare, insieme
+    alle richieste servite per endpoint nell'intervallo, così da poter correlare la
+    crescita della memoria con le route chiamate.
+    """
+
+    def __init__(self, size: int = HISTORY_SIZE) -> None:
+        self.history: Deque[Dict[str, Any]] = deque(maxlen=size)
+        self.interval = DEFAULT_HISTORY_INTERVAL
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._last_requests: Dict[str, float] = {}
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval: float = DEFAULT_HISTORY_INTERVAL) -> bool:
+        """
+        Avvia la registrazione in background.
+
+        Returns:
+            bool: False se la registrazione è già attiva
+        """
+
+        with self._lock:
+            if self.running:
+                return False
+
+            self.interval = interval
+            self._last_requests = self._requests_by_endpoint()
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="sonosphere-memory", daemon=True
+            )
+            self._thread.start()
+
+        logger.info(f"Registrazione della memoria avviata, intervallo {interval} s")
+        return True
+
+    def stop(self) -> None:
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.record()
+
+    def record(self) -> Dict[str, Any]:
+        """Aggiunge un campione al buffer e lo restituisce"""
+
+        requests = self._requests_by_endpoint()
+        delta = {
+            endpoint: int(count - self._last_requests.get(endpoint, 0))
+            for endpoint, count in requests.items()
+            if count != self._last_requests.get(endpoint, 0)
+        }
+        self._last_requests = requests
+
+        sample = {
+            "time": time.time(),
+            "rss": rss_bytes(),
+            "heap": python_heap_bytes(),
+            "blocks": sys.getallocatedblocks(),
+            "requests": delta,
+        }
+        self.history.append(sample)
+        return sample
+
+    @staticmethod
+    def _requests_by_endpoint() -> Dict[str, float]:
+        totals: Dict[str, float] = {}
+        for (endpoint, _method, _status), count in metrics.HTTP_REQUESTS.values().items():
+            totals[endpoint] = totals.get(endpoint, 0) + count
+        return totals
+
+
+recorder = MemoryRecorder()
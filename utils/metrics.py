@@ -0,0 +1,318 @@
+import threading
+from bisect import bisect_left
+from typing import Callable, Dict, List, Sequence, Tuple
+
+from utils.logger import get_dropped_records
+
+LabelValues = Tuple[str, ...]
+
+# Bucket in secondi per le latenze delle richieste e del database
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# Bucket per il numero di query eseguite da una richiesta
+QUERY_COUNT_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128)
+# Bucket per il numero di scritture eseguite in una transazione di gruppo
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+_registry: List["_Metric"] = []
+
+
+def _format_labels(labelnames: Sequence[str], labelvalues: Sequence[str]) -> str:
+    if not labelnames:
+        return ""
+    pairs = ",".join(
+        f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labelvalues)
+    )
+    return "{" + pairs + "}"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """Base comune delle metriche: nome, descrizione, etichette e lock"""
+
+    kind = "untyped"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: Sequence[str] = ()
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def render(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Contatore monotono, eventualmente suddiviso per etichette"""
+
+    kind = "counter"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: Sequence[str] = ()
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, labels: LabelValues = (), amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, labels: LabelValues = ()) -> float:
+        return self._values.get(labels, 0)
+
+    def values(self) -> Dict[LabelValues, float]:
+        with self._lock:
+            return dict(self._values)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+            for labels, value in items
+        ]
+
+
+class Gauge(Counter):
+    """Valore che può salire e scendere (es. richieste in corso)"""
+
+    kind = "gauge"
+
+    def dec(self, labels: LabelValues = (), amount: float = 1) -> None:
+        self.inc(labels, -amount)
+
+    def set(self, value: float, labels: LabelValues = ()) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+
+class CallbackGauge(_Metric):
+    """Gauge senza etichette il cui valore è letto da una funzione al momento dell'esportazione"""
+
+    kind = "gauge"
+
+    def __init__(
+        self, name: str, documentation: str, callback: Callable[[], float]
+    ) -> None:
+        super().__init__(name, documentation)
+        self.callback = callback
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name} {_format_value(self.callback())}"]
+
+
+class Histogram(_Metric):
+    """
+    Istogramma a bucket fissi. Ogni osservazione incrementa un solo bucket,
+    i conteggi cumulativi richiesti dal formato Prometheus sono calcolati in esportazione.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # Per ogni combinazione di etichette: [conteggi per bucket (+Inf in coda), somma]
+        self._values: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, labels: LabelValues = ()) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = [[0] * (len(self.buckets) + 1), 0.0]
+                self._values[labels] = entry
+            entry[0][index] += 1
+            entry[1] += value
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = [(labels, list(counts), total) for labels, (counts, total) in self._values.items()]
+
+        lines = []
+        bucket_labelnames = self.labelnames + ("le",)
+        for labels, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                bucket_labels = _format_labels(
+                    bucket_labelnames, labels + (_format_value(bound),)
+                )
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            plain_labels = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{plain_labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{plain_labels} {cumulative}")
+        return lines
+
+
+def render_metrics() -> str:
+    """
+    Esporta tutte le metriche registrate nel formato testuale di Prometheus.
+
+    Returns:
+        str: Il testo da restituire all'endpoint di scraping.
+    """
+
+    lines: List[str] = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    """
+    Registra un accesso ad una cache applicativa.
+
+    Parameters:
+        cache (str): Nome della cache
+        hit (bool): True se il valore era presente in cache
+    """
+
+    CACHE_REQUESTS.inc((cache, "hit" if hit else "miss"))
+
+
+HTTP_REQUESTS = Counter(
+    "sonosphere_http_requests_total",
+    "Richieste HTTP servite, per endpoint, metodo e codice di stato.",
+    ("endpoint", "method", "status"),
+)
+HTTP_REQUEST_DURATION = Histogram(
+    "sonosphere_http_request_duration_seconds",
+    "Latenza delle richieste HTTP per endpoint.",
+    ("endpoint",),
+)
+HTTP_IN_FLIGHT = Gauge(
+    "sonosphere_http_requests_in_flight",
+    "Richieste HTTP attualmente in corso per endpoint.",
+    ("endpoint",),
+)
+DB_QUERIES_PER_REQUEST = Histogram(
+    "sonosphere_db_queries_per_request",
+    "Numero di statement SQL eseguiti da ogni richiesta.",
+    ("endpoint",),
+    buckets=QUERY_COUNT_BUCKETS,
+)
+DB_TIME_PER_REQUEST = Histogram(
+    "sonosphere_db_time_per_request_seconds",
+    "Tempo passato in SQLite da ogni richiesta.",
+    ("endpoint",),
+)
+CACHE_REQUESTS = Counter(
+    "sonosphere_cache_requests_total",
+    "Accessi alle cache applicative; hit ratio = hit / (hit + miss).",
+    ("cache", "result"),
+)
+INSTRUMENTATION_OVERHEAD = Counter(
+    "sonosphere_instrumentation_overhead_seconds_total",
+    "Tempo speso negli hook di strumentazione delle richieste.",
+)
+STARTUP_DURATION = Gauge(
+    "sonosphere_startup_seconds",
+    "Durata dell'avvio dall'import di app.py: applicazione pronta (phase=app) e prima risposta (phase=first_response).",
+    ("phase",),
+)
+ADMISSION_IN_FLIGHT = Gauge(
+    "sonosphere_admission_in_flight",
+    "Richieste ammesse e in corso per classe di route.",
+    ("class",),
+)
+ADMISSION_QUEUED = Gauge(
+    "sonosphere_admission_queued",
+    "Richieste in attesa di ammissione per classe di route.",
+    ("class",),
+)
+ADMISSION_SHED = Counter(
+    "sonosphere_admission_shed_total",
+    "Richieste rifiutate con 503 per classe di route e motivo (queue_full, latency, timeout).",
+    ("class", "reason"),
+)
+ADMISSION_WAIT = Histogram(
+    "sonosphere_admission_wait_seconds",
+    "Attesa in coda delle richieste ammesse dopo un'attesa, per classe di route.",
+    ("class",),
+)
+TICKET_HOLDS = Counter(
+    "sonosphere_ticket_holds_total",
+    "Prenotazioni dei biglietti per esito (created, rejected, converted, released, expired).",
+    ("outcome",),
+)
+WAITING_ROOM_TOKENS = Counter(
+    "sonosphere_waiting_room_tokens_total",
+    "Numeri di coda assegnati dalla sala d'attesa.",
+)
+WAITING_ROOM_REQUESTS = Counter(
+    "sonosphere_waiting_room_requests_total",
+    "Richieste alle pagine di acquisto con la sala d'attesa aperta, per esito (admitted, waiting).",
+    ("outcome",),
+)
+IDEMPOTENCY_REQUESTS = Counter(
+    "sonosphere_idempotency_requests_total",
+    "Moduli inviati con chiave di idempotenza per esito (executed, replayed, conflict, mismatch).",
+    ("outcome",),
+)
+ATTENDEE_DRIFT = Gauge(
+    "sonosphere_attendee_drift",
+    "Differenza tra contatore e valore ricalcolato all'ultima riconciliazione, per giorno e contatore (current, held).",
+    ("day", "counter"),
+)
+RECONCILIATIONS = Counter(
+    "sonosphere_reconciliations_total",
+    "Riconciliazioni dei contatori dei giorni per esito (clean, drift, fixed, failed).",
+    ("outcome",),
+)
+DB_WRITE_BATCH_SIZE = Histogram(
+    "sonosphere_db_write_batch_size",
+    "Operazioni di scrittura eseguite in ogni transazione del thread di scrittura.",
+    buckets=BATCH_SIZE_BUCKETS,
+)
+DB_WRITE_QUEUE_WAIT = Histogram(
+    "sonosphere_db_write_queue_wait_seconds",
+    "Attesa delle operazioni di scrittura in coda prima dell'esecuzione.",
+)
+DB_WRITE_OPERATIONS = Counter(
+    "sonosphere_db_write_operations_total",
+    "Operazioni di scrittura per esito (committed, rolled_back, failed).",
+    ("outcome",),
+)
+DB_BUSY_RETRIES = Counter(
+    "sonosphere_db_busy_retries_total",
+    "Nuovi tentativi degli statement che hanno trovato il database bloccato (SQLITE_BUSY/LOCKED).",
+    ("statement",),
+)
+DB_BUSY_ERRORS = Counter(
+    "sonosphere_db_busy_errors_total",
+    "Statement falliti con il database ancora bloccato dopo tutti i tentativi.",
+    ("statement",),
+)
+DB_LOCK_WAIT = Histogram(
+    "sonosphere_db_lock_wait_seconds",
+    "Attesa del lock (busy_timeout e backoff) degli statement che hanno trovato il database bloccato.",
+)
+LOG_RECORDS_DROPPED = CallbackGauge(
+    "sonosphere_log_records_dropped",
+    "Record di log scartati per saturazione della coda di logging.",
+    get_dropped_records,
+)
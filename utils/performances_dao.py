@@ -1,9 +1,9 @@
-import sqlite3
 from typing import Any, Dict, List, Optional, Tuple
 
 from utils import event_days_dao
+from utils.db import DatabaseBusyError, get_connection
+from utils.db_writer import writer
 from utils.logger import get_logger
-from utils.vars import DB_PATH, ROOT_PATH
 
 logger = get_logger()
 
@@ -24,7 +24,7 @@ def get_all_performances(include_unpublished: bool = False) -> List[Dict[str, An
     else:
         query = "SELECT * FROM performances WHERE is_published = 1"
 
-    conn = sqlite3.connect(ROOT_PATH + DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute(query)
     performances = cursor.fetchall()
@@ -65,7 +65,7 @@ def get_performance_by_id(performance_id: int) -> Optional[Dict[str, Any]]:
 
     query = "SELECT * FROM performances WHERE id = ?"
 
-    conn = sqlite3.connect(ROOT_PATH + DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute(query, (performance_id,))
     p = cursor.fetchone()
@@ -112,7 +112,7 @@ def get_performances_by_organizer(
     else:
         query = "SELECT * FROM performances WHERE organizer_id = ? AND is_published = 1 ORDER BY day_id, start_time"
 
-    conn = sqlite3.connect(ROOT_PATH + DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute(query, (organizer_id,))
     performances = cursor.fetchall()
@@ -150,7 +150,7 @@ def get_featured_performances() -> List[Dict[str, Any]]:
 
     query = "SELECT * FROM performances WHERE is_featured = 1 AND is_published = 1 ORDER BY day_id, start_time"
 
-    conn = sqlite3.connect(ROOT_PATH + DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute(query)
     performances = cursor.fetchall()
@@ -178,6 +178,114 @@ def get_featured_performances() -> List[Dict[str, Any]]:
     ]
 
 
+# Performance con i nomi di palco, giorno, genere e organizzatore risolti in un'unica query
+_DETAILS_QUERY = """
+SELECT
+    p.*,
+    COALESCE(s.name, 'Sconosciuto'),
+    COALESCE(d.name, 'Sconosciuto'),
+    d.date,
+    COALESCE(g.name, 'Sconosciuto'),
+    COALESCE(u.username, 'Sconosciuto'),
+    COALESCE(u.name || ' ' || u.surname, 'Sconosciuto')
+FROM performances p
+LEFT JOIN stages s ON s.id = p.stage_id
+LEFT JOIN event_days d ON d.id = p.day_id
+LEFT JOIN genres g ON g.id = p.genre_id
+LEFT JOIN users u ON u.id = p.organizer_id
+"""
+
+
+def _performance_with_details(p: Tuple[Any, ...]) -> Dict[str, Any]:
+    return {
+        "id": p[0],
+        "artist_name": p[1],
+        "start_time": p[2],
+        "duration": p[3],
+        "description": p[4],
+        "image_path": p[5],
+        "day_id": p[6],
+        "stage_id": p[7],
+        "genre_id": p[8],
+        "organizer_id": p[9],
+        "is_published": p[10],
+        "created_at": p[11],
+        "updated_at": p[12],
+        "is_featured": p[13],
+        "stage_name": p[14],
+        "day_name": p[15],
+        "day_date": p[16],
+        "genre_name": p[17],
+        "organizer_username": p[18],
+        "organizer_full_name": p[19],
+    }
+
+
+def get_performance_details(performance_id: int) -> Optional[Dict[str, Any]]:
+    """
+    Restituisce una performance dato il suo ID, con i nomi di palco, giorno,
+    genere e organizzatore già risolti
+
+    Parameters:
+        performance_id (int): ID della performance
+
+    Returns:
+        dict: Dizionario contenente i dettagli della performance, o None se non trovato
+    """
+
+    query = _DETAILS_QUERY + "WHERE p.id = ?"
+
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(query, (performance_id,))
+    p = cursor.fetchone()
+    cursor.close()
+    conn.close()
+
+    return _performance_with_details(p) if p else None
+
+
+def get_all_performances_with_details(
+    include_unpublished: bool = False, organizer_id: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    """
+    Restituisce le performance con i nomi di palco, giorno, genere e organizzatore
+    già risolti, evitando una query per ogni performance
+
+    Parameters:
+        include_unpublished (bool): Se True, include anche le performance non pubblicate (default: False)
+        organizer_id (int, optional): Se specificato, restituisce solo le performance dell'organizzatore, ordinate per giorno e orario
+
+    Returns:
+        list: Lista di dizionari contenenti i dettagli delle performance
+    """
+
+    conditions = []
+    params: List[Any] = []
+
+    if not include_unpublished:
+        conditions.append("p.is_published = 1")
+
+    if organizer_id is not None:
+        conditions.append("p.organizer_id = ?")
+        params.append(organizer_id)
+
+    query = _DETAILS_QUERY
+    if conditions:
+        query += "WHERE " + " AND ".join(conditions)
+    if organizer_id is not None:
+        query += " ORDER BY p.day_id, p.start_time"
+
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(query, tuple(params))
+    performances = cursor.fetchall()
+    cursor.close()
+    conn.close()
+
+    return [_performance_with_details(p) for p in performances]
+
+
 def check_artist_exists(artist_name: str) -> bool:
     """
     Verifica se un artista esiste già
@@ -191,7 +299,7 @@ def check_artist_exists(artist_name: str) -> bool:
 
     query = "SELECT COUNT(*) FROM performances WHERE artist_name = ?"
 
-    conn = sqlite3.connect(ROOT_PATH + DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute(query, (artist_name,))
     count = cursor.fetchone()[0]
@@ -269,7 +377,7 @@ def check_time_slot_available(
     else:
         params = (day_id, stage_id)
 
-    conn = sqlite3.connect(ROOT_PATH + DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute(query, params)
     performances = cursor.fetchall()
@@ -342,9 +450,7 @@ def add_performance(
     ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
     """
 
-    conn = sqlite3.connect(ROOT_PATH + DB_PATH)
-    cursor = conn.cursor()
-    try:
+    def write(cursor: Any) -> Optional[int]:
         cursor.execute(
             query,
             (
@@ -361,22 +467,20 @@ def add_performance(
                 is_featured,
             ),
         )
-        conn.commit()
+        return cursor.lastrowid
 
-        performance_id = cursor.lastrowid
+    try:
+        performance_id = writer.execute(write)
         return (
             performance_id if performance_id is not None else -1
         ), "Performance aggiunta con successo"
 
+    except DatabaseBusyError:
+        raise
     except Exception as e:
-        conn.rollback()
         logger.error(f"Errore durante l'inserimento della performance: {e}")
         return -1, f"Errore durante l'inserimento della performance: {e}"
 
-    finally:
-        cursor.close()
-        conn.close()
-
 
 def update_performance(
     performance_id: int,
@@ -442,38 +546,31 @@ def update_performance(
     WHERE id = ?
     """
 
-    conn = sqlite3.connect(ROOT_PATH + DB_PATH)
-    cursor = conn.cursor()
+    params = (
+        artist_name,
+        start_time,
+        duration,
+        description,
+        image_path,
+        image_path,
+        day_id,
+        stage_id,
+        genre_id,
+        is_published,
+        is_featured,
+        performance_id,
+    )
+
     try:
-        cursor.execute(
-            query,
-            (
-                artist_name,
-                start_time,
-                duration,
-                description,
-                image_path,
-                image_path,
-                day_id,
-                stage_id,
-                genre_id,
-                is_published,
-                is_featured,
-                performance_id,
-            ),
-        )
-        conn.commit()
+        writer.execute(lambda cursor: cursor.execute(query, params))
         return True, "Performance aggiornata con successo"
 
+    except DatabaseBusyError:
+        raise
     except Exception as e:
-        conn.rollback()
         logger.error(f"Errore durante l'aggiornamento della performance: {e}")
         return False, f"Errore durante l'aggiornamento della performance: {e}"
 
-    finally:
-        cursor.close()
-        conn.close()
-
 
 def delete_performance(performance_id: int) -> Tuple[bool, str]:
     """
@@ -495,18 +592,12 @@ def delete_performance(performance_id: int) -> Tuple[bool, str]:
 
     query = "DELETE FROM performances WHERE id = ?"
 
-    conn = sqlite3.connect(ROOT_PATH + DB_PATH)
-    cursor = conn.cursor()
     try:
-        cursor.execute(query, (performance_id,))
-        conn.commit()
+        writer.execute(lambda cursor: cursor.execute(query, (performance_id,)))
         return True, "Performance eliminata con successo"
 
+    except DatabaseBusyError:
+        raise
     except Exception as e:
-        conn.rollback()
         logger.error(f"Errore durante l'eliminazione della performance: {e}")
         return False, f"Errore durante l'eliminazione della performance: {e}"
-
-    finally:
-        cursor.close()
-        conn.close()
@@ -0,0 +1,303 @@
+import cProfile
+import io
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+from utils.logger import get_logger
+
+logger = get_logger()
+
+# Intervallo di campionamento predefinito in secondi (100 campioni al secondo)
+DEFAULT_INTERVAL = 0.01
+# Limiti accettati dagli endpoint di amministrazione
+MAX_DURATION = 300
+MIN_INTERVAL = 0.001
+# Profondità massima degli stack campionati, i frame più esterni vengono scartati
+MAX_DEPTH = 128
+
+# Profilazione di singole richieste: token firmato in header o nel parametro della query
+PROFILE_HEADER = "X-Profile-Token"
+PROFILE_PARAM = "_profile"
+PROFILE_TOKEN_MAX_AGE = 3600
+PROFILE_DIR = os.environ.get("SONOSPHERE_PROFILE_DIR", "profiles")
+# Numero di funzioni riportate nell'header di riepilogo
+PROFILE_SUMMARY_SIZE = 5
+
+_PROFILE_SALT = "sonosphere-request-profile"
+# cProfile misura un solo thread ma dalla 3.12 un solo profiler può essere attivo nel processo:
+# si profila una richiesta alla volta, le altre con un token valido vengono servite senza profilo
+_request_profile_lock = threading.Lock()
+_PROFILE_ENVIRON_KEY = "HTTP_" + PROFILE_HEADER.upper().replace("-", "_")
+_PROFILE_PARAM_QUERY = PROFILE_PARAM + "="
+_UNSAFE_FILENAME_RE = re.compile(r"[^\w.-]")
+
+# I percorsi dei file del progetto vengono riportati relativi alla radice
+_ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + os.sep
+
+
+class SamplingProfiler:
+    """
+    Profiler a campionamento: un thread in background legge periodicamente gli stack
+    di tutti i thread con sys._current_frames() e li accumula in formato "collapsed"
+    (frame separati da ";" seguiti dal numero di campioni), leggibile da flamegraph.pl,
+    speedscope e strumenti analoghi. Il primo frame di ogni stack è il nome del thread,
+    così i worker di waitress (waitress-0, waitress-1, ...) restano distinguibili.
+
+    Attributes:
+        samples (Counter): Numero di campioni per stack collassato.
+        sampling_time (float): Tempo passato dal thread di campionamento a leggere gli stack.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._labels: Dict[Any, str] = {}
+
+        self.samples: Counter = Counter()
+        self.sample_count = 0
+        self.sampling_time = 0.0
+        self.interval = DEFAULT_INTERVAL
+        self.duration = 0.0
+        self.started_at: Optional[float] = None
+        self.stopped_at: Optional[float] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, duration: float, interval: float = DEFAULT_INTERVAL) -> bool:
+        """
+        Avvia una sessione di campionamento, azzerando i risultati della precedente.
+
+        Parameters:
+            duration (float): Durata della sessione in secondi
+            interval (float): Intervallo tra due campioni in secondi
+
+        Returns:
+            bool: False se una sessione è già in corso
+        """
+
+        with self._lock:
+            if self.running:
+                return False
+
+            self.samples = Counter()
+            self.sample_count = 0
+            self.sampling_time = 0.0
+            self.interval = interval
+            self.duration = duration
+            self.started_at = time.time()
+            self.stopped_at = None
+            self._stop.clear()
+
+            self._thread = threading.Thread(
+                target=self._run, name="sonosphere-profiler", daemon=True
+            )
+            self._thread.start()
+
+        logger.info(f"Profiler avviato per {duration} s, intervallo {interval * 1000:.1f} ms")
+        return True
+
+    def stop(self) -> None:
+        """Interrompe la sessione in corso e attende la fine del thread di campionamento"""
+
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        deadline = time.perf_counter() + self.duration
+
+        while not self._stop.is_set():
+            start = time.perf_counter()
+            if start >= deadline:
+                break
+
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_id:
+                    self.samples[self._collapse(names.get(thread_id, str(thread_id)), frame)] += 1
+            self.sample_count += 1
+
+            elapsed = time.perf_counter() - start
+            self.sampling_time += elapsed
+            self._stop.wait(max(self.interval - elapsed, 0))
+
+        self.stopped_at = time.time()
+        logger.info(
+            f"Profiler terminato: {self.sample_count} campioni, overhead {self.overhead() * 100:.2f}%"
+        )
+
+    def _collapse(self, thread_name: str, frame: Any) -> str:
+        frames = []
+        while frame is not None and len(frames) < MAX_DEPTH:
+            code = frame.f_code
+            label = self._labels.get(code)
+            if label is None:
+                filename = code.co_filename
+                if filename.startswith(_ROOT_DIR):
+                    filename = filename[len(_ROOT_DIR):]
+                # ";" separa i frame e lo spazio finale il conteggio: non possono comparire nell'etichetta
+                label = f"{code.co_name} ({filename}:{code.co_firstlineno})".replace(";", ":")
+                self._labels[code] = label
+            frames.append(label)
+            frame = frame.f_back
+
+        frames.append(thread_name.replace(";", ":").replace(" ", "_"))
+        frames.reverse()
+        return ";".join(frames)
+
+    def overhead(self) -> float:
+        """
+        Frazione del tempo di esecuzione passata a campionare, durante la quale
+        il thread di campionamento tiene il GIL e rallenta gli altri thread.
+        """
+
+        if self.started_at is None:
+            return 0.0
+        wall = (self.stopped_at or time.time()) - self.started_at
+        return self.sampling_time / wall if wall > 0 else 0.0
+
+    def collapsed(self) -> str:
+        """
+        Restituisce i campioni raccolti in formato collapsed, una riga per stack.
+        """
+
+        samples = list(self.samples.items())
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(samples))
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "started_at": self.started_at,
+            "stopped_at": self.stopped_at,
+            "duration": self.duration,
+            "interval": self.interval,
+            "samples": self.sample_count,
+            "stacks": len(self.samples),
+            "overhead": round(self.overhead(), 5),
+        }
+
+
+profiler = SamplingProfiler()
+
+
+def create_profile_token(secret_key: str) -> str:
+    """
+    Crea un token firmato che abilita la profilazione di una richiesta,
+    valido per PROFILE_TOKEN_MAX_AGE secondi.
+
+    Parameters:
+        secret_key (str): La SECRET_KEY dell'applicazione
+
+    Returns:
+        str: Il token da inviare nell'header X-Profile-Token o nel parametro _profile
+    """
+
+    return URLSafeTimedSerializer(secret_key, salt=_PROFILE_SALT).dumps("profile")
+
+
+def start_request_profile(
+    environ: Dict[str, Any], args: Any, secret_key: str
+) -> Optional[cProfile.Profile]:
+    """
+    Avvia cProfile per la richiesta corrente se contiene un token valido e nessun'altra
+    richiesta è in profilazione. Senza token il costo è di due ricerche nell'environ WSGI.
+
+    Parameters:
+        environ (dict): L'environ WSGI della richiesta
+        args: I parametri della query, letti solo se la query contiene _profile
+        secret_key (str): La SECRET_KEY dell'applicazione
+
+    Returns:
+        cProfile.Profile: Il profiler attivo, o None se la richiesta non va profilata
+    """
+
+    token = environ.get(_PROFILE_ENVIRON_KEY)
+    if token is None:
+        if _PROFILE_PARAM_QUERY not in environ.get("QUERY_STRING", ""):
+            return None
+        token = args.get(PROFILE_PARAM)
+
+    try:
+        URLSafeTimedSerializer(secret_key, salt=_PROFILE_SALT).loads(
+            token, max_age=PROFILE_TOKEN_MAX_AGE
+        )
+    except BadSignature:
+        logger.warning("Token di profilazione non valido o scaduto, richiesta non profilata")
+        return None
+
+    if not _request_profile_lock.acquire(blocking=False):
+        logger.info("Un'altra richiesta è in profilazione, richiesta non profilata")
+        return None
+
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError as e:
+        # Dalla 3.12: un altro strumento di profilazione (debugger, coverage, ...) è già attivo
+        _request_profile_lock.release()
+        logger.warning(f"Impossibile avviare cProfile, richiesta non profilata: {e}")
+        return None
+    return profile
+
+
+def stop_request_profile(profile: cProfile.Profile) -> None:
+    """
+    Ferma il profiler della richiesta senza salvarlo (es. se la richiesta è fallita)
+    e permette di profilare la richiesta successiva.
+
+    Parameters:
+        profile (cProfile.Profile): Il profiler restituito da start_request_profile
+    """
+
+    try:
+        profile.disable()
+    finally:
+        _request_profile_lock.release()
+
+
+def finish_request_profile(profile: cProfile.Profile, endpoint: str) -> Tuple[str, str]:
+    """
+    Ferma il profiler della richiesta e salva le statistiche in PROFILE_DIR
+    in un file <endpoint>_<timestamp>.pstats, leggibile con pstats o snakeviz.
+
+    Parameters:
+        profile (cProfile.Profile): Il profiler restituito da start_request_profile
+        endpoint (str): L'endpoint della richiesta, usato nel nome del file
+
+    Returns:
+        str: Il percorso del file salvato
+        str: Riepilogo delle funzioni con il tempo cumulativo più alto
+    """
+
+    stop_request_profile(profile)
+
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    path = os.path.join(PROFILE_DIR, f"{_UNSAFE_FILENAME_RE.sub('_', endpoint)}_{timestamp}.pstats")
+    profile.dump_stats(path)
+
+    stats = pstats.Stats(profile, stream=io.StringIO())
+    stats.sort_stats(pstats.SortKey.CUMULATIVE)
+    summary = []
+    for filename, line, function in stats.fcn_list[:PROFILE_SUMMARY_SIZE]:
+        cumulative = stats.stats[(filename, line, function)][3]
+        if filename.startswith(_ROOT_DIR):
+            filename = filename[len(_ROOT_DIR):]
+        summary.append(f"{function} ({os.path.basename(filename)}:{line})={cumulative * 1000:.2f}ms")
+
+    logger.info(f"Profilo della richiesta {endpoint} salvato in {path}")
+    return path, "; ".join(summary)
@@ -0,0 +1,114 @@
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from utils import event_days_dao, metrics
+from utils.logger import get_logger
+
+logger = get_logger()
+
+# Intervallo tra due riconciliazioni periodiche, in secondi (0 per disattivarle)
+RECONCILE_INTERVAL = float(os.environ.get("SONOSPHERE_RECONCILE_INTERVAL", 300))
+# Se impostata, la riconciliazione periodica corregge i contatori invece di segnalare soltanto la differenza
+RECONCILE_FIX = bool(os.environ.get("SONOSPHERE_RECONCILE_FIX"))
+
+
+def _drifted(days: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [
+        day
+        for day in days
+        if day["current_attendees"] != day["actual_attendees"]
+        or day["held_attendees"] != day["actual_held"]
+    ]
+
+
+def reconcile_attendees(fix: bool = False) -> List[Dict[str, Any]]:
+    """
+    Confronta i contatori dei giorni con i biglietti e le prenotazioni reali, segnala
+    nel log e nelle metriche le differenze e, se richiesto, le corregge.
+
+    Parameters:
+        fix (bool): Se True i contatori vengono riportati ai valori ricalcolati
+
+    Returns:
+        list: I giorni con contatori diversi dai valori ricalcolati (vedi event_days_dao.get_attendee_counts)
+    """
+
+    try:
+        days = event_days_dao.get_attendee_counts()
+        drifted = _drifted(days)
+        if drifted and fix:
+            drifted = event_days_dao.reconcile_day_attendees()
+    except Exception:
+        metrics.RECONCILIATIONS.inc(("failed",))
+        raise
+
+    fixed = {day["id"] for day in drifted} if fix else set()
+    for day in days:
+        if day["id"] in fixed:
+            current_drift = held_drift = 0
+        else:
+            current_drift = day["current_attendees"] - day["actual_attendees"]
+            held_drift = day["held_attendees"] - day["actual_held"]
+        metrics.ATTENDEE_DRIFT.set(current_drift, (day["name"], "current"))
+        metrics.ATTENDEE_DRIFT.set(held_drift, (day["name"], "held"))
+
+    if not drifted:
+        metrics.RECONCILIATIONS.inc(("clean",))
+    elif fix:
+        metrics.RECONCILIATIONS.inc(("fixed",))
+    else:
+        metrics.RECONCILIATIONS.inc(("drift",))
+        for day in drifted:
+            logger.warning(
+                f"Contatori di {day['name']} non allineati: partecipanti {day['current_attendees']} "
+                f"(reali {day['actual_attendees']}), prenotati {day['held_attendees']} (reali {day['actual_held']})"
+            )
+
+    return drifted
+
+
+class Reconciler:
+    """
+    Thread che esegue la riconciliazione dei contatori dei giorni ogni RECONCILE_INTERVAL
+    secondi. Il confronto è un solo aggregato su tickets e ticket_holds; la correzione,
+    se attiva, passa dal thread di scrittura.
+    """
+
+    def __init__(self, interval: float = RECONCILE_INTERVAL, fix: bool = RECONCILE_FIX) -> None:
+        self.interval = interval
+        self.fix = fix
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        """Avvia il thread, se non è già attivo e l'intervallo è positivo"""
+
+        with self._lock:
+            if self._thread is not None or self.interval <= 0:
+                return
+            self._thread = threading.Thread(target=self._run, name="sonosphere-reconciler", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            try:
+                reconcile_attendees(self.fix)
+            except Exception:
+                logger.exception("Errore durante la riconciliazione dei contatori dei giorni")
+
+
+reconciler = Reconciler()
+
+if hasattr(os, "register_at_fork"):
+    # Il thread non sopravvive al fork: nei worker (wsgi.py --workers) viene ricreato
+    def _restart_in_child() -> None:
+        started = reconciler._thread is not None
+        reconciler._thread = None
+        reconciler._lock = threading.Lock()
+        if started:
+            reconciler.start()
+
+    os.register_at_fork(after_in_child=_restart_in_child)
@@ -1,8 +1,7 @@
-import sqlite3
 from typing import Dict, List, Optional, Union
 
+from utils.db import get_connection
 from utils.logger import get_logger
-from utils.vars import DB_PATH, ROOT_PATH
 
 logger = get_logger()
 
@@ -17,7 +16,7 @@ def get_all_stages() -> List[Dict[str, Union[int, str]]]:
 
     query = "SELECT * FROM stages"
 
-    conn = sqlite3.connect(ROOT_PATH + DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute(query)
     stages = cursor.fetchall()
@@ -43,7 +42,7 @@ def get_stage_by_id(stage_id: int) -> Optional[Dict[str, Union[int, str]]]:
 
     query = "SELECT * FROM stages WHERE id = ?"
 
-    conn = sqlite3.connect(ROOT_PATH + DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute(query, (stage_id,))
     stage = cursor.fetchone()
@@ -0,0 +1,75 @@
+import os
+import time
+from typing import Any, Dict
+
+from jinja2 import Environment, FileSystemBytecodeCache
+from jinja2.bccache import Bucket
+
+from utils import metrics
+from utils.logger import get_logger
+from utils.vars import TEMPLATE_CACHE_PATH
+
+logger = get_logger()
+
+
+class InstrumentedBytecodeCache(FileSystemBytecodeCache):
+    """
+    Cache su file del bytecode dei template che registra hit e miss nella metrica
+    sonosphere_cache_requests_total (cache="jinja_bytecode").
+    I file vengono scritti in modo atomico, la directory può essere condivisa tra processi.
+    """
+
+    def __init__(self, directory: str) -> None:
+        os.makedirs(directory, exist_ok=True)
+        super().__init__(directory)
+
+    def load_bytecode(self, bucket: Bucket) -> None:
+        super().load_bytecode(bucket)
+        # Se il sorgente o la versione di Jinja sono cambiati il bucket resta vuoto
+        metrics.record_cache("jinja_bytecode", bucket.code is not None)
+
+
+def bytecode_cache(directory: str = TEMPLATE_CACHE_PATH) -> InstrumentedBytecodeCache:
+    """
+    Crea la cache del bytecode da passare a Jinja (app.jinja_options["bytecode_cache"]).
+
+    Parameters:
+        directory (str): Directory dei file di cache, creata se non esiste
+
+    Returns:
+        InstrumentedBytecodeCache: La cache
+    """
+
+    return InstrumentedBytecodeCache(directory)
+
+
+def precompile_templates(env: Environment) -> Dict[str, Any]:
+    """
+    Carica tutti i template dell'ambiente Jinja, così le prime richieste non pagano
+    la compilazione. Con una cache del bytecode configurata i template già compilati
+    vengono letti dalla cache, gli altri compilati e salvati.
+
+    Parameters:
+        env (Environment): L'ambiente Jinja dell'applicazione (app.jinja_env)
+
+    Returns:
+        dict: Numero di template caricati, di quelli letti dalla cache e durata in secondi
+    """
+
+    start = time.perf_counter()
+    hits_before = metrics.CACHE_REQUESTS.value(("jinja_bytecode", "hit"))
+    names = env.list_templates(extensions=("html",))
+
+    for name in names:
+        env.get_template(name)
+
+    result = {
+        "templates": len(names),
+        "cached": int(metrics.CACHE_REQUESTS.value(("jinja_bytecode", "hit")) - hits_before),
+        "duration": time.perf_counter() - start,
+    }
+    logger.info(
+        f"Template precompilati: {result['templates']} in {result['duration'] * 1000:.0f} ms "
+        f"({result['cached']} dalla cache del bytecode)"
+    )
+    return result
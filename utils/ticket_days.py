@@ -0,0 +1,51 @@
+from typing import Iterable, List
+
+# I giorni di validità di biglietti e prenotazioni sono salvati in una sola colonna intera "days":
+# il bit (id - 1) è acceso se il biglietto vale per il giorno con quell'id di event_days.
+# Un intero SQLite ha 64 bit, quindi il festival può avere fino a 63 giorni.
+MAX_DAYS = 63
+
+
+def day_bit(day_id: int) -> int:
+    """Restituisce il bit del giorno indicato"""
+
+    if not 1 <= day_id <= MAX_DAYS:
+        raise ValueError(f"ID del giorno non valido: {day_id}")
+    return 1 << (day_id - 1)
+
+
+def days_to_mask(days: Iterable[int]) -> int:
+    """
+    Converte una lista di ID dei giorni nella maschera di bit salvata nel database
+
+    Parameters:
+        days (iterable): ID dei giorni
+
+    Returns:
+        int: La maschera dei giorni
+    """
+
+    mask = 0
+    for day_id in days:
+        mask |= day_bit(day_id)
+    return mask
+
+
+def mask_to_days(mask: int) -> List[int]:
+    """
+    Converte una maschera di bit nella lista ordinata degli ID dei giorni
+
+    Parameters:
+        mask (int): La maschera dei giorni
+
+    Returns:
+        list: ID dei giorni
+    """
+
+    return [bit + 1 for bit in range(mask.bit_length()) if mask >> bit & 1]
+
+
+def covers_day(mask: int, day_id: int) -> bool:
+    """True se la maschera comprende il giorno indicato (es. per la validazione agli ingressi)"""
+
+    return bool(mask & day_bit(day_id))
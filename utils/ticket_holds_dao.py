@@ -0,0 +1,265 @@
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils import metrics
+from utils.db import DatabaseBusyError, get_connection
+from utils.db_writer import Rollback, writer
+from utils.logger import get_logger
+from utils.ticket_days import days_to_mask, mask_to_days
+from utils.tickets_dao import get_ticket_by_user_id
+
+logger = get_logger()
+
+# Durata di una prenotazione prima della scadenza, in secondi
+HOLD_TTL = 10 * 60
+
+
+def _release_days(cursor: Any, rows: List[Tuple[int]]) -> None:
+    """Restituisce alla capienza dei giorni i posti delle prenotazioni eliminate"""
+
+    # Le prenotazioni con gli stessi giorni vengono contate insieme prima di scomporre la maschera
+    released = Counter()
+    for mask, count in Counter(row[0] for row in rows).items():
+        for day_id in mask_to_days(mask):
+            released[day_id] += count
+
+    cursor.executemany(
+        "UPDATE event_days SET held_attendees = held_attendees - ? WHERE id = ?",
+        [(count, day_id) for day_id, count in released.items() if count],
+    )
+
+
+def get_hold_by_user_id(user_id: int) -> Optional[Dict[str, Any]]:
+    """
+    Restituisce la prenotazione non scaduta di un utente
+
+    Parameters:
+        user_id (int): L'ID dell'utente
+
+    Returns:
+        dict: Dizionario con i dettagli della prenotazione, il nome e il prezzo del tipo di biglietto, o None se non trovata
+    """
+
+    query = """
+    SELECT h.id, h.ticket_type_id, h.days, h.expires_at, tt.name, tt.price
+    FROM ticket_holds h
+    JOIN ticket_types tt ON tt.id = h.ticket_type_id
+    WHERE h.user_id = ? AND h.expires_at > ?
+    """
+
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(query, (user_id, time.time()))
+    hold = cursor.fetchone()
+    cursor.close()
+    conn.close()
+
+    if hold:
+        return {
+            "id": hold[0],
+            "user_id": user_id,
+            "ticket_type_id": hold[1],
+            "days": mask_to_days(hold[2]),
+            "expires_at": hold[3],
+            "ticket_type_name": hold[4],
+            "price": hold[5],
+        }
+
+    return None
+
+
+def create_hold(
+    user_id: int, ticket_type_id: int, days: List[int], ttl: float = HOLD_TTL
+) -> Tuple[bool, Optional[Dict[str, Any]]]:
+    """
+    Prenota un posto per ciascuno dei giorni indicati per ttl secondi.
+    La verifica della capienza e la prenotazione avvengono con un solo UPDATE condizionale
+    nella transazione del thread di scrittura: due acquisti concorrenti non possono superare la capienza.
+    Un'eventuale prenotazione precedente dell'utente viene sostituita.
+
+    Parameters:
+        user_id (int): ID dell'utente
+        ticket_type_id (int): ID del tipo di biglietto
+        days (list): ID dei giorni da prenotare (event_days.id)
+        ttl (float): Durata della prenotazione in secondi
+
+    Returns:
+        bool: True se la prenotazione è andata a buon fine, False se l'utente ha già un biglietto o i posti sono esauriti
+        dict (optional): Id e scadenza della prenotazione
+    """
+
+    days = sorted(set(days))
+    placeholders = ", ".join("?" for _ in days)
+    reserve_query = f"""
+    UPDATE event_days SET held_attendees = held_attendees + 1
+    WHERE id IN ({placeholders}) AND current_attendees + held_attendees < max_attendees
+    """
+
+    def write(cursor: Any) -> Dict[str, Any]:
+        cursor.execute("SELECT 1 FROM tickets WHERE user_id = ?", (user_id,))
+        if cursor.fetchone():
+            raise Rollback("ticket")
+
+        cursor.execute(
+            "DELETE FROM ticket_holds WHERE user_id = ? RETURNING days",
+            (user_id,),
+        )
+        _release_days(cursor, cursor.fetchall())
+
+        cursor.execute(reserve_query, days)
+        if cursor.rowcount != len(days):
+            raise Rollback("sold_out")
+
+        expires_at = time.time() + ttl
+        cursor.execute(
+            """INSERT INTO ticket_holds (user_id, ticket_type_id, days, expires_at)
+            VALUES (?, ?, ?, ?) RETURNING id""",
+            (user_id, ticket_type_id, days_to_mask(days), expires_at),
+        )
+        return {"id": cursor.fetchone()[0], "expires_at": expires_at}
+
+    try:
+        hold = writer.execute(write)
+    except DatabaseBusyError:
+        raise
+    except Exception as e:
+        logger.error(f"Errore durante la prenotazione del biglietto: {e}")
+        return False, None
+
+    if hold == "ticket":
+        logger.error("L'utente ha già un biglietto.")
+        return False, None
+    if hold == "sold_out":
+        metrics.TICKET_HOLDS.inc(("rejected",))
+        logger.error(f"Posti esauriti per almeno uno dei giorni {days}.")
+        return False, None
+
+    metrics.TICKET_HOLDS.inc(("created",))
+    return True, hold
+
+
+def convert_hold(user_id: int) -> Tuple[bool, Optional[Dict[str, Any]]]:
+    """
+    Trasforma la prenotazione non scaduta di un utente in un biglietto. I posti sono già
+    riservati: basta spostarli da held_attendees a current_attendees, senza verificare la capienza.
+
+    Parameters:
+        user_id (int): ID dell'utente
+
+    Returns:
+        bool: True se il biglietto è stato creato, False se la prenotazione non esiste o è scaduta
+        dict (optional): Dettagli del biglietto creato
+    """
+
+    def write(cursor: Any) -> bool:
+        cursor.execute(
+            """DELETE FROM ticket_holds WHERE user_id = ? AND expires_at > ?
+            RETURNING ticket_type_id, days""",
+            (user_id, time.time()),
+        )
+        hold = cursor.fetchone()
+        if not hold:
+            return False
+
+        days = mask_to_days(hold[1])
+        placeholders = ", ".join("?" for _ in days)
+        cursor.execute(
+            f"""UPDATE event_days SET held_attendees = held_attendees - 1,
+            current_attendees = current_attendees + 1 WHERE id IN ({placeholders})""",
+            days,
+        )
+        cursor.execute(
+            "INSERT INTO tickets (user_id, ticket_type_id, days) VALUES (?, ?, ?)",
+            (user_id, *hold),
+        )
+        return True
+
+    try:
+        converted = writer.execute(write)
+    except DatabaseBusyError:
+        raise
+    except Exception as e:
+        logger.error(f"Errore durante la conferma della prenotazione: {e}")
+        return False, None
+
+    if not converted:
+        logger.error("Prenotazione inesistente o scaduta.")
+        return False, None
+
+    metrics.TICKET_HOLDS.inc(("converted",))
+    logger.info("Biglietto creato con successo.")
+    return True, get_ticket_by_user_id(user_id)
+
+
+def release_hold(user_id: int) -> bool:
+    """
+    Annulla la prenotazione di un utente restituendo i posti
+
+    Parameters:
+        user_id (int): ID dell'utente
+
+    Returns:
+        bool: True se esisteva una prenotazione
+    """
+
+    def write(cursor: Any) -> int:
+        cursor.execute(
+            "DELETE FROM ticket_holds WHERE user_id = ? RETURNING days",
+            (user_id,),
+        )
+        rows = cursor.fetchall()
+        _release_days(cursor, rows)
+        return len(rows)
+
+    if writer.execute(write):
+        metrics.TICKET_HOLDS.inc(("released",))
+        return True
+    return False
+
+
+def expire_holds(now: Optional[float] = None) -> int:
+    """
+    Elimina le prenotazioni scadute restituendo i posti alla capienza dei giorni
+
+    Parameters:
+        now (float, optional): Istante di riferimento (time.time), predefinito l'istante attuale
+
+    Returns:
+        int: Numero di prenotazioni scadute eliminate
+    """
+
+    def write(cursor: Any) -> int:
+        cursor.execute(
+            "DELETE FROM ticket_holds WHERE expires_at <= ? RETURNING days",
+            (time.time() if now is None else now,),
+        )
+        rows = cursor.fetchall()
+        _release_days(cursor, rows)
+        return len(rows)
+
+    expired = writer.execute(write)
+    if expired:
+        metrics.TICKET_HOLDS.inc(("expired",), expired)
+        logger.info(f"Prenotazioni scadute: {expired}")
+    return expired
+
+
+def get_hold_expirations() -> List[Tuple[float, int]]:
+    """
+    Restituisce scadenza e id di tutte le prenotazioni, per ricostruire la coda delle scadenze all'avvio
+
+    Returns:
+        list: Coppie (scadenza, id prenotazione) in ordine di scadenza
+    """
+
+    query = "SELECT expires_at, id FROM ticket_holds ORDER BY expires_at"
+
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(query)
+    holds = cursor.fetchall()
+    cursor.close()
+    conn.close()
+
+    return [(hold[0], hold[1]) for hold in holds]
@@ -1,8 +1,7 @@
-import sqlite3
 from typing import Any, Dict, List, Optional
 
+from utils.db import get_connection
 from utils.logger import get_logger
-from utils.vars import DB_PATH, ROOT_PATH
 
 logger = get_logger()
 
@@ -17,7 +16,7 @@ def get_all_ticket_types() -> List[Dict[str, Any]]:
 
     query = "SELECT * FROM ticket_types"
 
-    conn = sqlite3.connect(ROOT_PATH + DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute(query)
     ticket_types = cursor.fetchall()
@@ -48,7 +47,7 @@ def get_ticket_type_by_id(ticket_type_id: int) -> Optional[Dict[str, Any]]:
     """
     query = "SELECT * FROM ticket_types WHERE id = ?"
 
-    conn = sqlite3.connect(ROOT_PATH + DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute(query, (ticket_type_id,))
     ticket_type = cursor.fetchone()
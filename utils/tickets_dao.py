@@ -1,9 +1,9 @@
-import sqlite3
 from typing import Any, Dict, List, Optional, Tuple
 
-from utils.event_days_dao import get_days_attendees, update_day_attendees
+from utils.db import DatabaseBusyError, get_connection
+from utils.db_writer import Rollback, writer
 from utils.logger import get_logger
-from utils.vars import DB_PATH, ROOT_PATH
+from utils.ticket_days import days_to_mask, mask_to_days
 
 logger = get_logger()
 
@@ -16,11 +16,16 @@ def get_ticket_by_user_id(user_id: int) -> Optional[Dict[str, Any]]:
         user_id (int): L'ID dell'utente
 
     Returns:
-        dict: Dizionario contenente i dettagli del biglietto, o None se non trovato
+        dict: Dizionario contenente i dettagli del biglietto, i giorni di validità (ID e maschera) e il nome del suo tipo, o None se non trovato
+    """
+    query = """
+    SELECT t.id, t.user_id, t.ticket_type_id, t.purchase_date, t.is_valid, t.days, tt.name
+    FROM tickets t
+    LEFT JOIN ticket_types tt ON tt.id = t.ticket_type_id
+    WHERE t.user_id = ?
     """
-    query = "SELECT * FROM tickets WHERE user_id = ?"
 
-    conn = sqlite3.connect(ROOT_PATH + DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute(query, (user_id,))
     ticket = cursor.fetchone()
@@ -34,9 +39,9 @@ def get_ticket_by_user_id(user_id: int) -> Optional[Dict[str, Any]]:
             "ticket_type_id": ticket[2],
             "purchase_date": ticket[3],
             "is_valid": ticket[4],
-            "friday": ticket[5],
-            "saturday": ticket[6],
-            "sunday": ticket[7],
+            "days": mask_to_days(ticket[5]),
+            "days_mask": ticket[5],
+            "ticket_type_name": ticket[6] or "Biglietto",
         }
 
     return None
@@ -51,7 +56,7 @@ def create_ticket(
     Parameters:
         user_id (int): ID dell'utente
         ticket_type_id (int): ID del tipo di biglietto
-        days (list): Lista dei giorni per cui è valido il biglietto [1=venerdì, 2=sabato, 3=domenica]
+        days (list): ID dei giorni per cui è valido il biglietto (event_days.id)
 
     Returns:
         bool: True se la creazione è andata a buon fine, False altrimenti
@@ -63,38 +68,40 @@ def create_ticket(
         logger.error("L'utente ha già un biglietto.")
         return False, existing_ticket
 
-    friday = 1 if 1 in days else 0
-    saturday = 1 if 2 in days else 0
-    sunday = 1 if 3 in days else 0
-
-    for day_id in days:
-        day_availability = get_days_attendees(day_id)
-        if day_availability["current_attendees"] >= day_availability["max_attendees"]:  # type: ignore
-            logger.error(f"Posti esauriti per il giorno {day_id}.")
-            return False, None
+    days = sorted(set(days))
+    mask = days_to_mask(days)
+    placeholders = ", ".join("?" for _ in days)
+    # Verifica della capienza (compresi i posti prenotati) e aggiornamento in un solo statement
+    reserve_query = f"""
+    UPDATE event_days SET current_attendees = current_attendees + 1
+    WHERE id IN ({placeholders}) AND current_attendees + held_attendees < max_attendees
+    """
 
     query = """
-    INSERT INTO tickets (user_id, ticket_type_id, friday, saturday, sunday) 
-    VALUES (?, ?, ?, ?, ?)
+    INSERT INTO tickets (user_id, ticket_type_id, days)
+    VALUES (?, ?, ?)
     """
 
-    conn = sqlite3.connect(ROOT_PATH + DB_PATH)
-    cursor = conn.cursor()
-    try:
-        cursor.execute(query, (user_id, ticket_type_id, friday, saturday, sunday))
-        conn.commit()
-
-        for day_id in days:
-            update_day_attendees(day_id, 1)
-
-        logger.info("Biglietto creato con successo.")
-        return True, get_ticket_by_user_id(user_id)
+    # Eseguita dal thread di scrittura nella transazione di gruppo: la capienza non può
+    # essere superata da due acquisti concorrenti
+    def write(cursor: Any) -> bool:
+        cursor.execute(reserve_query, days)
+        if cursor.rowcount != len(days):
+            raise Rollback(False)
+        cursor.execute(query, (user_id, ticket_type_id, mask))
+        return True
 
+    try:
+        created = writer.execute(write)
+    except DatabaseBusyError:
+        raise
     except Exception as e:
-        conn.rollback()
         logger.error(f"Errore durante la creazione del biglietto: {e}")
         return False, None
 
-    finally:
-        cursor.close()
-        conn.close()
+    if not created:
+        logger.error(f"Posti esauriti per almeno uno dei giorni {days}.")
+        return False, None
+
+    logger.info("Biglietto creato con successo.")
+    return True, get_ticket_by_user_id(user_id)
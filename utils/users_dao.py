@@ -1,8 +1,8 @@
-import sqlite3
 from typing import Any, Dict, Optional
 
+from utils.db import DatabaseBusyError, get_connection
+from utils.db_writer import writer
 from utils.logger import get_logger
-from utils.vars import DB_PATH, ROOT_PATH
 
 logger = get_logger()
 
@@ -20,7 +20,7 @@ def get_user_by_id(user_id: int) -> Optional[Dict[str, Any]]:
 
     query = "SELECT * FROM users WHERE id = ?"
 
-    conn = sqlite3.connect(ROOT_PATH + DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute(query, (user_id,))
     user = cursor.fetchone()
@@ -58,7 +58,7 @@ def user_from_nickname(username: str) -> Optional[Dict[str, Any]]:
 
     query = "SELECT * FROM users WHERE username = ?"
 
-    conn = sqlite3.connect(ROOT_PATH + DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute(query, (username,))
     user = cursor.fetchone()
@@ -96,7 +96,7 @@ def user_from_email(email: str) -> Optional[Dict[str, Any]]:
 
     query = "SELECT * FROM users WHERE email = ?"
 
-    conn = sqlite3.connect(ROOT_PATH + DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute(query, (email,))
     user = cursor.fetchone()
@@ -149,21 +149,20 @@ def new_user(
 
     query = "INSERT INTO users (username, name, surname, email, password, pfp, role) VALUES (?, ?, ?, ?, ?, ?, ?)"
 
-    try:
-        conn = sqlite3.connect(ROOT_PATH + DB_PATH)
-        cursor = conn.cursor()
+    def write(cursor: Any) -> Optional[int]:
         cursor.execute(
             query, (username, name, surname, email, password, pfp_path, role)
         )
-        conn.commit()
+        return cursor.lastrowid
 
-        user_id = cursor.lastrowid
-        cursor.close()
-        conn.close()
+    try:
+        user_id = writer.execute(write)
 
         logger.info(f"Nuovo utente creato: {username} (ID: {user_id})")
         return user_id if user_id is not None else -1
 
+    except DatabaseBusyError:
+        raise
     except Exception as e:
         logger.error(f"Errore durante la creazione dell'utente {username}: {e}")
         return -1
@@ -214,15 +213,12 @@ def update_user(
     params.append(user_id)
 
     try:
-        conn = sqlite3.connect(ROOT_PATH + DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute(query, tuple(params))
-        conn.commit()
-        cursor.close()
-        conn.close()
+        writer.execute(lambda cursor: cursor.execute(query, tuple(params)))
 
         logger.info(f"Dati utente aggiornati per ID: {user_id}")
 
+    except DatabaseBusyError:
+        raise
     except Exception as e:
         logger.error(f"Errore durante l'aggiornamento dell'utente ID {user_id}: {e}")
 
@@ -239,15 +235,12 @@ def update_user_pfp(user_id: int, pfp_path: str):
     query = "UPDATE users SET pfp = ? WHERE id = ?"
 
     try:
-        conn = sqlite3.connect(ROOT_PATH + DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute(query, (pfp_path, user_id))
-        conn.commit()
-        cursor.close()
-        conn.close()
+        writer.execute(lambda cursor: cursor.execute(query, (pfp_path, user_id)))
 
         logger.info(f"Immagine profilo aggiornata per utente ID: {user_id}")
 
+    except DatabaseBusyError:
+        raise
     except Exception as e:
         logger.error(
             f"Errore durante l'aggiornamento dell'immagine profilo per utente ID {user_id}: {e}"
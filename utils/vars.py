@@ -1,4 +1,12 @@
-DB_PATH = "db/sonosphere.db"
+import os
+
+# Il percorso può essere sovrascritto per puntare ad un database di test o di benchmark
+DB_PATH = os.environ.get("SONOSPHERE_DB_PATH", "db/sonosphere.db")
 
 # ROOT_PATH = "IAW-Esame-2025-06-16/"   # Impostata per l'hosting su PythonAnywhere
 ROOT_PATH = ""                        # Impostata per l'esecuzione locale
+
+# Cache del bytecode dei template Jinja, condivisa tra i processi e popolabile in fase di deploy
+TEMPLATE_CACHE_PATH = os.environ.get(
+    "SONOSPHERE_TEMPLATE_CACHE", f"{ROOT_PATH}cache/templates"
+)
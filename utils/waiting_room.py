@@ -0,0 +1,227 @@
+import math
+import threading
+import time
+from typing import Any, Dict, NamedTuple, Optional
+
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+from utils import metrics, waiting_room_dao
+from utils.logger import get_logger
+
+logger = get_logger()
+
+# Cookie con il token di coda, limitato ai percorsi /tickets
+QUEUE_COOKIE = "sonosphere_queue"
+# Durata di validità di un token di coda, in secondi
+TOKEN_MAX_AGE = 4 * 3600
+# Numeri di coda riservati con una sola scrittura e poi assegnati in memoria
+SERIAL_BLOCK = 20
+# Ogni processo rilegge lo stato dal database al massimo una volta in questo intervallo
+STATE_REFRESH_INTERVAL = 1.0
+# Limiti dell'intervallo di polling suggerito alla pagina di attesa, in secondi
+MIN_POLL_INTERVAL = 2
+MAX_POLL_INTERVAL = 30
+
+_QUEUE_SALT = "sonosphere-waiting-room"
+
+
+class QueueTicket(NamedTuple):
+    """Contenuto di un token di coda"""
+
+    serial: int
+    epoch: int
+    user_id: int
+
+
+def create_queue_token(secret_key: str, ticket: QueueTicket) -> str:
+    """
+    Firma un token di coda da salvare nel cookie QUEUE_COOKIE
+
+    Parameters:
+        secret_key (str): La SECRET_KEY dell'applicazione
+        ticket (QueueTicket): Numero di coda, coda di appartenenza e utente
+
+    Returns:
+        str: Il token firmato
+    """
+
+    return URLSafeTimedSerializer(secret_key, salt=_QUEUE_SALT).dumps(list(ticket))
+
+
+def read_queue_token(secret_key: str, token: Optional[str]) -> Optional[QueueTicket]:
+    """
+    Verifica un token di coda
+
+    Parameters:
+        secret_key (str): La SECRET_KEY dell'applicazione
+        token (str, optional): Il valore del cookie QUEUE_COOKIE
+
+    Returns:
+        QueueTicket: Il contenuto del token, o None se assente, non valido o scaduto
+    """
+
+    if not token:
+        return None
+
+    try:
+        serial, epoch, user_id = URLSafeTimedSerializer(secret_key, salt=_QUEUE_SALT).loads(
+            token, max_age=TOKEN_MAX_AGE
+        )
+    except (BadSignature, ValueError, TypeError):
+        return None
+
+    return QueueTicket(serial, epoch, user_id)
+
+
+def frontier(state: Dict[str, Any], now: Optional[float] = None) -> float:
+    """
+    Fronte di ammissione: sono ammessi all'acquisto tutti i numeri di coda minori o uguali.
+    Avanza di rate numeri al secondo a partire da (base_serial, base_time), quindi ogni
+    processo lo calcola dallo stesso stato senza scritture nel database.
+    """
+
+    if now is None:
+        now = time.time()
+    return state["base_serial"] + max(0.0, now - state["base_time"]) * state["rate"]
+
+
+class WaitingRoom:
+    """
+    Sala d'attesa virtuale per l'apertura delle vendite.
+
+    Gli utenti ricevono un numero di coda firmato e vengono ammessi all'acquisto quando il
+    fronte di ammissione lo raggiunge. Lo stato persistente (tabella waiting_room) viene letto
+    al massimo una volta al secondo e aggiornato solo per riservare un blocco di SERIAL_BLOCK
+    numeri: le scritture non crescono con il polling e crescono con gli arrivi di un
+    fattore SERIAL_BLOCK inferiore.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._state: Optional[Dict[str, Any]] = None
+        self._loaded_at = -math.inf
+        # Blocco di numeri riservato dal processo: [prossimo, fine)
+        self._next_serial = 0
+        self._block_end = 0
+        self._block_epoch: Optional[int] = None
+
+    def state(self) -> Optional[Dict[str, Any]]:
+        """
+        Stato della sala d'attesa, letto dal database al massimo ogni STATE_REFRESH_INTERVAL secondi
+
+        Returns:
+            dict: Lo stato, o None se la sala d'attesa è chiusa
+        """
+
+        with self._lock:
+            if time.monotonic() - self._loaded_at > STATE_REFRESH_INTERVAL:
+                self._set_state(waiting_room_dao.get_waiting_room())
+            state = self._state
+
+        return state if state and state["is_open"] else None
+
+    def issue(self, user_id: int) -> Optional[QueueTicket]:
+        """
+        Assegna il prossimo numero di coda del processo, riservando un nuovo blocco se necessario
+
+        Parameters:
+            user_id (int): L'utente a cui è intestato il numero
+
+        Returns:
+            QueueTicket: Numero e coda assegnati, o None se la sala d'attesa è chiusa
+        """
+
+        with self._lock:
+            state = self._state
+            if (
+                state is None
+                or self._block_epoch != state["epoch"]
+                or self._next_serial >= self._block_end
+            ):
+                reserved = waiting_room_dao.reserve_queue_serials(SERIAL_BLOCK)
+                if reserved is None:
+                    self._set_state(waiting_room_dao.get_waiting_room())
+                    return None
+                first, state = reserved
+                self._set_state(state)
+                self._next_serial, self._block_end = first, first + SERIAL_BLOCK
+                self._block_epoch = state["epoch"]
+
+            serial = self._next_serial
+            self._next_serial += 1
+
+        metrics.WAITING_ROOM_TOKENS.inc()
+        return QueueTicket(serial, state["epoch"], user_id)
+
+    def position(self, state: Dict[str, Any], ticket: QueueTicket) -> Dict[str, Any]:
+        """
+        Posizione di un numero di coda rispetto al fronte di ammissione
+
+        Returns:
+            dict: admitted, numeri davanti (ahead), attesa stimata (wait) e
+                intervallo di polling suggerito (poll), in secondi
+        """
+
+        ahead = max(0, math.ceil(ticket.serial - frontier(state)))
+        wait = ahead / state["rate"]
+        return {
+            "admitted": ahead == 0,
+            "ahead": ahead,
+            "wait": math.ceil(wait),
+            "poll": max(MIN_POLL_INTERVAL, min(MAX_POLL_INTERVAL, math.ceil(wait / 4))),
+        }
+
+    def open(self, rate: float) -> Dict[str, Any]:
+        """Apre una nuova coda con il ritmo di ammissione indicato (utenti al secondo)"""
+
+        with self._lock:
+            state = waiting_room_dao.open_waiting_room(rate)
+            self._set_state(state)
+        return state
+
+    def set_rate(self, rate: float) -> Optional[Dict[str, Any]]:
+        """Modifica il ritmo di ammissione della coda aperta"""
+
+        with self._lock:
+            state = waiting_room_dao.set_waiting_room_rate(rate)
+            self._set_state(state or waiting_room_dao.get_waiting_room())
+        return state
+
+    def close(self) -> bool:
+        """Chiude la sala d'attesa"""
+
+        with self._lock:
+            closed = waiting_room_dao.close_waiting_room()
+            self._set_state(waiting_room_dao.get_waiting_room())
+        return closed
+
+    def status(self) -> Dict[str, Any]:
+        """Stato letto dal database, con il fronte di ammissione attuale"""
+
+        with self._lock:
+            self._set_state(waiting_room_dao.get_waiting_room())
+            state = self._state
+            block = [self._next_serial, self._block_end] if self._block_epoch is not None else None
+
+        if not state or not state["is_open"]:
+            return {"open": False}
+
+        current = frontier(state)
+        issued = state["next_serial"] - 1
+        return {
+            "open": True,
+            "epoch": state["epoch"],
+            "rate": state["rate"],
+            "frontier": math.floor(current),
+            "reserved": issued,
+            # Comprende i numeri dei blocchi riservati e non ancora assegnati
+            "waiting": max(0, issued - math.floor(current)),
+            "process_block": block,
+        }
+
+    def _set_state(self, state: Optional[Dict[str, Any]]) -> None:
+        self._state = state
+        self._loaded_at = time.monotonic()
+
+
+room = WaitingRoom()
@@ -0,0 +1,162 @@
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from utils.db import get_connection
+from utils.db_writer import writer
+from utils.logger import get_logger
+
+logger = get_logger()
+
+_COLUMNS = "is_open, epoch, rate, next_serial, base_serial, base_time"
+
+
+def _to_dict(row: Any) -> Dict[str, Any]:
+    return {
+        "is_open": bool(row[0]),
+        "epoch": row[1],
+        "rate": row[2],
+        "next_serial": row[3],
+        "base_serial": row[4],
+        "base_time": row[5],
+    }
+
+
+def _write_returning(query: str, params: Tuple[Any, ...]) -> Optional[Tuple[Any, ...]]:
+    def write(cursor: Any) -> Optional[Tuple[Any, ...]]:
+        cursor.execute(query, params)
+        return cursor.fetchone()
+
+    return writer.execute(write)
+
+
+def get_waiting_room() -> Optional[Dict[str, Any]]:
+    """
+    Restituisce lo stato della sala d'attesa
+
+    Returns:
+        dict: Dizionario con apertura, epoca, ritmo di ammissione, prossimo numero
+            da assegnare e riferimento del fronte di ammissione, o None se non è mai stata aperta
+    """
+
+    query = f"SELECT {_COLUMNS} FROM waiting_room WHERE id = 1"
+
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(query)
+    row = cursor.fetchone()
+    cursor.close()
+    conn.close()
+
+    return _to_dict(row) if row else None
+
+
+def open_waiting_room(rate: float) -> Dict[str, Any]:
+    """
+    Apre la sala d'attesa con una nuova coda: i token emessi in precedenza non sono più validi
+
+    Parameters:
+        rate (float): Utenti ammessi all'acquisto al secondo
+
+    Returns:
+        dict: Il nuovo stato della sala d'attesa
+    """
+
+    query = f"""
+    INSERT INTO waiting_room (id, is_open, epoch, rate, next_serial, base_serial, base_time)
+    VALUES (1, 1, 1, ?, 1, 0, ?)
+    ON CONFLICT (id) DO UPDATE SET
+        is_open = 1,
+        epoch = epoch + 1,
+        rate = excluded.rate,
+        next_serial = 1,
+        base_serial = 0,
+        base_time = excluded.base_time
+    RETURNING {_COLUMNS}
+    """
+
+    row = _write_returning(query, (rate, time.time()))
+
+    logger.info(f"Sala d'attesa aperta (coda {row[1]}), {rate:g} utenti ammessi al secondo")
+    return _to_dict(row)
+
+
+def set_waiting_room_rate(rate: float) -> Optional[Dict[str, Any]]:
+    """
+    Modifica il ritmo di ammissione della sala d'attesa aperta. Gli utenti già ammessi
+    restano ammessi: il fronte riparte dalla posizione raggiunta con il nuovo ritmo.
+
+    Parameters:
+        rate (float): Utenti ammessi all'acquisto al secondo
+
+    Returns:
+        dict: Il nuovo stato della sala d'attesa, o None se non è aperta
+    """
+
+    query = f"""
+    UPDATE waiting_room SET
+        base_serial = MIN(next_serial - 1, CAST(base_serial + (? - base_time) * rate AS INTEGER)),
+        base_time = ?,
+        rate = ?
+    WHERE id = 1 AND is_open = 1
+    RETURNING {_COLUMNS}
+    """
+
+    now = time.time()
+    row = _write_returning(query, (now, now, rate))
+
+    if row:
+        logger.info(f"Ritmo della sala d'attesa impostato a {rate:g} utenti al secondo")
+    return _to_dict(row) if row else None
+
+
+def close_waiting_room() -> bool:
+    """
+    Chiude la sala d'attesa: l'acquisto torna accessibile a tutti
+
+    Returns:
+        bool: True se la sala d'attesa era aperta
+    """
+
+    query = "UPDATE waiting_room SET is_open = 0 WHERE id = 1 AND is_open = 1"
+
+    closed = writer.execute(lambda cursor: cursor.execute(query).rowcount > 0)
+
+    if closed:
+        logger.info("Sala d'attesa chiusa")
+    return closed
+
+
+def reserve_queue_serials(count: int) -> Optional[Tuple[int, Dict[str, Any]]]:
+    """
+    Riserva un blocco di numeri di coda consecutivi, assegnati poi in memoria dal processo.
+    Se il fronte di ammissione ha già superato tutti i numeri assegnati (coda vuota) viene
+    riportato all'ultimo numero assegnato, così chi arriva dopo una pausa non entra in blocco.
+
+    Parameters:
+        count (int): Numeri da riservare
+
+    Returns:
+        int: Il primo numero del blocco
+        dict: Lo stato aggiornato della sala d'attesa
+        Oppure None se la sala d'attesa non è aperta
+    """
+
+    query = f"""
+    UPDATE waiting_room SET
+        base_time = CASE WHEN base_serial + (? - base_time) * rate >= next_serial - 1
+            THEN ? ELSE base_time END,
+        base_serial = CASE WHEN base_serial + (? - base_time) * rate >= next_serial - 1
+            THEN next_serial - 1 ELSE base_serial END,
+        next_serial = next_serial + ?
+    WHERE id = 1 AND is_open = 1
+    RETURNING {_COLUMNS}
+    """
+
+    now = time.time()
+    row = _write_returning(query, (now, now, now, count))
+
+    if not row:
+        return None
+
+    state = _to_dict(row)
+    return state["next_serial"] - count, state
@@ -1,21 +1,403 @@
-import logging
-# pip install waitress
-from waitress import serve
-from app import app
+# pip install -r requirements.txt (waitress è fissato alla versione verificata per l'arresto ordinato)
+import argparse
+import atexit
+import functools
+import os
+import select
+import signal
+import socket
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from waitress import wasyncore
+from waitress.server import create_server
 from werkzeug.middleware.proxy_fix import ProxyFix
 
-logging.basicConfig(
-    filename="server.log",
-    level=logging.INFO,
-    format="%(asctime)s %(levelname)s: %(message)s",
-)
+from utils.admission import DEFAULT_MAX_QUEUE_WAIT
+from utils.logger import get_logger, setup_logger
+from utils.vars import TEMPLATE_CACHE_PATH
 
+logger = get_logger()
 
-app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1, x_prefix=1)
+# Secondi concessi alle richieste in corso per terminare dopo SIGTERM
+DEFAULT_GRACEFUL_TIMEOUT = 30
+# Un worker terminato prima di questo tempo viene riavviato con un ritardo crescente
+MIN_WORKER_UPTIME = 5
+MAX_RESTART_DELAY = 30
+LISTEN_BACKLOG = 1024
 
 
-if __name__ == "__main__":
-    logging.info("Server starting up...")
+def load_app(max_concurrency: Optional[int] = None, max_queue_wait: Optional[float] = None) -> Any:
+    """
+    Importa l'applicazione e applica i middleware WSGI di produzione.
+
+    Parameters:
+        max_concurrency (int): Richieste servite contemporaneamente da ogni processo,
+            0 per disattivare il controllo di ammissione (default: SONOSPHERE_MAX_CONCURRENCY)
+        max_queue_wait (float): Attesa massima in coda in secondi prima di rispondere 503
+            (default: SONOSPHERE_MAX_QUEUE_WAIT)
+
+    Returns:
+        Flask: L'applicazione pronta per essere servita
+    """
+
+    from app import app
+
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1, x_prefix=1)
+
+    if max_concurrency is None:
+        max_concurrency = int(os.environ.get("SONOSPHERE_MAX_CONCURRENCY", 0))
+    if max_queue_wait is None:
+        max_queue_wait = float(os.environ.get("SONOSPHERE_MAX_QUEUE_WAIT", DEFAULT_MAX_QUEUE_WAIT))
+    if max_concurrency > 0:
+        from utils.admission import AdmissionController, AdmissionMiddleware
+
+        app.wsgi_app = AdmissionMiddleware(
+            app.wsgi_app, AdmissionController(max_concurrency, max_wait=max_queue_wait)
+        )
+
+    # Cattura del traffico per tools/replay.py, attiva solo se è indicato il file di destinazione
+    if os.environ.get("SONOSPHERE_TRAFFIC_CAPTURE"):
+        from utils.capture import TrafficCaptureMiddleware
+
+        app.wsgi_app = TrafficCaptureMiddleware(app.wsgi_app, os.environ["SONOSPHERE_TRAFFIC_CAPTURE"])
+
+    return app
+
+
+def listen(host: str, port: int) -> socket.socket:
+    """Crea il socket in ascolto, condiviso dai worker che lo ereditano con fork"""
+
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    return socket.create_server((host, port), family=family, backlog=LISTEN_BACKLOG)
+
+
+class _GracefulServer:
+    """
+    Raccoglie in un solo punto gli interni di waitress usati per l'arresto ordinato
+    (mappa dei canali, passo del ciclo wasyncore, accept, dispatcher dei task), verificati
+    con la versione fissata in requirements.txt. Se la versione installata non li espone,
+    supported è False e il worker usa solo l'API pubblica (run e close), senza attendere
+    le richieste in corso.
+    """
+
+    _SERVER_ATTRIBUTES = ("_map", "adj", "accepting", "handle_accept", "active_channels", "task_dispatcher")
+
+    def __init__(self, server: Any) -> None:
+        self.server = server
+        self.supported = (
+            all(hasattr(server, name) for name in self._SERVER_ATTRIBUTES)
+            and hasattr(server.adj, "asyncore_loop_timeout")
+            and hasattr(server.adj, "asyncore_use_poll")
+            and hasattr(server.task_dispatcher, "shutdown")
+            and hasattr(wasyncore, "loop")
+            and hasattr(wasyncore, "close_all")
+        )
+
+    def loop_once(self) -> None:
+        """Esegue un solo passo del ciclo di waitress"""
+
+        wasyncore.loop(
+            timeout=self.server.adj.asyncore_loop_timeout,
+            map=self.server._map,
+            use_poll=self.server.adj.asyncore_use_poll,
+            count=1,
+        )
+
+    def accept_pending(self, sock: socket.socket, deadline: float) -> None:
+        """Accetta le connessioni già in coda sul socket, poi smette di accettarne"""
+
+        while time.monotonic() < deadline and select.select([sock], [], [], 0)[0]:
+            self.server.handle_accept()
+        self.server.accepting = False
+
+    def busy(self) -> bool:
+        """True se qualche connessione ha una richiesta in corso o una risposta da inviare"""
+
+        return any(
+            getattr(channel, "requests", None) or getattr(channel, "total_outbufs_len", 0)
+            for channel in list(self.server.active_channels.values())
+        )
+
+    def shutdown(self, deadline: float) -> None:
+        """Attende i thread delle richieste fino a deadline e chiude tutte le connessioni"""
+
+        self.server.task_dispatcher.shutdown(timeout=max(0.0, deadline - time.monotonic()))
+        wasyncore.close_all(self.server._map)
+
+    def close(self) -> None:
+        """Arresto con la sola API pubblica di waitress"""
+
+        try:
+            self.server.close()
+        except Exception:
+            logger.exception("Errore durante la chiusura del server")
+
+
+def run_worker(app: Any, sock: socket.socket, threads: int, graceful_timeout: float) -> None:
+    """
+    Serve l'applicazione con waitress sul socket indicato fino a SIGTERM o SIGINT.
+
+    Alla ricezione del segnale il worker smette di accettare connessioni, attende
+    fino a graceful_timeout secondi che le richieste in corso terminino e si ferma.
+    """
+
+    server = create_server(app, sockets=[sock], threads=threads)
+    graceful = _GracefulServer(server)
+
+    if not graceful.supported:
+        logger.warning(
+            "Versione di waitress non supportata per l'arresto ordinato: "
+            "le richieste in corso verranno interrotte all'arresto"
+        )
+
+        # server.run() intercetta SystemExit e ferma i thread delle richieste
+        def _exit(signum, frame):
+            raise SystemExit(0)
+
+        signal.signal(signal.SIGTERM, _exit)
+        signal.signal(signal.SIGINT, _exit)
+        try:
+            server.run()
+        finally:
+            graceful.close()
+        return
+
+    stopping = threading.Event()
 
-    serve(app, host="0.0.0.0", port=5000, threads=4)
-    logging.info("Server shutting down...")
+    def _stop(signum, frame):
+        stopping.set()
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    try:
+        # Il ciclo di waitress viene eseguito un passo alla volta per poter controllare l'arresto
+        while not stopping.is_set():
+            graceful.loop_once()
+
+        deadline = time.monotonic() + graceful_timeout
+        # Le connessioni già in coda sul socket vengono accettate e servite prima di chiuderlo
+        graceful.accept_pending(sock, deadline)
+        while time.monotonic() < deadline and graceful.busy():
+            graceful.loop_once()
+
+        graceful.shutdown(deadline)
+    except AttributeError:
+        # Interni di waitress cambiati in modo non rilevato dal controllo iniziale
+        logger.exception("Arresto ordinato non riuscito, chiusura del server")
+        graceful.close()
+
+
+class Supervisor:
+    """
+    Processo principale della modalità multi-processo: crea i worker con fork,
+    li riavvia se terminano inaspettatamente e li ferma in modo ordinato.
+    """
+
+    def __init__(
+        self,
+        sock: socket.socket,
+        workers: int,
+        threads: int,
+        graceful_timeout: float,
+        loader: Callable[[], Any],
+        app: Optional[Any] = None,
+    ) -> None:
+        self.sock = sock
+        self.workers = workers
+        self.threads = threads
+        self.graceful_timeout = graceful_timeout
+        # Caricamento dell'applicazione nei worker, se non è già stata caricata (--preload)
+        self.loader = loader
+        self.app = app
+        self.children: Dict[int, int] = {}
+        self._started: Dict[int, float] = {}
+        self._restart_delay: Dict[int, float] = {}
+        # Worker terminati in attesa di riavvio: indice -> istante (monotonic) del riavvio
+        self._restart_at: Dict[int, float] = {}
+        self._stopping = False
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        for index in range(self.workers):
+            self._spawn(index)
+
+        while not self._stopping:
+            self._reap()
+            self._restart_due()
+            time.sleep(0.2)
+
+        self._shutdown()
+
+    def _spawn(self, index: int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                app = self.app if self.app is not None else self.loader()
+                logger.info(f"Worker {index} avviato (pid {os.getpid()}, {self.threads} thread)")
+                run_worker(app, self.sock, self.threads, self.graceful_timeout)
+                logger.info(f"Worker {index} fermato (pid {os.getpid()})")
+            except BaseException:
+                logger.exception(f"Errore nel worker {index} (pid {os.getpid()})")
+                code = 1
+            finally:
+                # os._exit non esegue atexit: log e cattura del traffico vanno svuotati qui
+                atexit._run_exitfuncs()
+                os._exit(code)
+
+        self.children[pid] = index
+        self._started[index] = time.monotonic()
+
+    def _reap(self) -> None:
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+
+            index = self.children.pop(pid)
+            if self._stopping:
+                continue
+
+            uptime = time.monotonic() - self._started[index]
+            if uptime < MIN_WORKER_UPTIME:
+                delay = min(MAX_RESTART_DELAY, max(1.0, self._restart_delay.get(index, 0.5) * 2))
+            else:
+                delay = 0.0
+            self._restart_delay[index] = delay
+
+            logger.warning(
+                f"Worker {index} (pid {pid}) terminato con stato {os.waitstatus_to_exitcode(status)} "
+                f"dopo {uptime:.1f} s, riavvio tra {delay:.0f} s"
+            )
+            # Il riavvio avviene nel ciclo principale (_restart_due): un'attesa qui bloccherebbe
+            # l'arresto e la raccolta degli altri worker
+            self._restart_at[index] = time.monotonic() + delay
+
+    def _restart_due(self) -> None:
+        now = time.monotonic()
+        for index, restart_at in list(self._restart_at.items()):
+            if restart_at <= now and not self._stopping:
+                del self._restart_at[index]
+                self._spawn(index)
+
+    def _stop(self, signum, frame) -> None:
+        self._stopping = True
+
+    def _shutdown(self) -> None:
+        logger.info(f"Arresto dei worker, attesa massima {self.graceful_timeout:g} s")
+        for pid in self.children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+        deadline = time.monotonic() + self.graceful_timeout + 5
+        while self.children and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.1)
+
+        for pid, index in list(self.children.items()):
+            logger.warning(f"Worker {index} (pid {pid}) non terminato in tempo, SIGKILL")
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+        self.children.clear()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Avvia Sonosphere con waitress")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--threads", type=int, default=4, help="thread di waitress per ogni worker")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="processi worker che condividono il socket (con 1 il server gira nel processo principale)",
+    )
+    parser.add_argument(
+        "--preload",
+        action="store_true",
+        help="carica l'applicazione prima del fork, condivisa copy-on-write tra i worker",
+    )
+    parser.add_argument(
+        "--graceful-timeout",
+        type=float,
+        default=DEFAULT_GRACEFUL_TIMEOUT,
+        help="secondi concessi alle richieste in corso all'arresto",
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=int(os.environ.get("SONOSPHERE_MAX_CONCURRENCY", 0)),
+        help="richieste servite contemporaneamente da ogni worker, oltre si va in coda (0 = nessun limite)",
+    )
+    parser.add_argument(
+        "--max-queue-wait",
+        type=float,
+        default=float(os.environ.get("SONOSPHERE_MAX_QUEUE_WAIT", DEFAULT_MAX_QUEUE_WAIT)),
+        help="secondi massimi di attesa in coda prima di rispondere 503",
+    )
+    parser.add_argument(
+        "--compile-templates",
+        action="store_true",
+        help="popola la cache del bytecode dei template ed esce (fase di deploy)",
+    )
+    args = parser.parse_args()
+
+    if args.compile_templates:
+        # I template vengono precompilati nella cache durante l'import di app
+        load_app()
+        logger.info(f"Cache dei template popolata in {TEMPLATE_CACHE_PATH}")
+        return
+
+    if args.workers > 1 and not hasattr(os, "fork"):
+        parser.error("--workers richiede un sistema con fork")
+
+    setup_logger()
+
+    if args.workers > 1 and os.environ.get("SONOSPHERE_TRAFFIC_CAPTURE") and not args.preload:
+        # Sale e istante di inizio della cattura devono essere comuni a tutti i worker
+        logger.info("La cattura del traffico con più worker richiede --preload: attivato")
+        args.preload = True
+
+    if 0 < args.max_concurrency and args.threads <= args.max_concurrency:
+        # Le richieste in coda occupano un thread di waitress: servono thread oltre la capacità
+        logger.warning(
+            f"--threads ({args.threads}) non supera --max-concurrency ({args.max_concurrency}): "
+            "le richieste in eccesso resteranno nella coda di waitress invece di ricevere 503"
+        )
+
+    sock = listen(args.host, args.port)
+    logger.info(
+        f"Server starting up on {args.host}:{args.port} with {args.workers} worker(s), "
+        f"{args.threads} threads each"
+    )
+
+    if args.workers == 1:
+        app = load_app(args.max_concurrency, args.max_queue_wait)
+        run_worker(app, sock, args.threads, args.graceful_timeout)
+    else:
+        loader = functools.partial(load_app, args.max_concurrency, args.max_queue_wait)
+        # Con --preload l'applicazione è condivisa copy-on-write con i worker
+        app = loader() if args.preload else None
+        Supervisor(sock, args.workers, args.threads, args.graceful_timeout, loader, app).run()
+
+    sock.close()
+    logger.info("Server shutting down...")
+
+
+if __name__ == "__main__":
+    main()
+else:
+    app = load_app()